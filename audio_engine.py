@@ -0,0 +1,641 @@
+import os
+import time
+import wave
+import queue
+import shutil
+import threading
+import subprocess
+import logging
+from collections import deque
+
+import numpy as np
+
+# --- PCM Audio Engine ---
+#
+#   synthesis workers: provider audio --decode()--> DecodedClip --prepare()--> trimmed / normalized / envelope
+#   playback stage:    PlaybackChannel.play(clip) --> feeder thread --> PcmRingBuffer (one per channel)
+#   output:            sink (one persistent stream) --render()--> mix of all channel rings
+#
+# Only float32 frames at the engine's sample rate reach the output side: all
+# decoding (ffmpeg), resampling and analysis happens before play(), off the
+# playback and audio threads. Each channel (one per stream) has its own ring,
+# so several streams mix into the same device.
+
+ENVELOPE_STEP_MS = 50 # One envelope level (0-100) per 50ms of audio, see AudioEngine.prepare
+
+
+# --- Decoded Clips ---
+class DecodedClip:
+    """
+    float32 PCM, shape (frames, channels), at the engine's sample rate. A clip
+    decoded from a stream grows while the decoder runs: the playback channel
+    takes chunks as they arrive and finish() marks the end.
+    """
+    def __init__(self, sample_rate, channels, samples=None, source=None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = 0
+        self.envelope = None # Levels 0-100, one per ENVELOPE_STEP_MS (complete clips only)
+        self.rate = 1.0 # Speed-up applied by AudioEngine.prepare()
+        self.error = None
+        self._chunks = deque()
+        self._finished = threading.Event()
+        self._source = source # ByteRingBuffer a streamed clip is decoded from
+        if samples is not None:
+            self.append(samples)
+            self.finish()
+
+    def append(self, samples):
+        if len(samples):
+            self._chunks.append(samples)
+            self.frames += len(samples)
+
+    def finish(self, error=None):
+        self.error = error
+        self._finished.set()
+
+    @property
+    def complete(self):
+        return self._finished.is_set()
+
+    @property
+    def exhausted(self):
+        """All chunks handed out and nothing more coming."""
+        return self._finished.is_set() and not self._chunks
+
+    @property
+    def duration_s(self):
+        return self.frames / self.sample_rate if self.complete else None
+
+    def samples(self):
+        """All frames of a complete clip as one array (before playback)."""
+        if len(self._chunks) != 1:
+            merged = np.concatenate(self._chunks) if self._chunks else np.zeros((0, self.channels), np.float32)
+            self.replace(merged)
+        return self._chunks[0]
+
+    def replace(self, samples):
+        self._chunks.clear()
+        self._chunks.append(samples)
+        self.frames = len(samples)
+
+    def next_chunk(self):
+        """The next chunk, or None if none is waiting (yet)."""
+        try:
+            return self._chunks.popleft()
+        except IndexError:
+            return None
+
+    def cancel(self):
+        """The clip won't be played: stop the download and decoder feeding a streamed clip."""
+        if self._source is not None:
+            self._source.close()
+
+
+# --- Decoding ---
+def pcm_to_float(data, sample_width, channels):
+    """Interleaved integer PCM bytes -> float32 frames in [-1, 1]."""
+    if sample_width == 1:
+        samples = (np.frombuffer(data, np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(data, "<i2").astype(np.float32) / 32768.0
+    elif sample_width == 4:
+        samples = np.frombuffer(data, "<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"Unsupported PCM sample width: {sample_width}")
+    samples = samples[:len(samples) - len(samples) % channels]
+    return samples.reshape(-1, channels)
+
+
+def convert(samples, src_rate, sample_rate, channels):
+    """Channel up/down-mix and linear resampling to the engine format."""
+    if samples.shape[1] != channels:
+        mono = samples.mean(axis=1, keepdims=True)
+        samples = mono if channels == 1 else np.repeat(mono, channels, axis=1)
+    if src_rate != sample_rate and len(samples):
+        frames = int(round(len(samples) * sample_rate / src_rate))
+        positions = np.arange(frames) * (src_rate / sample_rate)
+        source = np.arange(len(samples))
+        samples = np.stack([np.interp(positions, source, samples[:, c]) for c in range(channels)], axis=1)
+    return np.ascontiguousarray(samples, dtype=np.float32)
+
+
+def _ffmpeg_args(sample_rate, channels, streaming=False):
+    if not shutil.which("ffmpeg"):
+        raise ValueError("ffmpeg not found, necessary to decode audio for the audio engine.")
+    args = ["ffmpeg", "-loglevel", "quiet"]
+    if streaming:
+        # Small probe/analyze sizes stop ffmpeg from buffering before it starts decoding.
+        args += ["-fflags", "nobuffer", "-probesize", "32", "-analyzeduration", "0"]
+    return args + ["-i", "-", "-f", "f32le", "-ac", str(channels), "-ar", str(sample_rate), "-"]
+
+
+def decode_bytes(data, sample_rate, channels):
+    """Decode a complete compressed clip (MP3, WAV...) with ffmpeg."""
+    proc = subprocess.run(_ffmpeg_args(sample_rate, channels), input=bytes(data),
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    samples = np.frombuffer(proc.stdout, np.float32)
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+    return DecodedClip(sample_rate, channels, samples)
+
+
+def decode_stream(buffer, sample_rate, channels, read_size=4096):
+    """
+    Decode a ByteRingBuffer (StreamingClip.buffer) while it is still filling.
+    ffmpeg runs in the background and decoded frames are appended to the
+    returned clip as they come out, so playback can start on the first ones.
+    """
+    proc = subprocess.Popen(_ffmpeg_args(sample_rate, channels, streaming=True), stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    clip = DecodedClip(sample_rate, channels, source=buffer)
+
+    def pump_in():
+        try:
+            while True:
+                data = buffer.read(read_size)
+                if not data:
+                    break
+                proc.stdin.write(data)
+                proc.stdin.flush()
+        except OSError:
+            buffer.close() # ffmpeg died; stop the download
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    def pump_out():
+        frame_bytes = 4 * channels
+        pending = b""
+        fd = proc.stdout.fileno()
+        while True:
+            data = os.read(fd, 16384) # Whatever is decoded so far, don't wait for a full read
+            if not data:
+                break
+            pending += data
+            usable = len(pending) - len(pending) % frame_bytes
+            if usable:
+                clip.append(np.frombuffer(pending[:usable], np.float32).reshape(-1, channels))
+                pending = pending[usable:]
+        proc.stdout.close()
+        proc.wait()
+        clip.finish(buffer.error)
+
+    threading.Thread(target=pump_in, name="audio-decode-in", daemon=True).start()
+    threading.Thread(target=pump_out, name="audio-decode-out", daemon=True).start()
+    return clip
+
+
+# --- Clip Analysis (runs in prepare(), off the playback thread) ---
+def trim_silence(samples, threshold, pad_frames):
+    """Cut leading/trailing near-silence (MP3 encoder padding, TTS lead-in) down to pad_frames."""
+    loud = np.flatnonzero(np.abs(samples).max(axis=1) > threshold)
+    if not len(loud):
+        return samples
+    return samples[max(0, loud[0] - pad_frames):min(len(samples), loud[-1] + 1 + pad_frames)]
+
+
+def normalize(samples, target_dbfs, max_gain_db):
+    """Scale to target RMS loudness (dBFS), limited by max_gain_db and the peak level."""
+    if not len(samples):
+        return samples
+    rms = float(np.sqrt(np.mean(np.square(samples))))
+    peak = float(np.abs(samples).max())
+    if rms < 1e-5:
+        return samples
+    gain = min(10 ** (target_dbfs / 20) / rms, 10 ** (max_gain_db / 20), 0.99 / peak)
+    return samples * np.float32(gain)
+
+
+def envelope(samples, sample_rate):
+    """RMS level per ENVELOPE_STEP_MS window, scaled so the loudest window is 100."""
+    window = max(1, sample_rate * ENVELOPE_STEP_MS // 1000)
+    if not len(samples):
+        return []
+    mono = samples.mean(axis=1)
+    padded = np.zeros(-(-len(mono) // window) * window, np.float32)
+    padded[:len(mono)] = mono
+    levels = np.sqrt(np.mean(np.square(padded.reshape(-1, window)), axis=1))
+    top = float(levels.max())
+    if top <= 0:
+        return [0] * len(levels)
+    return [int(round(v)) for v in levels / top * 100]
+
+
+def time_stretch(samples, sample_rate, rate, frame_ms=40, search_ms=10):
+    """
+    Play `rate` times faster without changing pitch (WSOLA): frames are taken
+    at the nominal input position, nudged within +-search_ms to the offset whose
+    waveform best continues the previous frame, and overlap-added.
+    """
+    frame = int(sample_rate * frame_ms / 1000) // 2 * 2
+    hop = frame // 2
+    search = int(sample_rate * search_ms / 1000)
+    if rate == 1.0 or len(samples) < 2 * frame + search:
+        return samples
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)).astype(np.float32)[:, None] # Sums to 1 at 50% overlap
+    step = max(1, sample_rate // 11025) # Match on a decimated mono signal, the search doesn't need full resolution
+    mono = samples.mean(axis=1)
+    last_start = len(samples) - frame
+    frames_out = int((len(samples) / rate - frame) // hop) + 1
+    out = np.zeros(((frames_out - 1) * hop + frame, samples.shape[1]), np.float32)
+    pos = 0
+    for k in range(frames_out):
+        if k:
+            target = min(int(k * hop * rate), last_start)
+            natural = pos + hop # Where the previous frame's waveform continues
+            lo, hi = max(0, target - search), min(last_start, target + search)
+            if natural + hop <= len(mono) and hi > lo:
+                ref = mono[natural:natural + hop:step]
+                region = mono[lo:hi + hop:step]
+                pos = lo + int(np.argmax(np.correlate(region, ref, mode="valid"))) * step
+            else:
+                pos = target
+        out[k * hop:k * hop + frame] += samples[pos:pos + frame] * window
+    return out
+
+
+# --- Ring Buffer ---
+class PcmRingBuffer:
+    """
+    Single-producer / single-consumer ring of float32 frames. The producer
+    (feeder thread) only advances `written` and the consumer (audio callback)
+    only advances `read`, each after its copy is done, so neither side takes
+    a lock: a plain int assignment is atomic under the GIL.
+    """
+    def __init__(self, frames, channels):
+        self.capacity = int(frames)
+        self._buf = np.zeros((self.capacity, channels), np.float32)
+        self.written = 0 # Total frames ever written (producer only)
+        self.read = 0    # Total frames ever read (consumer only)
+
+    def available(self):
+        return self.written - self.read
+
+    def free(self):
+        return self.capacity - (self.written - self.read)
+
+    def write(self, frames):
+        """Copies as many frames as fit; returns the count."""
+        n = min(len(frames), self.free())
+        if n <= 0:
+            return 0
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = frames[:first]
+        if n > first:
+            self._buf[:n - first] = frames[first:n]
+        self.written += n
+        return n
+
+    def read_into(self, out):
+        """Fills out[:n] with up to len(out) frames; returns n."""
+        n = min(len(out), self.available())
+        if n <= 0:
+            return 0
+        start = self.read % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._buf[start:start + first]
+        if n > first:
+            out[first:n] = self._buf[:n - first]
+        self.read += n
+        return n
+
+
+# --- Playback Channels ---
+class _Playback:
+    __slots__ = ("clip", "done")
+
+    def __init__(self, clip):
+        self.clip = clip
+        self.done = threading.Event()
+
+
+class PlaybackChannel:
+    """
+    One stream's voice in the mix. play() hands a clip to the feeder thread,
+    which writes it into this channel's ring right behind the previous clip
+    (gapless, optionally crossfaded) and returns lead_s before the clip ends,
+    so the pipeline can queue the next one while the output is still busy.
+    """
+    def __init__(self, engine, name, volume=1.0):
+        self.engine = engine
+        self.name = name
+        self.volume = float(volume)
+        self.sample_rate = engine.sample_rate
+        self.channels = engine.channels
+        self.ring = PcmRingBuffer(engine.sample_rate * engine.buffer_s, engine.channels)
+        self.level = 0.0 # RMS of the last block this channel put into the mix
+        self.clips_played = 0
+        self.underruns = 0 # Blocks the output needed while a clip was playing but the ring ran dry
+        self._busy = False # Feeder has a clip in flight (read by the audio thread)
+        self._clips = queue.Queue()
+        self._scratch = np.zeros((engine.block_frames, engine.channels), np.float32)
+        self._thread = threading.Thread(target=self._feed, name=f"audio-feed-{name}", daemon=True)
+        self._thread.start()
+
+    # --- Pipeline Side ---
+    @property
+    def ready(self):
+        """False until the engine's output is open: clips are left to the provider until then."""
+        return self.engine.ready.is_set()
+
+    def accepts(self, audio):
+        return isinstance(audio, DecodedClip)
+
+    def prepare(self, clip, rate=1.0):
+        return self.engine.prepare(clip, rate)
+
+    def cues(self, clip):
+        """Overlay START fields: expected output latency (ms) and the clip's level envelope."""
+        cues = {"lat": round(self.latency_s() * 1000)}
+        if clip.envelope:
+            cues["env"] = clip.envelope
+        return cues
+
+    def latency_s(self):
+        """Audio already queued ahead of a clip handed over now, plus the device's own latency."""
+        return self.ring.available() / self.sample_rate + self.engine.sink.latency_s
+
+    def play(self, clip):
+        """Queue a clip behind the current one and wait until it has nearly finished (BLOCKING)."""
+        playback = _Playback(clip)
+        self._clips.put(playback)
+        while not playback.done.wait(0.5):
+            if self.engine.stopped:
+                return
+        if clip.error is not None:
+            raise clip.error
+
+    # --- Feeder Thread ---
+    def _feed(self):
+        engine = self.engine
+        tick = engine.block_frames / engine.sample_rate / 2
+        current = None # _Playback being written
+        pending = np.zeros((0, self.channels), np.float32) # Received frames of `current` not written yet
+        tail = None    # End of the previous clip held back to crossfade into the next one
+        releases = deque() # (ring frame, _Playback): release play() once the output reaches that frame
+        while not engine.stopped:
+            while releases and self.ring.read >= releases[0][0]:
+                releases.popleft()[1].done.set()
+            if current is None:
+                try:
+                    current = self._clips.get(timeout=0 if (tail is not None or releases) else tick)
+                except queue.Empty:
+                    current = None
+            self._busy = current is not None or tail is not None or bool(releases)
+
+            if current is not None:
+                clip = current.clip
+                chunk = clip.next_chunk()
+                while chunk is not None:
+                    pending = np.concatenate((pending, chunk)) if len(pending) else chunk
+                    chunk = clip.next_chunk()
+                finished = clip.exhausted
+                if tail is not None and (len(pending) >= len(tail) or finished):
+                    pending = self._crossfade(tail, pending)
+                    tail = None
+                if tail is None:
+                    # Hold back the last crossfade_frames: they become the tail once the clip ends
+                    hold = min(engine.crossfade_frames, clip.frames // 2) if finished else engine.crossfade_frames
+                    body = max(0, len(pending) - hold)
+                    written = self.ring.write(pending[:body])
+                    pending = pending[written:]
+                    if finished and written >= body:
+                        tail = pending if len(pending) else None
+                        pending = np.zeros((0, self.channels), np.float32)
+                        releases.append((max(0, self.ring.written - engine.lead_frames), current))
+                        self.clips_played += 1
+                        current = None
+                        continue
+
+            if tail is not None and self.ring.available() < engine.lead_frames // 2:
+                # Nothing to crossfade into before the output runs dry: play the tail as is.
+                tail = tail[self.ring.write(tail):]
+                if not len(tail):
+                    tail = None
+            time.sleep(tick)
+
+        for _, playback in releases:
+            playback.done.set()
+        if current is not None:
+            current.done.set()
+
+    def _crossfade(self, tail, head):
+        """Equal-power crossfade of the previous clip's tail into the start of the next clip."""
+        n = min(len(tail), len(head))
+        ramp = np.linspace(0.0, np.pi / 2, n, dtype=np.float32)[:, None]
+        mixed = tail[:n] * np.cos(ramp) + head[:n] * np.sin(ramp)
+        return np.concatenate((mixed, tail[n:], head[n:])) if len(tail) > n else np.concatenate((mixed, head[n:]))
+
+    # --- Audio Thread Side ---
+    def mix_into(self, out):
+        frames = len(out)
+        if len(self._scratch) < frames:
+            self._scratch = np.zeros((frames, self.channels), np.float32)
+        scratch = self._scratch[:frames]
+        n = self.ring.read_into(scratch)
+        if n < frames and self._busy:
+            self.underruns += 1
+        if n:
+            block = scratch[:n] * np.float32(self.volume)
+            out[:n] += block
+            self.level = float(np.sqrt(np.mean(np.square(block))))
+        else:
+            self.level = 0.0
+
+    def stats(self):
+        return {
+            "clips": self.clips_played,
+            "underruns": self.underruns,
+            "buffered_ms": round(self.ring.available() / self.sample_rate * 1000),
+            "level": round(self.level, 4),
+            "volume": self.volume,
+        }
+
+
+# --- Engine ---
+class AudioEngine:
+    """
+    Mixes every PlaybackChannel into one persistent output (the sink).
+    prepare() trims, normalizes and analyzes decoded clips; it runs in the
+    synthesis workers so the output side only copies and adds frames.
+    """
+    def __init__(self, sink, sample_rate=44100, channels=1, block_frames=512, buffer_s=1.0, lead_s=0.1,
+                 crossfade_ms=0, normalize_dbfs=-18.0, max_gain_db=12.0, trim=True, volume=1.0):
+        self.sink = sink
+        self.sample_rate = int(sample_rate)
+        self.channels = int(channels)
+        self.block_frames = int(block_frames)
+        self.buffer_s = float(buffer_s)
+        self.lead_frames = int(lead_s * self.sample_rate)
+        self.crossfade_frames = int(crossfade_ms / 1000 * self.sample_rate)
+        self.normalize_dbfs = normalize_dbfs # None = play at the provider's level
+        self.max_gain_db = float(max_gain_db)
+        self.trim = trim
+        self.volume = float(volume) # Master volume
+        self.level = 0.0 # RMS of the last output block
+        self.blocks_rendered = 0
+        self._channels = {}
+        self._channel_list = () # Replaced, never mutated, so render() iterates without a lock
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.ready = threading.Event() # Set once the sink is open
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def channel(self, name, volume=1.0):
+        """The named channel (one per stream), created on first use."""
+        with self._lock:
+            channel = self._channels.get(name)
+            if channel is None:
+                channel = self._channels[name] = PlaybackChannel(self, name, volume)
+                self._channel_list = tuple(self._channels.values())
+            return channel
+
+    def prepare(self, clip, rate=1.0):
+        """
+        Trim silence, speed up by `rate` (pitch unchanged), normalize loudness
+        and compute the level envelope of a complete clip.
+        """
+        if not clip.complete or clip.error is not None:
+            return clip # Streamed: frames are played as they are decoded, at the provider's level and speed
+        samples = clip.samples()
+        if self.trim:
+            samples = trim_silence(samples, threshold=10 ** (-50 / 20), pad_frames=self.sample_rate // 100)
+        if rate != 1.0:
+            samples = time_stretch(samples, self.sample_rate, rate)
+            clip.rate = rate
+        if self.normalize_dbfs is not None:
+            samples = normalize(samples, self.normalize_dbfs, self.max_gain_db)
+        clip.replace(np.ascontiguousarray(samples, dtype=np.float32))
+        clip.envelope = envelope(samples, self.sample_rate)
+        return clip
+
+    def render(self, frames):
+        """Called by the sink for every output block (audio thread)."""
+        out = np.zeros((frames, self.channels), np.float32)
+        for channel in self._channel_list:
+            channel.mix_into(out)
+        if self.volume != 1.0:
+            out *= np.float32(self.volume)
+        np.clip(out, -1.0, 1.0, out=out)
+        self.level = float(np.sqrt(np.mean(np.square(out)))) if frames else 0.0
+        self.blocks_rendered += 1
+        return out
+
+    def start(self):
+        self.sink.start(self)
+        self.ready.set()
+        logging.info(f"Audio engine started ({self.sink.__class__.__name__}, {self.sample_rate}Hz, "
+                     f"{self.channels}ch, {self.block_frames}-frame blocks)")
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self.sink.stop()
+
+    def stats(self):
+        return {
+            "sink": self.sink.__class__.__name__,
+            "ready": self.ready.is_set(),
+            "level": round(self.level, 4),
+            "blocks": self.blocks_rendered,
+            "channels": {name: channel.stats() for name, channel in self._channels.items()},
+        }
+
+
+# --- Sinks ---
+class NullSink:
+    """Pulls the mix at the real-time rate and discards it: headless runs and tests."""
+    latency_s = 0.0
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, engine):
+        self._thread = threading.Thread(target=self._run, args=(engine,), name="audio-sink", daemon=True)
+        self._thread.start()
+
+    def _run(self, engine):
+        period = engine.block_frames / engine.sample_rate
+        next_at = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                self.write(engine.render(engine.block_frames))
+                next_at += period
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    self._stop.wait(delay)
+                elif delay < -4 * period:
+                    next_at = time.monotonic() # Fell far behind (suspended?): don't burst to catch up
+        finally:
+            self.close()
+
+    def write(self, block):
+        pass
+
+    def close(self):
+        """Called by the render thread once it has written its last block."""
+        pass
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+
+class FileSink(NullSink):
+    """NullSink that also records the mix to a 16-bit WAV file."""
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._wav = None
+
+    def start(self, engine):
+        self._wav = wave.open(self.path, "wb")
+        self._wav.setnchannels(engine.channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(engine.sample_rate)
+        super().start(engine)
+
+    def write(self, block):
+        self._wav.writeframes((block * 32767).astype("<i2").tobytes())
+
+    def close(self):
+        # Only the render thread closes the file, so a slow stop() can't pull it from under a write
+        self._wav.close()
+
+
+class SoundDeviceSink:
+    """One persistent PortAudio output stream; its callback thread pulls the mix."""
+    def __init__(self, device=None, latency="low"):
+        self.device = device
+        self.latency = latency
+        self.latency_s = 0.0
+        self.xruns = 0
+        self._stream = None
+
+    def start(self, engine):
+        import sounddevice as sd
+
+        def callback(outdata, frames, time_info, status):
+            if status:
+                self.xruns += 1
+            outdata[:] = engine.render(frames)
+
+        self._stream = sd.OutputStream(samplerate=engine.sample_rate, channels=engine.channels, dtype="float32",
+                                       blocksize=engine.block_frames, device=self.device, latency=self.latency,
+                                       callback=callback)
+        self._stream.start()
+        self.latency_s = float(self._stream.latency)
+
+    def stop(self):
+        if self._stream:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
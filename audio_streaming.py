@@ -0,0 +1,166 @@
+import time
+import shutil
+import threading
+import subprocess
+import logging
+
+# --- Bounded Byte Ring Buffer ---
+class ByteRingBuffer:
+    """
+    Fixed-capacity circular byte buffer between one producer and one consumer.
+    write() blocks while the buffer is full, read() blocks until data arrives
+    or the producer calls close(). This keeps memory bounded no matter how far
+    the network runs ahead of playback.
+    """
+    def __init__(self, capacity=512 * 1024):
+        self.capacity = int(capacity)
+        self._buf = bytearray(self.capacity)
+        self._start = 0 # Read position
+        self._size = 0  # Bytes currently stored
+        self._closed = False
+        self.error = None # Set by the producer if the source failed
+        self._cond = threading.Condition()
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view):
+            with self._cond:
+                while self._size == self.capacity and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                end = (self._start + self._size) % self.capacity
+                n = min(len(view), self.capacity - self._size, self.capacity - end)
+                self._buf[end:end + n] = view[:n]
+                self._size += n
+                self._cond.notify_all()
+            view = view[n:]
+
+    def read(self, max_bytes=4096):
+        """Returns up to max_bytes, or b'' once the buffer is closed and drained."""
+        with self._cond:
+            while self._size == 0 and not self._closed:
+                self._cond.wait()
+            if self._size == 0:
+                return b""
+            n = min(max_bytes, self._size, self.capacity - self._start)
+            data = bytes(self._buf[self._start:self._start + n])
+            self._start = (self._start + n) % self.capacity
+            self._size -= n
+            self._cond.notify_all()
+            return data
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self, error=None):
+        with self._cond:
+            self._closed = True
+            if error is not None:
+                self.error = error
+            self._cond.notify_all()
+
+
+# --- Streaming Clip ---
+class StreamingClip:
+    """
+    An in-flight audio stream. A background thread pulls chunks from the
+    provider's iterator into a ByteRingBuffer as soon as the clip is created,
+    so playback can start on the first chunk while the rest is still arriving.
+    """
+    def __init__(self, chunk_iterator, text="", buffer_bytes=512 * 1024, on_complete=None):
+        self.text = text
+        self._on_complete = on_complete # Called with the full clip bytes once the stream ends cleanly
+        self._complete_data = None # Full clip bytes once the stream ended cleanly
+        self._lock = threading.Lock()
+        self._chunks = []
+        self.requested_at = time.monotonic()
+        self.first_chunk_at = None
+        self.first_chunk = threading.Event() # Set on the first chunk, or when the stream ends/fails without one
+        self.bytes_received = 0
+        self.buffer = ByteRingBuffer(buffer_bytes)
+        self._thread = threading.Thread(target=self._fill, args=(chunk_iterator,),
+                                        name="tts-stream-reader", daemon=True)
+        self._thread.start()
+
+    def _fill(self, chunk_iterator):
+        try:
+            for chunk in chunk_iterator:
+                if self.buffer.closed:
+                    return # Cancelled: stop downloading, nothing to hand to on_complete
+                if not chunk:
+                    continue
+                if self.first_chunk_at is None:
+                    self.first_chunk_at = time.monotonic()
+                    self.first_chunk.set()
+                self.bytes_received += len(chunk)
+                self._chunks.append(chunk)
+                self.buffer.write(chunk)
+            self.buffer.close()
+            self.first_chunk.set()
+            with self._lock:
+                self._complete_data = b"".join(self._chunks)
+                callback = self._on_complete
+            if callback:
+                callback(self._complete_data)
+        except Exception as e:
+            logging.error(f"Audio stream reader failed: {e}")
+            self.buffer.close(error=e)
+            self.first_chunk.set()
+
+    @property
+    def on_complete(self):
+        return self._on_complete
+
+    @on_complete.setter
+    def on_complete(self, callback):
+        # The reader starts in __init__, so the stream may already be done: fire at once then
+        with self._lock:
+            self._on_complete = callback
+            data = self._complete_data
+        if callback and data is not None:
+            callback(data)
+
+    def cancel(self):
+        self.buffer.close()
+        self.first_chunk.set()
+
+
+def play_streaming_clip(clip: StreamingClip, read_size=4096):
+    """
+    Decode and play a StreamingClip through ffplay as chunks arrive (BLOCKING).
+    Returns the time-to-first-audio in seconds, measured from the request.
+    """
+    if not shutil.which("ffplay"):
+        clip.cancel()
+        raise ValueError("ffplay from ffmpeg not found, necessary for streaming playback.")
+
+    # Small probe/analyze sizes stop ffplay from buffering before it starts decoding.
+    args = ["ffplay", "-autoexit", "-nodisp", "-loglevel", "quiet",
+            "-fflags", "nobuffer", "-probesize", "32", "-analyzeduration", "0", "-i", "-"]
+    proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    ttfa = None
+    try:
+        while True:
+            data = clip.buffer.read(read_size)
+            if not data:
+                break
+            if ttfa is None:
+                ttfa = time.monotonic() - clip.requested_at
+            proc.stdin.write(data)
+            proc.stdin.flush()
+    except BrokenPipeError:
+        logging.warning("ffplay exited before the stream finished.")
+        clip.cancel()
+    finally:
+        try:
+            proc.stdin.close()
+        except Exception:
+            pass
+        proc.wait()
+
+    if clip.buffer.error is not None:
+        raise clip.buffer.error
+    return ttfa
@@ -0,0 +1,172 @@
+import time
+import logging
+import threading
+
+import metrics
+from metrics import trace
+from text_prep import truncate_text
+
+# --- Backlog Policy ---
+# Keeps spoken audio close to live chat when the TTS queue backs up. Every
+# dequeued message is checked against the latency target ("audio must start
+# within target_s of chat"):
+#
+#   pressure = (time until this message plays + max(its age, time to play the queue behind it)) / target_s
+#
+# and, as pressure crosses each step, the policy escalates:
+#
+#   speed_up    play faster, pitch unchanged (audio engine only), up to max_rate
+#   truncate    also cut the message to truncate_chars
+#   summarize   also fold queued messages that say the same thing into this one
+#   skip        also skip messages that will miss the target
+#
+# Levels go down one step at a time, and only once pressure is clearly below
+# the step (hysteresis), so the policy doesn't flap around a threshold.
+
+NORMAL, SPEED_UP, TRUNCATE, SUMMARIZE, SKIP = range(5)
+LEVEL_NAMES = ("normal", "speed_up", "truncate", "summarize", "skip")
+HYSTERESIS = 0.8 # Step down once pressure is below 80% of the level's threshold
+
+# --- Metrics ---
+LEVEL = metrics.gauge("tts_backlog_level", "Backlog policy level (0 normal, 1 speed up, 2 truncate, "
+                                           "3 summarize, 4 skip)", ("stream",))
+PRESSURE = metrics.gauge("tts_backlog_pressure", "Projected chat-to-audio latency / latency target", ("stream",))
+RATE = metrics.gauge("tts_backlog_playback_rate", "Playback speed applied to the last message", ("stream",))
+ACTIONS = metrics.counter("tts_backlog_actions_total", "Messages changed by the backlog policy",
+                          ("stream", "action"))
+
+
+class BacklogPolicy:
+    """
+    Per-stream backlog policy, consulted by the TTS pipeline for every message
+    it takes off the queue. steps are the pressure thresholds of the speed_up,
+    truncate, summarize and skip levels. Lanes in protect_lanes (superchats)
+    are sped up at most: never truncated, summarized or skipped.
+    """
+    def __init__(self, target_s=15.0, steps=(0.25, 0.5, 0.75, 1.0), max_rate=1.3, truncate_chars=100,
+                 protect_lanes=("superchat",), stream_id="default", initial_clip_s=3.0):
+        if len(steps) != 4 or not all(a < b for a, b in zip(steps, steps[1:])):
+            raise ValueError(f"Backlog steps must be 4 strictly increasing thresholds: {steps}")
+        if target_s <= 0:
+            raise ValueError(f"Backlog latency target must be positive: {target_s}")
+        self.target_s = float(target_s)
+        self.steps = tuple(float(s) for s in steps)
+        self.max_rate = max(1.0, float(max_rate))
+        self.truncate_chars = int(truncate_chars)
+        self.protect_lanes = tuple(protect_lanes)
+        self.stream_id = stream_id or "default"
+        self.level = NORMAL
+        self.pressure = 0.0
+        self.clip_s = float(initial_clip_s) # Moving average of playback time per message
+        self.actions = {"speed_up": 0, "truncate": 0, "summarize": 0, "skip": 0}
+        self._last_sped_up = None # Chunks of one message count as one speed-up
+        self._lock = threading.Lock() # apply() runs in the dispatcher, observe() / sped_up() in playback
+        self._level_gauge = LEVEL.labels(self.stream_id)
+        self._pressure_gauge = PRESSURE.labels(self.stream_id)
+        self._rate_gauge = RATE.labels(self.stream_id)
+        self._rate_gauge.set(1.0)
+
+    def apply(self, job, scheduler, ahead=0, can_speed_up=True):
+        """
+        Adjust a dequeued job in place (rate, text, chunks). `ahead` is the
+        number of messages that play before it (prefetched and playing).
+        can_speed_up=False leaves the rate alone (nothing would apply it).
+        Returns False if it should be skipped.
+        """
+        age = time.monotonic() - job.enqueued_at
+        queued = scheduler.qsize()
+        with self._lock:
+            ahead_s = ahead * self.clip_s # clip_s already reflects current speed-ups and cuts
+            self._update((ahead_s + max(age, queued * self.clip_s)) / self.target_s)
+            level = self.level
+            rate = self._rate() if can_speed_up else 1.0
+        protected = job.lane in self.protect_lanes
+
+        if level >= SKIP and not protected and age + ahead_s > self.target_s:
+            self._count("skip")
+            trace(job, "skipped", "waited %.1fs, backlog level %s", age, LEVEL_NAMES[level])
+            if hasattr(scheduler, "skip"):
+                scheduler.skip(job)
+            return False
+        folded = 0
+        if level >= SUMMARIZE and not protected and hasattr(scheduler, "take_similar"):
+            folded = scheduler.take_similar(job) # Before truncating, which changes the text being compared
+        if level >= TRUNCATE and not protected and len(job.text) > self.truncate_chars:
+            self._truncate(job)
+            self._count("truncate")
+            trace(job, "truncated", "to %d chars", len(job.text))
+        if folded:
+            self._count("summarize")
+            suffix = f" ({folded} more said the same)"
+            job.text += suffix
+            if job.chunks:
+                job.chunks[-1] += suffix
+            trace(job, "summarized", "folded %d similar messages", folded)
+        if rate > 1.0:
+            job.rate = rate # Counted by sped_up() once the audio engine has actually applied it
+        self._rate_gauge.set(rate)
+        return True
+
+    def sped_up(self, job):
+        """Called by the pipeline when job's audio plays at job.rate (streamed clips can't be sped up)."""
+        with self._lock:
+            if job is self._last_sped_up:
+                return
+            self._last_sped_up = job
+        self._count("speed_up")
+
+    def observe(self, playback_s):
+        """Playback time of one message, for the backlog estimate."""
+        with self._lock:
+            self.clip_s += 0.2 * (playback_s - self.clip_s)
+
+    def _update(self, pressure):
+        """New pressure and level; called with the lock held."""
+        self.pressure = pressure
+        level = sum(pressure >= step for step in self.steps)
+        if level < self.level:
+            # One step down at a time, once clearly below the current level's threshold
+            level = self.level - 1 if pressure < self.steps[self.level - 1] * HYSTERESIS else self.level
+        if level != self.level:
+            logging.info(f"Backlog policy [{self.stream_id}]: {LEVEL_NAMES[self.level]} -> {LEVEL_NAMES[level]} "
+                         f"(pressure {pressure:.2f} of a {self.target_s:.0f}s target)")
+            self.level = level
+        self._level_gauge.set(self.level)
+        self._pressure_gauge.set(round(pressure, 3))
+
+    def _rate(self):
+        """Speed for the current pressure: 1.0 below the speed_up step, max_rate from the skip step on."""
+        if self.level < SPEED_UP:
+            return 1.0
+        low, high = self.steps[0], self.steps[-1]
+        span = min(1.0, max(0.0, (self.pressure - low) / (high - low)))
+        return round(1.0 + (self.max_rate - 1.0) * span, 2)
+
+    def _truncate(self, job):
+        chunks = job.chunks
+        if not chunks:
+            job.text = truncate_text(job.text, self.truncate_chars)
+            return
+        kept, length = [], 0
+        for chunk in chunks: # Whole sentences while they fit, at least a cut first one
+            if kept and length + 1 + len(chunk) > self.truncate_chars:
+                break
+            kept.append(chunk if kept else truncate_text(chunk, self.truncate_chars))
+            length += len(kept[-1]) + 1
+        job.chunks = kept if len(kept) > 1 else None
+        job.text = " ".join(kept)
+
+    def _count(self, action):
+        with self._lock:
+            self.actions[action] += 1
+        ACTIONS.labels(self.stream_id, action).inc()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "level": LEVEL_NAMES[self.level],
+                "pressure": round(self.pressure, 3),
+                "rate": self._rate(),
+                "clip_s": round(self.clip_s, 2),
+                "actions": dict(self.actions),
+            }
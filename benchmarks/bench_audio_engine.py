@@ -0,0 +1,103 @@
+"""
+Audio engine check: gaps between back-to-back clips and audio-thread cost.
+
+Plays CLIPS tone clips from the fake provider through the real TTS pipeline
+into the engine's file sink (no audio device), then scans the recorded WAV for
+silence between clips. Also times AudioEngine.render() per output block, the
+only work done on the audio thread, against the block's real-time budget.
+
+    python benchmarks/bench_audio_engine.py [--clips 8] [--crossfade-ms 0] [--streams 1]
+"""
+import os
+import sys
+import time
+import wave
+import argparse
+import tempfile
+import threading
+import logging
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_engine import AudioEngine, FileSink, NullSink
+from tts_pipeline import TtsPipeline
+from tts_scheduler import TtsScheduler, TtsJob
+from tts_services import FakeTtsService
+
+SAMPLE_RATE = 44100
+GAP_WINDOW_MS = 5 # Silence shorter than this isn't counted as a gap
+
+
+def play_clips(engine, streams, clips, clip_s):
+    service = FakeTtsService({"synth_delay_s": 0.05, "play_delay_s": clip_s, "tone_hz": 220})
+    shutdown = threading.Event()
+    workers, schedulers = [], []
+    for s in range(streams):
+        scheduler = TtsScheduler(capacity=clips)
+        for i in range(clips):
+            scheduler.put(TtsJob(f"stream {s} clip {i}", author=f"viewer{i}"))
+        pipeline = TtsPipeline(service, scheduler, shutdown_event=shutdown, player=engine.channel(f"s{s}"))
+        workers.append(threading.Thread(target=pipeline.run, daemon=True))
+        schedulers.append(scheduler)
+    for w in workers:
+        w.start()
+    while any(c["clips"] < clips for c in engine.stats()["channels"].values()):
+        time.sleep(0.05)
+    for scheduler in schedulers:
+        scheduler.put(None) # Control items jump the queue, so only stop once every clip is in the engine
+    for w in workers:
+        w.join()
+    time.sleep(0.3) # Let the last clip drain
+
+
+def silent_gaps(path):
+    with wave.open(path, "rb") as w:
+        samples = np.abs(np.frombuffer(w.readframes(w.getnframes()), "<i2").astype(np.int32))
+    loud = np.flatnonzero(samples > 50)
+    audio = samples[loud[0]:loud[-1] + 1]
+    window = SAMPLE_RATE * GAP_WINDOW_MS // 1000
+    peaks = audio[:len(audio) // window * window].reshape(-1, window).max(axis=1)
+    return len(audio) / SAMPLE_RATE, int((peaks <= 50).sum()) * GAP_WINDOW_MS
+
+
+def render_cost(streams, blocks=2000):
+    engine = AudioEngine(NullSink())
+    for s in range(streams):
+        engine.channel(f"s{s}").ring.write(np.zeros((engine.block_frames * 4, 1), np.float32))
+    started = time.perf_counter()
+    for _ in range(blocks):
+        engine.render(engine.block_frames)
+    per_block = (time.perf_counter() - started) / blocks
+    engine.stop()
+    return per_block, engine.block_frames / engine.sample_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio engine gap and render-cost check.")
+    parser.add_argument("--clips", type=int, default=8)
+    parser.add_argument("--clip-s", type=float, default=0.5)
+    parser.add_argument("--crossfade-ms", type=float, default=0)
+    parser.add_argument("--streams", type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="audio-engine-bench-"), "out.wav")
+    engine = AudioEngine(FileSink(path), sample_rate=SAMPLE_RATE, crossfade_ms=args.crossfade_ms).start()
+    play_clips(engine, args.streams, args.clips, args.clip_s)
+    engine.stop()
+    audible_s, gap_ms = silent_gaps(path)
+    underruns = sum(c["underruns"] for c in engine.stats()["channels"].values())
+    expected_s = args.clips * args.clip_s - (args.clips - 1) * args.crossfade_ms / 1000
+    print(f"{args.clips} clips x {args.clip_s}s: {audible_s:.3f}s audible (expected {expected_s:.3f}s), "
+          f"{gap_ms}ms silence between clips, {underruns} underruns")
+
+    per_block, budget = render_cost(args.streams)
+    print(f"render(): {per_block * 1e6:.0f}us per {budget * 1000:.1f}ms block "
+          f"({per_block / budget:.1%} of the audio thread budget, {args.streams} channels)")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
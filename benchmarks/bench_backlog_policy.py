@@ -0,0 +1,80 @@
+"""
+Backlog policy benchmark: chat-to-audio latency during a raid, with the
+backlog policy off and on.
+
+Replays steady chat plus a raid of near-identical spam ("POG", "pog pog!!")
+through chat_overlay's handler and TTS worker (see chat_load.py). Clips are
+tones from the fake provider played through the audio engine with a null
+sink (real time, no device), so speed-ups really shorten playback. Reports
+latency, what the policy did and the highest level it reached.
+
+    python benchmarks/bench_backlog_policy.py [--target-s 10] [--raid-rate 20] [--duration-s 20]
+"""
+import random
+import logging
+import argparse
+
+from chat_load import TraceMessage, synthetic_trace, run_load
+import chat_overlay
+from audio_engine import AudioEngine, NullSink
+from backlog_policy import LEVEL_NAMES
+
+RAID_SPAM = ("pog", "pog pog", "lol", "lmao", "w stream", "hi faust", "raid hype", "faust best sinner")
+
+
+def raid_trace(duration_s, chat_rate, raid_start_s, raid_s, raid_rate, seed=5):
+    """Steady chat (every message triggers TTS) plus a raid: spam in many spellings ("POG", "pog!!")."""
+    trace = synthetic_trace(rate=chat_rate, duration_s=duration_s, trigger_ratio=1.0, seed=seed)
+    rng = random.Random(seed)
+    phrase = chat_overlay.ACTIVATION_PHRASE
+    t = raid_start_s
+    while True:
+        t += rng.expovariate(raid_rate)
+        if t >= raid_start_s + raid_s:
+            break
+        spam = rng.choice(RAID_SPAM)
+        spam = (spam.upper() if rng.random() < 0.5 else spam) + "!" * rng.randrange(4)
+        trace.append(TraceMessage(round(t, 6), f"raider{rng.randrange(100000)}", f"{phrase}{spam}"))
+    trace.sort(key=lambda m: m.t)
+    return trace
+
+
+def run(trace, target_s, truncate_chars, drain_s):
+    chat_overlay.TTS_LATENCY_TARGET_S = target_s
+    chat_overlay.TTS_BACKLOG_TRUNCATE_CHARS = truncate_chars
+    engine = AudioEngine(NullSink()).start()
+    try:
+        return run_load(trace, fake_config={"synth_delay_s": 0.15, "play_delay_s": None, "chars_per_s": 18,
+                                            "tone_hz": 220},
+                        drain_s=drain_s, audio_engine=engine)
+    finally:
+        engine.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backlog policy latency benchmark.")
+    parser.add_argument("--target-s", type=float, default=10, help="Latency target for the 'on' run")
+    parser.add_argument("--truncate-chars", type=int, default=40, help="Length messages are cut to")
+    parser.add_argument("--duration-s", type=float, default=20)
+    parser.add_argument("--chat-rate", type=float, default=0.5, help="Regular TTS messages/s")
+    parser.add_argument("--raid-rate", type=float, default=20, help="Raid spam messages/s")
+    parser.add_argument("--raid-s", type=float, default=4)
+    parser.add_argument("--drain-s", type=float, default=60)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    trace = raid_trace(args.duration_s, args.chat_rate, 3.0, args.raid_s, args.raid_rate)
+    print(f"{'policy':>8} {'accepted':>8} {'spoken':>7} {'summed':>7} {'skipped':>7} {'wall s':>7} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}  actions / max level")
+    for mode, target_s in (("off", 0), ("on", args.target_s)):
+        r = run(trace, target_s, args.truncate_chars, args.drain_s)
+        lat = r["latency_ms"]
+        backlog = r["backlog"]
+        detail = f"{backlog['actions']} / {LEVEL_NAMES[backlog['max_level']]}" if backlog else "-"
+        print(f"{mode:>8} {r['accepted']:>8} {r['spoken']:>7} {r['dropped']['summarized']:>7} "
+              f"{r['dropped']['skipped']:>7} {r['wall_s']:>7} {str(lat['p50']):>8} {str(lat['p95']):>8} "
+              f"{str(lat['max']):>8}  {detail}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+End-to-end latency benchmark: chat message -> audio start, under replayed load.
+
+Each scenario replays a chat trace through chat_overlay's message handler and
+TTS worker (see chat_load.py) with the deterministic fake provider and reports
+throughput, queue depth and p50/p95/p99 chat-to-audio latency. Runs headless:
+no network, no audio device.
+
+    python benchmarks/bench_e2e_latency.py                      # all scenarios, compare to baseline
+    python benchmarks/bench_e2e_latency.py --scenario raid      # one scenario
+    python benchmarks/bench_e2e_latency.py --trace chat.jsonl   # replay a recorded trace
+    python benchmarks/bench_e2e_latency.py --record-dir traces/ # save the synthetic traces
+    python benchmarks/bench_e2e_latency.py --update-baseline    # accept the current numbers
+
+Exits with status 1 when a scenario regresses past the baseline tolerance.
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+
+from chat_load import synthetic_trace, load_trace, save_trace, run_load
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, "e2e_latency_baseline.json")
+
+# name -> synthetic_trace() arguments. Rates are all chat messages, ~30% trigger TTS.
+SCENARIOS = {
+    "steady_10":  dict(rate=10, duration_s=6),
+    "steady_200": dict(rate=200, duration_s=4),
+    "raid":       dict(rate=10, duration_s=6, bursts=[(2.0, 2000, 1.0)]),
+    "flood_5000": dict(rate=5000, duration_s=3),
+}
+
+# A metric regresses when it is worse than baseline by more than the relative
+# tolerance AND the absolute slack (timing noise on small numbers).
+LATENCY_TOLERANCE = 0.25
+LATENCY_SLACK_MS = 50
+THROUGHPUT_TOLERANCE = 0.25
+
+
+def compare(name, result, baseline):
+    """Returns a list of human-readable regressions for one scenario."""
+    problems = []
+    for key in ("p50", "p95", "p99"):
+        now, then = result["latency_ms"][key], baseline["latency_ms"][key]
+        if now is None or then is None:
+            continue
+        if now > then * (1 + LATENCY_TOLERANCE) and now - then > LATENCY_SLACK_MS:
+            problems.append(f"{name}: latency {key} {now:.0f}ms vs baseline {then:.0f}ms")
+    if result["spoken_per_s"] < baseline["spoken_per_s"] * (1 - THROUGHPUT_TOLERANCE):
+        problems.append(f"{name}: spoken/s {result['spoken_per_s']} vs baseline {baseline['spoken_per_s']}")
+    return problems
+
+
+def print_result(name, r):
+    lat = r["latency_ms"]
+    dropped = sum(r["dropped"].values())
+    print(f"{name:>12} {r['offered']:>8} {r['accepted']:>8} {dropped:>8} {r['spoken']:>7} "
+          f"{r['spoken_per_s']:>9} {str(r['ingest_msgs_per_s']):>10} {r['queue_depth']['max']:>6} "
+          f"{str(lat['p50']):>8} {str(lat['p95']):>8} {str(lat['p99']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat-to-audio latency benchmark under replayed load.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Run only these (repeatable)")
+    parser.add_argument("--trace", help="Replay a recorded JSONL trace instead of the synthetic scenarios")
+    parser.add_argument("--record-dir", help="Save each synthetic trace as <scenario>.jsonl here")
+    parser.add_argument("--batch-window-ms", type=float, default=0, help="Deliver chat in batches (async ingest style)")
+    parser.add_argument("--synth-ms", type=float, default=150, help="Fake provider synthesis time")
+    parser.add_argument("--play-ms", type=float, default=300, help="Fake provider playback time")
+    parser.add_argument("--out", help="Write full results (incl. queue depth series) as JSON")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING) # Per-message INFO logs would dominate the measurement
+
+    if args.trace:
+        traces = {os.path.splitext(os.path.basename(args.trace))[0]: load_trace(args.trace)}
+    else:
+        traces = {name: synthetic_trace(**SCENARIOS[name]) for name in (args.scenario or SCENARIOS)}
+    if args.record_dir:
+        os.makedirs(args.record_dir, exist_ok=True)
+        for name, trace in traces.items():
+            save_trace(trace, os.path.join(args.record_dir, f"{name}.jsonl"))
+
+    fake_config = {"synth_delay_s": args.synth_ms / 1000, "play_delay_s": args.play_ms / 1000}
+    print(f"{'scenario':>12} {'offered':>8} {'accepted':>8} {'dropped':>8} {'spoken':>7} {'spoken/s':>9} "
+          f"{'ingest/s':>10} {'maxq':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    results = {}
+    for name, trace in traces.items():
+        results[name] = run_load(trace, fake_config=fake_config, batch_window_s=args.batch_window_ms / 1000)
+        print_result(name, results[name])
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    summary = {name: {k: r[k] for k in ("spoken_per_s", "latency_ms")} for name, r in results.items()}
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(summary)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --update-baseline to create one.")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    problems = [p for name in summary if name in baseline for p in compare(name, summary[name], baseline[name])]
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    if not problems:
+        print("No regressions against baseline.")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
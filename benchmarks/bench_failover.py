@@ -0,0 +1,160 @@
+"""
+Failover benchmark: time to first audio with a slow or failing primary
+provider, and checks of the failover bookkeeping.
+
+Two fake providers (no network) sit behind FailoverTtsService:
+
+    hedge     the primary is slow; hedges to the backup must win, every late
+              primary clip must be discarded (not leaked), and once the
+              backup's latency is trusted it must be routed to first
+    breaker   the primary always fails; its breaker must open after
+              TTS_FAILOVER_FAILURES errors and later requests skip it (and
+              falling back after a failure is not a hedge win)
+    timeout   a hung attempt that fails after the request timed out must be
+              counted once (as a timeout), not again as a failure; a stream
+              that never sends audio must not count as a success
+
+Exits with status 1 if a check fails.
+
+    python benchmarks/bench_failover.py [--requests 20] [--slow-ms 600] [--hedge-ms 100]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts_services import FakeTtsService
+from tts_failover import FailoverTtsService, OPEN
+from audio_streaming import StreamingClip
+
+
+class TrackedFakeTtsService(FakeTtsService):
+    """Fake provider that remembers which clips were discarded."""
+    def __init__(self, config=None):
+        super().__init__(config)
+        self.discarded = []
+
+    def discard(self, audio):
+        self.discarded.append(audio)
+
+
+class StalledStreamService(TrackedFakeTtsService):
+    """Streams that connect but send their first chunk only after stall_s."""
+    def synthesize(self, text):
+        def chunks():
+            time.sleep(self.config.get("stall_s", 1.0))
+            yield text.encode("utf-8")
+        return StreamingClip(chunks(), text=text)
+
+
+def make_failover(primary, backup, **config):
+    return FailoverTtsService([("primary", TrackedFakeTtsService(primary)),
+                               ("backup", TrackedFakeTtsService(backup))], config)
+
+
+def timed_requests(service, requests):
+    latencies = []
+    for i in range(requests):
+        started = time.monotonic()
+        service.synthesize(f"message {i}")
+        latencies.append((time.monotonic() - started) * 1000)
+    return latencies
+
+
+def check(failures, ok, message):
+    print(f"  {'ok' if ok else 'FAIL':>4}  {message}")
+    if not ok:
+        failures.append(message)
+
+
+def bench_hedge(args, failures):
+    primary = {"name": "primary", "synth_delay_s": args.slow_ms / 1000}
+    backup = {"name": "backup", "synth_delay_s": 0.05}
+    rows = []
+    for mode, hedge_ms in (("no hedge", args.slow_ms * 10), ("hedge", args.hedge_ms)):
+        service = make_failover(primary, backup, hedge_after_ms=hedge_ms, timeout_s=args.slow_ms / 100)
+        latencies = timed_requests(service, args.requests)
+        time.sleep(args.slow_ms / 1000 + 0.2) # Let the abandoned primary attempts finish
+        rows.append((mode, service, latencies))
+        service.cleanup()
+    print(f"{'mode':>10} {'p50 ms':>8} {'max ms':>8} {'hedges won':>11}")
+    for mode, service, latencies in rows:
+        print(f"{mode:>10} {statistics.median(latencies):>8.0f} {max(latencies):>8.0f} "
+              f"{service.stats()['backup']['hedges_won']:>11}")
+    _, service, _ = rows[1]
+    primary_service = service.providers[0].service
+    hedges_won = service.stats()["backup"]["hedges_won"]
+    check(failures, hedges_won >= 1, f"the hedge won {hedges_won} request(s)")
+    check(failures, len(primary_service.discarded) == hedges_won,
+          f"the primary's late clips were discarded ({len(primary_service.discarded)}/{hedges_won})")
+    check(failures, primary_service.synth_calls == hedges_won,
+          f"the primary was only tried until the backup was faster ({primary_service.synth_calls} calls)")
+
+
+def bench_breaker(args, failures):
+    threshold = 3
+    service = make_failover({"name": "primary", "synth_delay_s": 0.01, "failure_rate": 1.0},
+                            {"name": "backup", "synth_delay_s": 0.01},
+                            failure_threshold=threshold, cooldown_s=60)
+    timed_requests(service, args.requests)
+    state = service.providers[0]
+    check(failures, state.breaker.state == OPEN, f"the primary's breaker is {state.breaker.state}")
+    check(failures, state.service.synth_calls == threshold,
+          f"the primary was called {state.service.synth_calls} times (expected {threshold})")
+    hedges_won = service.stats()["backup"]["hedges_won"]
+    check(failures, hedges_won == 0, f"falling back after failures counted {hedges_won} hedge wins (expected 0)")
+    service.cleanup()
+
+
+def bench_timeout(args, failures):
+    service = FailoverTtsService([("hung", TrackedFakeTtsService({"synth_delay_s": 0.3, "failure_rate": 1.0}))],
+                                 {"timeout_s": 0.1, "failure_threshold": 5})
+    try:
+        service.synthesize("hello")
+        check(failures, False, "the request timed out")
+    except TimeoutError:
+        pass
+    time.sleep(0.4) # The abandoned attempt fails now
+    state = service.providers[0]
+    check(failures, state.counts["timeouts"] == 1 and state.counts["failures"] == 0,
+          f"the hung attempt counted once (timeouts {state.counts['timeouts']}, failures {state.counts['failures']})")
+    check(failures, state.breaker.consecutive_failures == 1,
+          f"the breaker saw {state.breaker.consecutive_failures} failure(s) (expected 1)")
+    service.cleanup()
+
+    service = FailoverTtsService([("stalled", StalledStreamService({"stall_s": 1.0})),
+                                  ("backup", TrackedFakeTtsService({"synth_delay_s": 0.05}))],
+                                 {"timeout_s": 0.3, "hedge_after_ms": 50})
+    service.synthesize("hello") # The hedge wins; the stalled stream is abandoned
+    time.sleep(0.4) # Its attempt gives up waiting for the first chunk now
+    state = service.providers[0]
+    check(failures, state.counts["successes"] == 0 and state.counts["failures"] == 1,
+          f"a stream without audio is not a success (successes {state.counts['successes']}, "
+          f"failures {state.counts['failures']})")
+    service.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Failover latency benchmark and bookkeeping checks.")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--slow-ms", type=float, default=600, help="Slow primary's synthesis time")
+    parser.add_argument("--hedge-ms", type=float, default=100, help="Hedge delay")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    failures = []
+    bench_hedge(args, failures)
+    print("breaker")
+    bench_breaker(args, failures)
+    print("timeout")
+    bench_timeout(args, failures)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Connection pooling check against a local mock of the ElevenLabs TTS endpoint.
+
+The mock server answers POST /v1/text-to-speech/<voice> with chunked "audio"
+after a fixed processing delay, and charges HANDSHAKE_MS on every new
+connection to stand in for TCP + TLS setup to the real API. ElevenLabsService
+is pointed at it via base_url and sends MESSAGES requests with idle gaps
+between them, under a few pool configurations:
+
+    no keep-alive    every request opens a new connection
+    pooled           default shared pool
+    idle > expiry    gaps longer than the keep-alive expiry, no heartbeat
+    + heartbeat      same gaps, idle heartbeat keeps the connection open
+
+    python benchmarks/bench_http_pool.py
+"""
+import os
+import sys
+import json
+import socket
+import time
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts_services import ElevenLabsService, start_warm_up
+
+HANDSHAKE_MS = 120  # Simulated connection setup cost per new connection
+PROCESSING_MS = 40  # Simulated synthesis time before the first byte
+CHUNKS = 8
+CHUNK_BYTES = 4096
+MESSAGES = 12
+
+
+class MockTtsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        # Like real API servers; otherwise Nagle + delayed ACKs add ~40ms stalls to small writes
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        MockTtsHandler.connections += 1
+        time.sleep(HANDSHAKE_MS / 1000)
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send_json({"voices": []} if self.path.startswith("/v1/voices") else [])
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.startswith("/v1/text-to-speech/"):
+            self.send_error(404)
+            return
+        time.sleep(PROCESSING_MS / 1000)
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for _ in range(CHUNKS):
+            self.wfile.write(f"{CHUNK_BYTES:x}\r\n".encode() + b"\x00" * CHUNK_BYTES + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def run_scenario(base_url, http_config, gap_s):
+    MockTtsHandler.connections = 0
+    service = ElevenLabsService({"api_key": "mock", "base_url": base_url, "http": http_config})
+    start_warm_up(service, background=False) # Key check on a fresh connection, starts the heartbeat
+    for i in range(MESSAGES):
+        time.sleep(gap_s)
+        service.synthesize(f"message number {i}")
+    stats = service.http_pool.stats()
+    service.http_pool.close()
+    return stats, MockTtsHandler.connections
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockTtsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    scenarios = (
+        ("no keep-alive", {"keepalive_expiry_s": 0}, 0.05),
+        ("pooled", {}, 0.05),
+        ("idle > expiry", {"keepalive_expiry_s": 0.4}, 0.6),
+        ("+ heartbeat", {"keepalive_expiry_s": 0.4, "heartbeat_s": 0.2}, 0.6),
+    )
+    print(f"{'scenario':>14} {'conns':>6} {'reused':>7} {'ttfb p50 ms':>12} {'total p50 ms':>13} {'heartbeats':>11}")
+    for label, http_config, gap_s in scenarios:
+        stats, server_connections = run_scenario(base_url, http_config, gap_s)
+        reused = stats["reused_ratio"] or 0.0
+        print(f"{label:>14} {server_connections:>6} {reused:>7.0%} {stats['ttfb_ms_p50']:>12.1f} "
+              f"{stats['total_ms_p50']:>13.1f} {stats['heartbeats']:>11}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Startup benchmark: how long until the app can accept its first chat message.
+
+Each run is a fresh interpreter that imports chat_overlay, initializes the TTS
+provider and feeds one triggering message through handle_new_pytchat_message.
+Reported per mode (medians over RUNS):
+
+    import     interpreter start -> chat_overlay imported
+    accepted   interpreter start -> first message accepted by the TTS queue
+    ready      interpreter start -> provider warm-up finished (/health = ready)
+
+The fake provider stands in for ElevenLabs, with WARM_UP_S simulating the
+voices.get_all() key check, so fast-start and blocking startup can be compared
+without an API key.
+
+    python benchmarks/bench_startup.py [--runs 5] [--warm-up-s 0.8]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(spawned_at, fast_start, warm_up_s):
+    sys.path.insert(0, ROOT)
+    from types import SimpleNamespace
+
+    import chat_overlay
+    imported_at = time.time()
+
+    chat_overlay.TTS_PROVIDER = "fake"
+    chat_overlay.TTS_FAST_START = fast_start
+    chat_overlay.TTS_CACHE_ENABLED = False
+    chat_overlay.TTS_CONFIG["fake"] = {"warm_up_s": warm_up_s}
+    service = chat_overlay.init_tts_service()
+
+    item = SimpleNamespace(message=chat_overlay.ACTIVATION_PHRASE + "hello chat",
+                           author=SimpleNamespace(name="bench", isChatSponsor=False), type="textMessage")
+    chat_overlay.handle_new_pytchat_message(item)
+    if chat_overlay.tts_queue.qsize() != 1:
+        raise RuntimeError("benchmark message was not accepted")
+    accepted_at = time.time()
+
+    service.ready.wait()
+    ready_at = time.time()
+    print(json.dumps({
+        "import_ms": (imported_at - spawned_at) * 1000,
+        "accepted_ms": (accepted_at - spawned_at) * 1000,
+        "ready_ms": (ready_at - spawned_at) * 1000,
+        "elevenlabs_imported": "elevenlabs" in sys.modules,
+    }))
+
+
+def run_once(fast_start, warm_up_s):
+    env = dict(os.environ, YOUTUBE_VIDEO_ID="", STREAMS_CONFIG="", TRIGGERS_CONFIG="")
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", repr(time.time()),
+         "--fast-start", str(fast_start), "--warm-up-s", str(warm_up_s)],
+        env=env, cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warm-up-s", type=float, default=0.8)
+    parser.add_argument("--child", type=float, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--fast-start", default="True", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child, args.fast_start == "True", args.warm_up_s)
+        return
+
+    run_once(True, 0.0) # Warm the OS file cache so the first measured run isn't an outlier
+    print(f"{'mode':>10} {'import ms':>10} {'accepted ms':>12} {'ready ms':>9}   (warm-up {args.warm_up_s:.1f}s, "
+          f"median of {args.runs})")
+    for label, fast_start in (("blocking", False), ("fast", True)):
+        results = [run_once(fast_start, args.warm_up_s) for _ in range(args.runs)]
+        median = {key: statistics.median(r[key] for r in results) for key in ("import_ms", "accepted_ms", "ready_ms")}
+        print(f"{label:>10} {median['import_ms']:>10.0f} {median['accepted_ms']:>12.0f} {median['ready_ms']:>9.0f}")
+    if any(r["elevenlabs_imported"] for r in results):
+        print("note: the elevenlabs SDK was imported although the fake provider was used")
+
+
+if __name__ == "__main__":
+    main()
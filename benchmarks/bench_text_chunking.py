@@ -0,0 +1,71 @@
+"""
+Text preprocessing / chunked synthesis benchmark: chat-to-audio latency for
+long messages, spoken whole vs split into sentence chunks.
+
+Replays a trace of long chat messages (sentences plus URLs, emoji and spam)
+through chat_overlay's handler and TTS worker (see chat_load.py). The fake
+provider's synthesis time grows with text length, like a real one, so the
+first chunk of a split message is ready long before the whole text would be.
+
+    python benchmarks/bench_text_chunking.py [--messages 8] [--chunk-chars 120] [--ms-per-char 4]
+"""
+import random
+import logging
+import argparse
+
+from chat_load import TraceMessage, run_load
+import chat_overlay
+from text_prep import TextPreprocessor
+
+SENTENCES = (
+    "I just pulled the new identity on my first ten pull and I still cannot believe it.",
+    "The boss in the third floor of the mirror dungeon took me forty minutes, send help.",
+    "Faust, what do you think about the manager's choices on the last run?",
+    "Chat has been spamming the same emote for five minutes and honestly it is beautiful.",
+    "Remember to drink water and take a break between refraction railway attempts.",
+    "Dante's clock noises are my favorite part of every single stream.",
+)
+NOISE = (" https://www.youtube.com/watch?v=dQw4w9WgXcQ", " 😂😂😂😂😂", " :face-blue-smiling::face-blue-smiling:",
+         " lol lol lol lol lol lol", " POGGGGGGGGGG")
+
+
+def long_message_trace(messages, spacing_s, seed=3):
+    rng = random.Random(seed)
+    phrase = chat_overlay.ACTIVATION_PHRASE
+    trace = []
+    for i in range(messages):
+        text = " ".join(rng.sample(SENTENCES, 3)) + "".join(rng.sample(NOISE, 2))
+        trace.append(TraceMessage(i * spacing_s, f"viewer{i}", f"{phrase}{i}: {text}"))
+    return trace
+
+
+def run(trace, preprocessor, ms_per_char):
+    chat_overlay.text_preprocessor = preprocessor
+    result = run_load(trace, fake_config={"synth_delay_s": 0.1, "synth_jitter_s": 0.0,
+                                          "synth_s_per_char": ms_per_char / 1000,
+                                          "play_delay_s": None, "chars_per_s": 150},
+                      drain_s=30)
+    return result, preprocessor.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunked synthesis latency benchmark.")
+    parser.add_argument("--messages", type=int, default=8)
+    parser.add_argument("--spacing-s", type=float, default=2.5, help="Time between messages")
+    parser.add_argument("--chunk-chars", type=int, default=120)
+    parser.add_argument("--ms-per-char", type=float, default=4, help="Fake provider synthesis time per character")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    trace = long_message_trace(args.messages, args.spacing_s)
+    print(f"{'mode':>10} {'spoken':>7} {'chars in':>9} {'chars out':>10} {'saved':>6} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for mode, chunk_chars in (("whole", 0), ("chunked", args.chunk_chars)):
+        result, text = run(trace, TextPreprocessor(chunk_chars=chunk_chars), args.ms_per_char)
+        lat = result["latency_ms"]
+        print(f"{mode:>10} {result['spoken']:>7} {text['chars_in']:>9} {text['chars_out']:>10} "
+              f"{text['chars_saved_ratio']:>6.0%} {str(lat['p50']):>8} {str(lat['p95']):>8} {str(lat['max']):>8}")
+
+
+if __name__ == "__main__":
+    main()
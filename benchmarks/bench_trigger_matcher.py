@@ -0,0 +1,98 @@
+"""
+Microbenchmark: per-message cost of trigger matching + moderation as the
+activation-phrase and banned-word lists grow.
+
+Compares the compiled TriggerMatcher (trie regexes, batch moderation pass)
+with the naive approach of one startswith() per phrase and one substring
+scan per banned word. First checks that batch moderation agrees with the
+per-message is_banned() for words and anchored / ".*" patterns.
+
+    python benchmarks/bench_trigger_matcher.py
+"""
+import os
+import sys
+import time
+import random
+import string
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trigger_matcher import TriggerMatcher, TriggerRule, ModerationFilter
+
+SIZES = (10, 100, 1000, 5000)
+MESSAGES = 5000
+BATCH = 50
+
+
+def random_word(rng, lo=4, hi=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(lo, hi)))
+
+
+def make_messages(rng, phrases, n):
+    messages = []
+    for _ in range(n):
+        body = " ".join(random_word(rng) for _ in range(rng.randint(3, 25)))
+        # About a third of chat uses an activation phrase
+        messages.append(rng.choice(phrases) + body if rng.random() < 0.33 else body)
+    return messages
+
+
+def naive(messages, phrases, banned):
+    hits = 0
+    for message in messages:
+        lowered = message.lower()
+        for phrase in phrases:
+            if lowered.startswith(phrase):
+                content = lowered[len(phrase):]
+                if not any(word in content for word in banned):
+                    hits += 1
+                break
+    return hits
+
+
+def compiled(messages, matcher):
+    hits = 0
+    for start in range(0, len(messages), BATCH):
+        for match in matcher.match_batch(messages[start:start + BATCH]):
+            if match is not None and not match.banned:
+                hits += 1
+    return hits
+
+
+def check_batch_consistency():
+    moderation = ModerationFilter(["spam", "c++"], [r"^spam", r"buy.*now", r"free\s+\w+$"])
+    texts = ["spam me", "please buy stuff", "now is fine", "no spam here", "buy it now", "i like c++",
+             "free stuff", "free stuff please", "totally fine", "", "SPAM", "c+++ not this"]
+    batch = moderation.banned_batch(texts)
+    single = [moderation.is_banned(t) for t in texts]
+    if batch != single:
+        raise SystemExit(f"banned_batch() disagrees with is_banned():\n  {texts}\n  batch  {batch}\n  single {single}")
+    print(f"batch moderation matches is_banned() on {len(texts)} messages")
+
+
+def per_message_us(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - started) / MESSAGES * 1e6
+
+
+def main():
+    check_batch_consistency()
+    rng = random.Random(1234)
+    print(f"{'entries':>8} {'naive us/msg':>14} {'compiled us/msg':>16} {'compile ms':>11}")
+    for size in SIZES:
+        phrases = ["faust says "] + [f"{random_word(rng)} says " for _ in range(size - 1)]
+        banned = [random_word(rng, 5, 12) for _ in range(size)]
+        messages = make_messages(rng, phrases[:10], MESSAGES)
+
+        started = time.perf_counter()
+        matcher = TriggerMatcher([TriggerRule(p) for p in phrases], ModerationFilter(banned))
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        naive_us = per_message_us(naive, messages, phrases, banned)
+        compiled_us = per_message_us(compiled, messages, matcher)
+        print(f"{size:>8} {naive_us:>14.2f} {compiled_us:>16.2f} {compile_ms:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
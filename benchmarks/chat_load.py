@@ -0,0 +1,249 @@
+"""
+Replayable chat load: synthetic/recorded chat traces and a driver that plays
+them through chat_overlay's real message handler and TTS worker, with a
+deterministic fake TTS provider. No network, no audio device.
+
+A trace is a list of TraceMessage (offset in seconds from the start, author,
+message text, superchat/member flags) and can be saved to / loaded from JSONL,
+so the exact same load can be replayed later.
+"""
+import os
+import sys
+import re
+import json
+import time
+import random
+import threading
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_overlay
+from streams import StreamContext
+from tts_scheduler import TtsScheduler
+from tts_services import FakeTtsService
+
+# Drop reasons for messages that were accepted first (and so will never be spoken)
+DROPPED_AFTER_ACCEPT = ("expired", "overflow_oldest", "summarized", "skipped")
+
+SUMMARY_SUFFIX_RE = re.compile(r" \(\d+ more said the same\)$")
+
+WORDS = ("hello", "chat", "faust", "limbus", "company", "manager", "dante", "sinner", "mirror", "dungeon",
+         "gacha", "pog", "lol", "nice", "clutch", "ego", "ticket", "bus", "abno", "refraction")
+
+
+# --- Traces ---
+class TraceMessage:
+    __slots__ = ("t", "author", "message", "superchat", "member")
+
+    def __init__(self, t, author, message, superchat=False, member=False):
+        self.t = t
+        self.author = author
+        self.message = message
+        self.superchat = superchat
+        self.member = member
+
+    def to_item(self):
+        """The shape handle_new_pytchat_message expects from Pytchat."""
+        return SimpleNamespace(message=self.message, type="superChat" if self.superchat else "textMessage",
+                               author=SimpleNamespace(name=self.author, isChatSponsor=self.member))
+
+
+def synthetic_trace(rate, duration_s, bursts=(), trigger_ratio=0.3, authors=500, seed=1):
+    """
+    Poisson chat at `rate` msgs/s for duration_s, plus raid bursts given as
+    (start_s, rate, length_s). About trigger_ratio of messages use the
+    activation phrase; the rest are ordinary chat the handler must skip.
+    """
+    rng = random.Random(seed)
+    phrase = chat_overlay.ACTIVATION_PHRASE
+    segments = [(0.0, duration_s, rate)]
+    segments += [(start, start + length_s, burst_rate) for start, burst_rate, length_s in bursts]
+    messages = []
+    for start, end, seg_rate in segments:
+        t = start
+        while seg_rate > 0:
+            t += rng.expovariate(seg_rate)
+            if t >= end:
+                break
+            body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 12)))
+            text = f"{phrase}{body} #{len(messages)}" if rng.random() < trigger_ratio else body
+            messages.append(TraceMessage(round(t, 6), f"viewer{rng.randrange(authors)}", text,
+                                         superchat=rng.random() < 0.01, member=rng.random() < 0.1))
+    messages.sort(key=lambda m: m.t)
+    return messages
+
+
+def save_trace(messages, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for m in messages:
+            f.write(json.dumps({s: getattr(m, s) for s in TraceMessage.__slots__}) + "\n")
+
+
+def load_trace(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [TraceMessage(**json.loads(line)) for line in f if line.strip()]
+
+
+# --- Instrumented Fake Provider ---
+class TimedFakeTtsService(FakeTtsService):
+    """FakeTtsService that records when each clip starts playing (= audio start)."""
+    def __init__(self, config=None):
+        super().__init__(config)
+        self.audio_started = {} # text -> time.monotonic()
+
+    def play(self, audio):
+        if audio:
+            self.audio_started[audio.decode("utf-8")] = time.monotonic()
+        super().play(audio)
+
+    def decode(self, audio, sample_rate, channels):
+        clip = super().decode(audio, sample_rate, channels)
+        if clip is not None:
+            clip.text = audio.decode("utf-8") # Played through the audio engine: see _time_engine_playback
+        return clip
+
+
+def _time_engine_playback(channel, service):
+    """Record audio starts for clips played by an audio engine channel instead of the provider."""
+    play = channel.play
+
+    def timed_play(clip):
+        service.audio_started[clip.text] = time.monotonic() + channel.latency_s() # When it becomes audible
+        play(clip)
+    channel.play = timed_play
+
+
+def _message_starts(audio_started, arrived):
+    """
+    Audio start per message (keyed like `arrived`). The backlog policy may have
+    truncated a message or appended a summary, so a clip matches the message
+    whose first chunk it starts with, or that starts with it.
+    """
+    starts = {}
+    for text, at in audio_started.items():
+        key = text if text in arrived else SUMMARY_SUFFIX_RE.sub("", text)
+        if key not in arrived:
+            key = next((k for k in arrived if k.startswith(key) and k not in starts), None)
+        if key is not None and key not in starts:
+            starts[key] = at
+    return starts
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+# --- Driver ---
+def run_load(trace, fake_config=None, scheduler_kwargs=None, drain_s=10.0, sample_interval_s=0.05,
+             batch_window_s=0.0, audio_engine=None):
+    """
+    Replays `trace` in real time into chat_overlay.handle_new_pytchat_message
+    (or handle_new_pytchat_batch with messages grouped per batch_window_s,
+    like the async ingestor delivers them) for a fresh stream whose
+    tts_worker plays through a TimedFakeTtsService (or through audio_engine,
+    given an audio_engine.AudioEngine and a fake_config with tone_hz). After
+    the trace, waits up to drain_s for the queue to empty, then stops the
+    worker. Returns a dict of metrics.
+    """
+    fake_config = dict({"synth_delay_s": 0.15, "synth_jitter_s": 0.05, "play_delay_s": 0.3, "seed": 7},
+                       **(fake_config or {}))
+    if scheduler_kwargs is None:
+        scheduler_kwargs = dict(
+            capacity=chat_overlay.TTS_QUEUE_CAPACITY, lanes=chat_overlay.TTS_PRIORITY_LANES,
+            overflow_policy=chat_overlay.TTS_QUEUE_OVERFLOW, max_age_s=chat_overlay.TTS_QUEUE_MAX_AGE_S,
+            author_rate_per_min=chat_overlay.TTS_AUTHOR_RATE_PER_MIN, author_burst=chat_overlay.TTS_AUTHOR_BURST,
+            dedupe_window_s=chat_overlay.TTS_DEDUPE_WINDOW_S,
+        )
+    service = TimedFakeTtsService(fake_config)
+    stream = StreamContext("bench", activation_phrase=chat_overlay.ACTIVATION_PHRASE,
+                           scheduler=TtsScheduler(**scheduler_kwargs), matcher=chat_overlay.default_matcher)
+    previous_engine, chat_overlay.audio_engine = chat_overlay.audio_engine, audio_engine
+    if audio_engine is not None:
+        _time_engine_playback(audio_engine.channel(stream.stream_id), service)
+    worker = threading.Thread(target=chat_overlay.tts_worker, args=(service, stream), name="bench-tts", daemon=True)
+    worker.start()
+
+    depth_samples = [] # (seconds since start, queue depth)
+    max_level = 0 # Highest backlog policy level seen
+    sampling = threading.Event()
+    started = time.monotonic()
+
+    def sample():
+        nonlocal max_level
+        while not sampling.wait(sample_interval_s):
+            depth_samples.append((round(time.monotonic() - started, 3), stream.scheduler.qsize()))
+            if stream.backlog_policy:
+                max_level = max(max_level, stream.backlog_policy.level)
+    sampler = threading.Thread(target=sample, name="bench-sampler", daemon=True)
+    sampler.start()
+
+    # --- Replay ---
+    arrived = {} # first spoken chunk -> time the message appeared in chat (its trace offset)
+    prep = chat_overlay.text_preprocessor
+    handler_s = 0.0
+    phrase = chat_overlay.ACTIVATION_PHRASE
+    index = 0
+    while index < len(trace):
+        # Batch mode holds messages for batch_window_s, like one poll of the async ingestor
+        wait_s = trace[index].t + batch_window_s - (time.monotonic() - started)
+        if wait_s > 0:
+            time.sleep(wait_s)
+        now = time.monotonic() - started
+        batch = []
+        while index < len(trace) and trace[index].t <= now:
+            batch.append(trace[index])
+            index += 1
+        for m in batch:
+            if m.message.lower().startswith(phrase):
+                spoken = prep.normalize(m.message[len(phrase):].strip())
+                if spoken:
+                    arrived[prep.split(spoken)[0]] = started + m.t
+        call_started = time.monotonic()
+        if batch_window_s:
+            chat_overlay.handle_new_pytchat_batch([m.to_item() for m in batch], stream)
+        else:
+            for m in batch:
+                chat_overlay.handle_new_pytchat_message(m.to_item(), stream)
+        handler_s += time.monotonic() - call_started
+    replay_s = time.monotonic() - started
+
+    # --- Drain, then stop the worker (the None sentinel is served before queued jobs) ---
+    drain_deadline = time.monotonic() + drain_s
+    accepted = stream.scheduler.accepted
+    while time.monotonic() < drain_deadline:
+        dropped_after = sum(stream.scheduler.dropped[reason] for reason in DROPPED_AFTER_ACCEPT)
+        started_msgs = len(_message_starts(service.audio_started, arrived)) # Chunked messages log every chunk
+        if stream.scheduler.qsize() == 0 and started_msgs >= accepted - dropped_after:
+            break
+        time.sleep(0.05)
+    stream.scheduler.put(None)
+    worker.join(timeout=5)
+    chat_overlay.audio_engine = previous_engine
+    sampling.set()
+    sampler.join()
+    wall_s = time.monotonic() - started
+
+    latencies = sorted(at - arrived[key] for key, at in _message_starts(service.audio_started, arrived).items())
+    depths = [d for _, d in depth_samples] or [0]
+    pct = lambda p: round(_percentile(latencies, p) * 1000, 1) if latencies else None
+    stats = stream.scheduler.stats()
+    return {
+        "offered": len(trace),
+        "triggered": len(arrived),
+        "accepted": stats["accepted"],
+        "dropped": stats["dropped"],
+        "spoken": len(latencies),
+        "unspoken": stats["depth"],
+        "replay_s": round(replay_s, 3),
+        "wall_s": round(wall_s, 3),
+        "ingest_msgs_per_s": round(len(trace) / handler_s) if handler_s else None, # Handler capacity
+        "spoken_per_s": round(len(latencies) / wall_s, 2),
+        "latency_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99),
+                       "max": round(latencies[-1] * 1000, 1) if latencies else None},
+        "queue_depth": {"mean": round(sum(depths) / len(depths), 2), "max": max(depths)},
+        "queue_depth_series": depth_samples,
+        "backlog": dict(stream.backlog_policy.stats(), max_level=max_level) if stream.backlog_policy else None,
+    }
@@ -0,0 +1,227 @@
+import time
+import random
+import asyncio
+import threading
+import logging
+
+import pytchat
+
+# --- Chat Sources ---
+class ChatSource:
+    """
+    Pluggable chat source for the async ingestor.
+    fetch() returns (items, suggested_interval_s); suggested_interval_s may be
+    None if the source has no opinion on when to poll next.
+    """
+    name = "source"
+
+    async def fetch(self):
+        raise NotImplementedError("Subclasses must implement the 'fetch' method.")
+
+    def is_alive(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class PytchatSource(ChatSource):
+    """
+    Wraps a pytchat instance. The blocking HTTP fetch runs in the loop's
+    executor; items are handed over immediately instead of being paced out by
+    sync_items(), and the server's timeoutMs drives the next poll.
+
+    pytchat terminates itself on any error, so with reconnect=True a fresh
+    instance is created on the next fetch (after the ingestor's backoff).
+    """
+    def __init__(self, chat, video_id=None, reconnect=True, name=None):
+        self.chat = chat
+        self.video_id = video_id or getattr(chat, "_video_id", None)
+        self.reconnect = reconnect and self.video_id is not None
+        self.name = name or self.video_id or "pytchat"
+        self._closed = False
+
+    def _ensure_chat(self):
+        if self.chat is None or not self.chat.is_alive():
+            logging.info(f"Pytchat source '{self.name}': (re)connecting...")
+            # interruptable=False: pytchat may only install its SIGINT handler in the main thread
+            self.chat = pytchat.create(video_id=self.video_id, interruptable=False)
+        return self.chat
+
+    def _fetch_blocking(self):
+        chat = self._ensure_chat() if self.reconnect else self.chat
+        chatdata = chat.get()
+        chat.raise_for_status() # Surface errors pytchat holds instead of raising
+        return chatdata
+
+    async def fetch(self):
+        loop = asyncio.get_running_loop()
+        chatdata = await loop.run_in_executor(None, self._fetch_blocking)
+        if not chatdata: # get() returns [] once terminated
+            return [], None
+        return list(chatdata.items), getattr(chatdata, "interval", None)
+
+    def is_alive(self):
+        if self._closed:
+            return False
+        return self.reconnect or (self.chat is not None and self.chat.is_alive())
+
+    def close(self):
+        self._closed = True
+        try:
+            if self.chat is not None:
+                self.chat.terminate()
+        except Exception as e:
+            logging.error(f"Error terminating pytchat source {self.name}: {e}")
+
+
+# --- Ingest Latency Stats ---
+class IngestStats:
+    """Chat-post -> hand-off latency (from the item's own timestamp) and batch counters."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.latency_count = 0
+        self.latency_total_s = 0.0
+        self.latency_max_s = 0.0
+
+    def record_batch(self, items, handed_off_at):
+        with self.lock:
+            self.batches += 1
+            self.items += len(items)
+            for item in items:
+                ts = getattr(item, "timestamp", None)
+                if not ts:
+                    continue
+                latency = max(0.0, handed_off_at - ts / 1000.0)
+                self.latency_count += 1
+                self.latency_total_s += latency
+                self.latency_max_s = max(self.latency_max_s, latency)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "errors": self.errors,
+                "latency_mean_s": self.latency_total_s / self.latency_count if self.latency_count else 0.0,
+                "latency_max_s": self.latency_max_s,
+            }
+
+
+# --- Async Ingestor ---
+class AsyncChatIngestor:
+    """
+    Runs every chat source on one asyncio event loop in a dedicated thread.
+
+    Poll intervals follow the server-suggested timeout (clamped to
+    [min_interval_s, max_interval_s], shortened while chat is busy), errors
+    back off exponentially with full jitter, and each fetched batch is handed
+    to the source's batch callback in one call. Between polls the loop just
+    sleeps, so an idle stream costs next to no CPU.
+    """
+    def __init__(self, min_interval_s=0.5, max_interval_s=10.0,
+                 backoff_base_s=1.0, backoff_max_s=60.0):
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.stats = IngestStats()
+        self._sources = [] # (source, batch_callback)
+        self._loop = None
+        self._stop = None
+        self._thread = None
+
+    def add_source(self, source: ChatSource, batch_callback):
+        """Register a source before start(), or while running (thread-safe)."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(
+                lambda: self._loop.create_task(self._run_source(source, batch_callback)))
+        self._sources.append((source, batch_callback))
+
+    def next_interval(self, suggested_s, batch_size):
+        interval = suggested_s if suggested_s else self.min_interval_s
+        if batch_size:
+            interval /= 2 # Busy chat: come back sooner
+        return min(self.max_interval_s, max(self.min_interval_s, interval))
+
+    def backoff_delay(self, failures):
+        cap = min(self.backoff_max_s, self.backoff_base_s * (2 ** (failures - 1)))
+        return random.uniform(0, cap) # "Full jitter"
+
+    async def _sleep(self, seconds):
+        """Sleeps, but wakes immediately when the ingestor is stopped. Returns False on stop."""
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def _run_source(self, source: ChatSource, batch_callback):
+        logging.info(f"Chat ingest: source '{source.name}' started.")
+        failures = 0
+        while not self._stop.is_set() and source.is_alive():
+            try:
+                items, suggested = await source.fetch()
+                failures = 0
+            except Exception as e:
+                if isinstance(e, pytchat.exceptions.RetryExceedMaxCount) and not getattr(source, "reconnect", False):
+                    logging.error(f"Chat ingest: retry exceeded for '{source.name}': {e}. Stopping source.")
+                    break
+                failures += 1
+                with self.stats.lock:
+                    self.stats.errors += 1
+                delay = self.backoff_delay(failures)
+                logging.error(f"Chat ingest: error from '{source.name}' (attempt {failures}): {e}. "
+                              f"Retrying in {delay:.1f}s")
+                if not await self._sleep(delay):
+                    break
+                continue
+
+            if items and not self._stop.is_set():
+                self.stats.record_batch(items, time.time())
+                try:
+                    batch_callback(items)
+                except Exception:
+                    logging.exception(f"Chat ingest: batch callback failed for '{source.name}':")
+
+            if not await self._sleep(self.next_interval(suggested, len(items))):
+                break
+        logging.info(f"Chat ingest: source '{source.name}' finished.")
+
+    async def _main(self):
+        self._stop = asyncio.Event()
+        tasks = [asyncio.create_task(self._run_source(s, cb)) for s, cb in self._sources]
+        self._loop = asyncio.get_running_loop() # From here on add_source() schedules its own task
+        await self._stop.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _thread_main(self):
+        logging.info("Chat ingest event loop started.")
+        try:
+            asyncio.run(self._main())
+        except Exception:
+            logging.exception("Chat ingest event loop failed:")
+        finally:
+            for source, _ in self._sources:
+                source.close()
+            logging.info("Chat ingest event loop finished.")
+
+    def start(self):
+        """Start the event loop thread and return it."""
+        self._thread = threading.Thread(target=self._thread_main, name="chat-ingest", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        """Thread-safe: ask the loop to finish. Sources are closed on exit."""
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
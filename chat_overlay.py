@@ -1,9 +1,9 @@
 import os
 import time
 import threading
-import queue
-from flask import Flask, render_template
-from flask_socketio import SocketIO, emit
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, render_template, jsonify, request
+from flask_socketio import SocketIO, emit, join_room
 import logging
 from dotenv import load_dotenv
 import random
@@ -11,17 +11,53 @@ from datetime import datetime, timezone
 import pytchat
 
 # --- Import TTS services ---
-from tts_services import get_tts_service, BaseTtsService
+from tts_services import get_tts_service, start_warm_up, BaseTtsService, READY
+from tts_pipeline import TtsPipeline
+from tts_cache import AudioCache, CachedTtsService
+from tts_failover import FailoverTtsService
+from tts_scheduler import TtsScheduler, TtsJob
+from tts_wal import QueueWal
+from text_prep import TextPreprocessor
+from backlog_policy import BacklogPolicy
+from chat_ingest import AsyncChatIngestor, PytchatSource
+from streams import StreamContext, load_stream_configs, build_stream_context
+from trigger_matcher import TriggerMatcher, TriggerRule, ModerationFilter, load_trigger_config
+from overlay_events import OverlayEventChannel, MSG, START, STOP, server_time_ms
+import metrics
+from metrics import trace
 
 # --- Load Environment Variables ---
 load_dotenv()
 
 # --- Configuration ---
-TTS_PROVIDER = "elevenlabs"
+TTS_PROVIDER = os.getenv("TTS_PROVIDER", "elevenlabs") # elevenlabs | local (offline, pyttsx3) | failover (several of these)
 TTS_CONFIG = {
     "elevenlabs": { # Example
         "voice_id": os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM"), # Default to Rachel
-        "model": "eleven_turbo_v2" # defaults to use the turbo model for low latency
+        "model": "eleven_turbo_v2", # defaults to use the turbo model for low latency
+        "streaming": os.getenv("TTS_STREAMING", "false").lower() == "true", # Start playback on the first audio chunk
+        "latency_preset": os.getenv("ELEVENLABS_LATENCY_PRESET", "default"), # quality | default | balanced | fast | fastest
+        "http": { # Shared connection pool for all ElevenLabs requests
+            "pool_size": int(os.getenv("TTS_HTTP_POOL_SIZE", "10")), # Max open connections
+            "keepalive_expiry_s": float(os.getenv("TTS_HTTP_KEEPALIVE_S", "120")), # Idle connections are closed after this
+            "connect_timeout_s": float(os.getenv("TTS_HTTP_CONNECT_TIMEOUT_S", "5")),
+            "read_timeout_s": float(os.getenv("TTS_HTTP_READ_TIMEOUT_S", "30")),
+            "http2": os.getenv("TTS_HTTP2", "true").lower() == "true", # Needs the 'h2' package, else HTTP/1.1
+            "heartbeat_s": float(os.getenv("TTS_HTTP_HEARTBEAT_S", "0")) # Ping after this much idle time to keep connections warm (0 = off)
+        }
+    },
+    "local": { # Offline pyttsx3 engine, no API key or network needed
+        "rate": 180, # Words per minute
+        "volume": 1.0,
+        "voice_id": os.getenv("LOCAL_TTS_VOICE_ID", None), # pyttsx3 voice id, None = system default
+        "workers": int(os.getenv("LOCAL_TTS_WORKERS", "2")) # Parallel render processes
+    },
+    "failover": { # Routes each message to the healthiest/fastest of several providers
+        "providers": [p.strip() for p in os.getenv("TTS_FAILOVER_PROVIDERS", "elevenlabs,local").split(",") if p.strip()],
+        "timeout_s": float(os.getenv("TTS_FAILOVER_TIMEOUT_S", "15")), # Give up on a message after this long
+        "hedge_after_ms": int(os.getenv("TTS_FAILOVER_HEDGE_MS", "0")), # Start a backup request if the first is this slow (0 = primary's p95)
+        "failure_threshold": int(os.getenv("TTS_FAILOVER_FAILURES", "3")), # Consecutive failures before a provider is skipped
+        "cooldown_s": float(os.getenv("TTS_FAILOVER_COOLDOWN_S", "30")) # How long a failed provider is skipped before a retry
     }
 }
 
@@ -29,10 +65,103 @@ TTS_CONFIG = {
 # !!!!! IMPORTANT: SET YOUR VIDEO ID HERE (via .env ideally) !!!!!
 YOUTUBE_VIDEO_ID = os.getenv("YOUTUBE_VIDEO_ID", None)
 
+# --- Multi-Stream Mode ---
+# Path to a JSON file listing several streams (see README). When set, YOUTUBE_VIDEO_ID
+# is ignored and every listed stream is served by this one process.
+STREAMS_CONFIG = os.getenv("STREAMS_CONFIG", None)
+MULTI_STREAM_SYNTH_WORKERS = int(os.getenv("MULTI_STREAM_SYNTH_WORKERS", "4")) # Synthesis pool shared by all streams
+
 # --- Activation Phrase ---
 ACTIVATION_PHRASE = "faust says " # Case-insensitive check later
+
+# --- Triggers & Moderation ---
+# Optional JSON file with several activation phrases (each may route to its own voice/character)
+# and banned words/patterns. Without it, ACTIVATION_PHRASE is the only trigger and nothing is banned.
+TRIGGERS_CONFIG = os.getenv("TRIGGERS_CONFIG", None)
+MODERATION_ACTION = os.getenv("MODERATION_ACTION", "drop") # drop | mask
+
+# --- Startup ---
+# Fast start: the overlay, chat ingestion and TTS worker come up immediately while the
+# provider verifies credentials / warms connections in the background (see /health).
+# false = verify before starting anything and exit if it fails.
+TTS_FAST_START = os.getenv("TTS_FAST_START", "true").lower() == "true"
+
+# --- Observability ---
+# Fraction of messages whose per-stage trace lines (queued, synthesized, playing...) are logged.
+# Counters/histograms for every message are always available at /metrics.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+# --- Overlay Events ---
+OVERLAY_BATCH_MS = int(os.getenv("OVERLAY_BATCH_MS", "50")) # Overlay events within this window go out as one emit (0 = send at once)
+
+# --- TTS Pipeline ---
+TTS_PREFETCH_DEPTH = int(os.getenv("TTS_PREFETCH_DEPTH", "2")) # Upcoming messages synthesized ahead of playback (0 = no prefetch)
+TTS_SYNTH_WORKERS = int(os.getenv("TTS_SYNTH_WORKERS", "2")) # Parallel synthesis requests
+
+# --- TTS Queue Scheduling / Flood Control ---
+TTS_QUEUE_CAPACITY = int(os.getenv("TTS_QUEUE_CAPACITY", "50")) # Max messages waiting to be spoken
+TTS_QUEUE_OVERFLOW = os.getenv("TTS_QUEUE_OVERFLOW", "drop_oldest") # drop_oldest | drop_newest
+TTS_QUEUE_MAX_AGE_S = float(os.getenv("TTS_QUEUE_MAX_AGE_S", "120")) # Drop messages that waited longer (0 = never)
+TTS_AUTHOR_RATE_PER_MIN = float(os.getenv("TTS_AUTHOR_RATE_PER_MIN", "6")) # Per-author messages per minute (0 = unlimited)
+TTS_AUTHOR_BURST = int(os.getenv("TTS_AUTHOR_BURST", "2")) # Messages an author may send back-to-back
+TTS_DEDUPE_WINDOW_S = float(os.getenv("TTS_DEDUPE_WINDOW_S", "30")) # Identical messages within this window are coalesced (0 = off)
+TTS_PRIORITY_LANES = ("superchat", "member", "normal") # Highest priority first
+
+# --- Backlog Policy ---
+# When the queue backs up, keep audio within TTS_LATENCY_TARGET_S of chat: as the projected
+# latency passes each fraction of the target in TTS_BACKLOG_STEPS, messages are sped up
+# (pitch unchanged, needs the audio engine), then truncated, then similar queued messages
+# are merged, and finally messages that already missed the target are skipped.
+TTS_LATENCY_TARGET_S = float(os.getenv("TTS_LATENCY_TARGET_S", "15")) # 0 = off, play everything in full
+TTS_BACKLOG_STEPS = [float(s) for s in os.getenv("TTS_BACKLOG_STEPS", "0.25,0.5,0.75,1.0").split(",")] # speed up, truncate, summarize, skip
+TTS_BACKLOG_MAX_RATE = float(os.getenv("TTS_BACKLOG_MAX_RATE", "1.3")) # Fastest playback speed
+TTS_BACKLOG_TRUNCATE_CHARS = int(os.getenv("TTS_BACKLOG_TRUNCATE_CHARS", "100")) # Length messages are cut to
+TTS_BACKLOG_PROTECT_LANES = [l.strip() for l in os.getenv("TTS_BACKLOG_PROTECT_LANES", "superchat").split(",") if l.strip()] # Only ever sped up
+
+# --- Text Preprocessing ---
+# Applied to every triggered message before it is queued: URLs and emoji are stripped (or
+# spoken as "example dot com" / their name), spam like "loooool lol lol lol lol" is collapsed
+# and the text is capped. Longer results are split into sentence chunks that are synthesized
+# in parallel and played in order, so the first sentence starts while the rest renders.
+TTS_TEXT_MAX_CHARS = int(os.getenv("TTS_TEXT_MAX_CHARS", "300")) # Spoken text is cut (at a word) after this (0 = no cap)
+TTS_TEXT_MAX_REPEAT = int(os.getenv("TTS_TEXT_MAX_REPEAT", "3")) # Longest run of one character / one word kept
+TTS_TEXT_URLS = os.getenv("TTS_TEXT_URLS", "strip") # strip | speak (domain only) | keep
+TTS_TEXT_EMOJI = os.getenv("TTS_TEXT_EMOJI", "strip") # strip | speak (emoji name, once per run) | keep
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "120")) # Split longer messages into sentence chunks of about this size (0 = off)
+
+# --- Audio Engine ---
+# device: decode clips to PCM and play them through one persistent output stream (gapless,
+# mixed across streams). null / file: same engine without an audio device (headless testing;
+# file records the output to AUDIO_OUTPUT_FILE). off: every provider plays its own clips.
+AUDIO_ENGINE = os.getenv("AUDIO_ENGINE", "device")
+AUDIO_DEVICE = os.getenv("AUDIO_DEVICE", None) # sounddevice output device name/index (None = system default)
+AUDIO_OUTPUT_FILE = os.getenv("AUDIO_OUTPUT_FILE", "tts_output.wav")
+AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", "44100"))
+AUDIO_BLOCK_FRAMES = int(os.getenv("AUDIO_BLOCK_FRAMES", "512")) # Output block size (lower = less latency, more CPU)
+AUDIO_CROSSFADE_MS = float(os.getenv("AUDIO_CROSSFADE_MS", "0")) # Overlap between back-to-back clips (0 = gapless, no overlap)
+AUDIO_NORMALIZE_DBFS = os.getenv("AUDIO_NORMALIZE_DBFS", "-18") # Target clip loudness (empty = off)
+AUDIO_VOLUME = float(os.getenv("AUDIO_VOLUME", "1.0")) # Master volume
+
+# --- Queue Write-Ahead Log ---
+# Directory for a durable log of accepted messages (empty = off). Messages that were
+# accepted but never played are re-queued on the next start.
+TTS_WAL_DIR = os.getenv("TTS_WAL_DIR", "")
+TTS_WAL_COMMIT_MS = float(os.getenv("TTS_WAL_COMMIT_MS", "20")) # Group commit window: one fsync per window
+TTS_WAL_SEGMENT_MB = float(os.getenv("TTS_WAL_SEGMENT_MB", "4")) # Compact once the current segment grows past this
+TTS_WAL_RECOVER_MAX_AGE_S = float(os.getenv("TTS_WAL_RECOVER_MAX_AGE_S", "300")) # Don't re-queue older messages (0 = no limit)
+
+# --- Synthesized Audio Cache ---
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".tts_cache") # Empty string = memory-only cache
+TTS_CACHE_MEMORY_MB = int(os.getenv("TTS_CACHE_MEMORY_MB", "32"))
+TTS_CACHE_DISK_MB = int(os.getenv("TTS_CACHE_DISK_MB", "512"))
 LOOK_FOR_YOUTUBE_ID = True # or false to disable YouTube chat polling
 
+# --- Chat Ingestion ---
+CHAT_INGEST_MODE = os.getenv("CHAT_INGEST_MODE", "async") # async (event loop, server-paced polling) | polling (legacy thread loop)
+CHAT_MIN_POLL_S = float(os.getenv("CHAT_MIN_POLL_S", "0.5")) # Never poll faster than this
+CHAT_MAX_POLL_S = float(os.getenv("CHAT_MAX_POLL_S", "10")) # Never wait longer than this between polls
+
 # --- Basic Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 # Reduce log noise from libraries
@@ -45,82 +174,223 @@ logging.getLogger("websockets").setLevel(logging.WARNING)
 logging.getLogger("engineio").setLevel(logging.WARNING)
 logging.getLogger("socketio").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING) # Pytchat uses requests/urllib3
+metrics.set_trace_sample_rate(TRACE_SAMPLE_RATE)
+
+# --- Metrics ---
+CHAT_MESSAGES = metrics.counter("chat_messages_total", "Chat messages received", ("stream",))
+TRIGGERS_MATCHED = metrics.counter("chat_triggers_matched_total", "Messages starting with an activation phrase", ("stream",))
+MODERATION_BLOCKED = metrics.counter("chat_moderation_blocked_total", "Triggered messages dropped by the moderation filter", ("stream",))
+QUEUE_DEPTH = metrics.gauge("tts_queue_depth", "Messages waiting to be spoken", ("stream",))
+JOBS_ACCEPTED = metrics.counter("tts_jobs_accepted_total", "Messages accepted into the TTS queue", ("stream",))
+JOBS_DROPPED = metrics.counter("tts_jobs_dropped_total", "Messages dropped by the TTS scheduler", ("stream", "reason"))
+CACHE_HITS = metrics.counter("tts_cache_hits_total", "Audio cache hits", ("tier",))
+CACHE_MISSES = metrics.counter("tts_cache_misses_total", "Audio cache misses")
+TEXT_CHARS_SAVED = metrics.counter("tts_text_chars_saved_total", "Characters removed by text preprocessing", ("stream",))
+TEXT_CHUNKS = metrics.histogram("tts_text_chunks", "Synthesis chunks per queued message", ("stream",),
+                                buckets=(1, 2, 3, 4, 6, 8))
+AUDIO_UNDERRUNS = metrics.counter("audio_underruns_total", "Output blocks the audio engine could not fill mid-clip", ("stream",))
+AUDIO_BUFFERED = metrics.gauge("audio_buffered_seconds", "Audio queued in the engine ahead of the output", ("stream",))
 
 # --- Queues and Globals ---
-tts_queue = queue.Queue()
+tts_queue = TtsScheduler(
+    capacity=TTS_QUEUE_CAPACITY,
+    lanes=TTS_PRIORITY_LANES,
+    overflow_policy=TTS_QUEUE_OVERFLOW,
+    max_age_s=TTS_QUEUE_MAX_AGE_S,
+    author_rate_per_min=TTS_AUTHOR_RATE_PER_MIN,
+    author_burst=TTS_AUTHOR_BURST,
+    dedupe_window_s=TTS_DEDUPE_WINDOW_S,
+)
+text_preprocessor = TextPreprocessor(max_chars=TTS_TEXT_MAX_CHARS, max_repeat=TTS_TEXT_MAX_REPEAT,
+                                     urls=TTS_TEXT_URLS, emoji=TTS_TEXT_EMOJI, chunk_chars=TTS_CHUNK_CHARS)
 socketio_global = None
 active_tts_service: BaseTtsService = None
+audio_cache: AudioCache = None
+
+def build_default_matchers():
+    """Compiles the moderation filter (shared by all streams) and the default trigger matcher."""
+    rules, banned_words, banned_patterns = [TriggerRule(ACTIVATION_PHRASE)], [], []
+    if TRIGGERS_CONFIG:
+        config_rules, banned_words, banned_patterns = load_trigger_config(TRIGGERS_CONFIG)
+        rules = config_rules or rules
+    moderation = ModerationFilter(banned_words, banned_patterns, action=MODERATION_ACTION)
+    return TriggerMatcher(rules, moderation), moderation
+
+default_matcher, moderation_filter = build_default_matchers()
+default_stream = StreamContext("", YOUTUBE_VIDEO_ID, ACTIVATION_PHRASE, scheduler=tts_queue, room=None,
+                               matcher=default_matcher) # Single-stream mode
+streams = {} # stream_id -> StreamContext (multi-stream mode)
 pytchat_instance = None # To hold the pytchat object for stopping
 pytchat_listener_thread = None   # To hold the listener thread
+chat_ingestor = None # To hold the async ingestor (CHAT_INGEST_MODE == "async")
 tts_thread = None # To hold the TTS worker thread
+queue_wal: QueueWal = None # Durable queue log (TTS_WAL_DIR)
+audio_engine = None # Shared PCM output (AUDIO_ENGINE), None = providers play clips themselves
 
 # Flag to signal shutdown to threads
 shutdown_event = threading.Event()
+overlay_channel = OverlayEventChannel(lambda event, data, room: emit_overlay(event, data, room),
+                                      window_s=OVERLAY_BATCH_MS / 1000.0)
+started_at = time.monotonic() # For /health uptime
+
+def collect_metrics():
+    """Scrape-time metrics read from the schedulers and the audio cache."""
+    for ctx in (streams.values() if streams else [default_stream]):
+        stream_id = ctx.stream_id or "default"
+        queue_stats = ctx.scheduler.stats()
+        QUEUE_DEPTH.labels(stream_id).set(queue_stats["depth"])
+        JOBS_ACCEPTED.labels(stream_id).set(queue_stats["accepted"])
+        for reason, count in queue_stats["dropped"].items():
+            JOBS_DROPPED.labels(stream_id, reason).set(count)
+    if audio_cache:
+        cache_stats = audio_cache.stats()
+        CACHE_HITS.labels("memory").set(cache_stats["memory_hits"])
+        CACHE_HITS.labels("disk").set(cache_stats["disk_hits"])
+        CACHE_MISSES.set(cache_stats["misses"])
+    if audio_engine:
+        for name, channel in audio_engine.stats()["channels"].items():
+            AUDIO_UNDERRUNS.labels(name).set(channel["underruns"])
+            AUDIO_BUFFERED.labels(name).set(channel["buffered_ms"] / 1000)
+
+metrics.register_collector(collect_metrics)
+
+def init_tts_service():
+    """Creates the configured provider (plus the audio cache) and starts its warm-up."""
+    global active_tts_service, audio_cache
+    logging.info(f"Initializing TTS provider: {TTS_PROVIDER}")
+    active_tts_service = get_tts_service(TTS_PROVIDER, TTS_CONFIG)
+    if TTS_CACHE_ENABLED:
+        logging.info(f"Enabling audio cache (dir: '{TTS_CACHE_DIR}', memory: {TTS_CACHE_MEMORY_MB}MB, disk: {TTS_CACHE_DISK_MB}MB)")
+        audio_cache = AudioCache(TTS_CACHE_DIR, TTS_CACHE_MEMORY_MB * 1024 * 1024, TTS_CACHE_DISK_MB * 1024 * 1024)
+        if isinstance(active_tts_service, FailoverTtsService):
+            # Cache per provider, so a hit never depends on which provider is healthy right now
+            active_tts_service.wrap_providers(lambda service: CachedTtsService(service, audio_cache))
+        else:
+            active_tts_service = CachedTtsService(active_tts_service, audio_cache)
+    if TTS_FAST_START:
+        logging.info("Fast start: warming up the TTS provider in the background.")
+    start_warm_up(active_tts_service, background=TTS_FAST_START)
+    return active_tts_service
+
+def init_audio_engine():
+    """
+    Creates the shared audio engine and opens its output, in the background
+    with TTS_FAST_START. Providers play clips themselves until the output is
+    open, and for good if it can't be opened.
+    """
+    global audio_engine
+    if AUDIO_ENGINE == "off":
+        return None
+    try:
+        from audio_engine import AudioEngine, SoundDeviceSink, NullSink, FileSink
+        if AUDIO_ENGINE == "null":
+            sink = NullSink()
+        elif AUDIO_ENGINE == "file":
+            sink = FileSink(AUDIO_OUTPUT_FILE)
+        else:
+            sink = SoundDeviceSink(device=int(AUDIO_DEVICE) if AUDIO_DEVICE and AUDIO_DEVICE.isdigit() else AUDIO_DEVICE)
+        engine = AudioEngine(sink, sample_rate=AUDIO_SAMPLE_RATE, block_frames=AUDIO_BLOCK_FRAMES,
+                             crossfade_ms=AUDIO_CROSSFADE_MS, volume=AUDIO_VOLUME,
+                             normalize_dbfs=float(AUDIO_NORMALIZE_DBFS) if AUDIO_NORMALIZE_DBFS else None)
+    except Exception as e:
+        logging.warning(f"Audio engine unavailable ({e}); providers will play clips themselves.")
+        return None
 
-# --- TTS Worker ---
-def tts_worker(tts_service: BaseTtsService): # Accepts the service instance
-    """Worker thread that processes the TTS queue using the provided service."""
-    logging.info(f"TTS Worker Thread Started (Using: {tts_service.__class__.__name__}).")
-    while not shutdown_event.is_set():
-        text_to_speak = None
+    def start():
         try:
-            logging.info("TTS Worker: Waiting for item from queue...")
-            text_to_speak = tts_queue.get() # Blocks here
-            logging.info(f"TTS Worker: Got item: '{text_to_speak}'")
-
-            if text_to_speak is None: # Signal to exit
-                logging.info("TTS Worker: Received None, exiting.")
-                break
-
-            # --- Start Speaking Signal ---
-            logging.info("TTS Worker: Attempting to emit tts_start...")
-            if socketio_global:
-                socketio_global.emit('tts_start', namespace='/')
-                logging.info("TTS Worker: Emitted tts_start.")
-            else:
-                logging.warning("TTS Worker: socketio_global not set, cannot emit tts_start.")
-
-            # --- Delegate to the TTS Service ---
-            logging.info(f"TTS Worker: Calling {tts_service.__class__.__name__}.speak()...")
-            tts_service.speak(text_to_speak)
-            logging.info(f"TTS Worker: {tts_service.__class__.__name__}.speak() COMPLETED.")
-
-        except queue.Empty:
-            # Timeout occurred, just loop again and check shutdown_event
-            continue
+            engine.start()
+            return True
         except Exception as e:
-            logging.error(f"!!!!!!!! ERROR in TTS worker processing '{text_to_speak}': {e} !!!!!!!!")
-            # Avoid super-fast error loops
-            time.sleep(1)
-
-        finally:
-            # --- Stop Speaking Signal (ALWAYS emit this, unless shutting down immediately) ---
-            # Only emit stop if we actually started (i.e., text_to_speak was processed)
-            # And only if we are not already shutting down
-            if text_to_speak is not None and not shutdown_event.is_set():
-                logging.info("TTS Worker: In finally block, attempting to emit tts_stop...")
-                if socketio_global:
-                    socketio_global.emit('tts_stop', namespace='/')
-                    logging.info("TTS Worker: Emitted tts_stop.")
-                else:
-                    logging.warning("TTS Worker: socketio_global not set, cannot emit tts_stop.")
-
-            # Mark the task as done in the queue
-            if text_to_speak is not None:
-                logging.info("TTS Worker: Marking task done.")
-                # Use task_done() for queue management if using queue.join() later
-                # If not using join(), this isn't strictly necessary but good practice
-                try:
-                     tts_queue.task_done()
-                except ValueError:
-                    # Can happen if task_done() is called after queue cleared or on None
-                    logging.debug("TTS Worker: task_done() called when not needed or queue cleared.")
-                except Exception as e_td:
-                    logging.error(f"TTS Worker: Error calling task_done(): {e_td}")
+            logging.warning(f"Audio engine unavailable ({e}); providers will play clips themselves.")
+            return False
+
+    if TTS_FAST_START:
+        logging.info("Fast start: opening the audio output in the background.")
+        threading.Thread(target=start, name="audio-engine-start", daemon=True).start()
+    elif not start():
+        return None
+    audio_engine = engine
+    return audio_engine
+
+def open_queue_wal():
+    """Opens the queue WAL (when TTS_WAL_DIR is set) and attaches it to the single-stream queue."""
+    global queue_wal
+    if not TTS_WAL_DIR:
+        return None
+    queue_wal = QueueWal(TTS_WAL_DIR, commit_interval_s=TTS_WAL_COMMIT_MS / 1000.0,
+                         segment_bytes=int(TTS_WAL_SEGMENT_MB * 1024 * 1024)).open()
+    if not STREAMS_CONFIG:
+        attach_queue_wal(default_stream)
+    return queue_wal
+
+def attach_queue_wal(stream: StreamContext):
+    """Journals the stream's queue and re-queues its unfinished messages from the last run."""
+    scheduler = stream.scheduler
+    scheduler.journal = queue_wal.stream(stream.stream_id)
+    restored = 0
+    for record in queue_wal.pending(stream.stream_id, TTS_WAL_RECOVER_MAX_AGE_S):
+        job = TtsJob(record["text"], author=record.get("author") or "Someone", lane=record.get("lane") or "normal",
+                     voice_id=record.get("voice"), character=record.get("ch"))
+        job.trace_id = record["id"] # Keeps the journal entry (and trace) of the original message
+        job.chunks = text_preprocessor.split(job.text) # Journaled text is already preprocessed
+        if not scheduler.restore(job):
+            scheduler.complete(job, "dropped")
+            continue
+        restored += 1
+        overlay_channel.publish(stream.room, MSG, job.msg_id, text=f"{job.author}: {job.text}",
+                                pos=scheduler.lane_position(job.lane), ch=job.character)
+    if restored:
+        overlay_channel.set_state(stream.room, q=scheduler.qsize())
+        logging.info(f"Queue WAL: re-queued {restored} unfinished messages for stream '{stream.stream_id or 'default'}'.")
+
+# --- TTS Worker ---
+def emit_overlay(event, data=None, room=None):
+    """Emit to the overlays of one stream (room), or to everyone when room is None."""
+    if socketio_global:
+        socketio_global.emit(event, data, namespace='/', to=room)
+        logging.debug("Emitted %s to room '%s': %s", event, room, data)
+    else:
+        logging.warning(f"socketio_global not set, cannot emit {event}.")
+
+def tts_worker(tts_service: BaseTtsService, stream: StreamContext = None, executor=None): # Accepts the service instance
+    """Worker thread that runs the synthesis/playback pipeline over a stream's TTS queue."""
+    stream = stream or default_stream
+    logging.info(f"TTS Worker Thread Started (Using: {tts_service.__class__.__name__}, Stream: '{stream.stream_id}').")
+    if TTS_LATENCY_TARGET_S > 0:
+        stream.backlog_policy = BacklogPolicy(TTS_LATENCY_TARGET_S, steps=TTS_BACKLOG_STEPS,
+                                              max_rate=TTS_BACKLOG_MAX_RATE,
+                                              truncate_chars=TTS_BACKLOG_TRUNCATE_CHARS,
+                                              protect_lanes=TTS_BACKLOG_PROTECT_LANES,
+                                              stream_id=stream.stream_id or "default")
+
+    def on_start(job, duration_s, cues):
+        overlay_channel.set_state(stream.room, q=stream.scheduler.qsize())
+        overlay_channel.publish(stream.room, START, getattr(job, 'msg_id', None),
+                                dur=round(duration_s * 1000) if duration_s else None,
+                                ch=getattr(job, 'character', None), **cues)
+
+    def on_stop(job):
+        overlay_channel.publish(stream.room, STOP, getattr(job, 'msg_id', None))
+    pipeline = TtsPipeline(
+        tts_service,
+        stream.scheduler,
+        prefetch_depth=TTS_PREFETCH_DEPTH,
+        synth_workers=TTS_SYNTH_WORKERS,
+        shutdown_event=shutdown_event,
+        on_start=on_start,
+        on_stop=on_stop,
+        executor=executor,
+        stream_id=stream.stream_id or "default",
+        player=audio_engine.channel(stream.stream_id or "default") if audio_engine else None,
+        policy=stream.backlog_policy,
+    )
+    pipeline.run() # Blocks until shutdown or a None item is received
 
     # --- End of Worker Loop ---
-    logging.info("TTS Worker: Performing service cleanup...")
-    if hasattr(tts_service, 'cleanup'): tts_service.cleanup()
+    # Shared services (multi-stream) are cleaned up once by the main thread instead.
+    if executor is None:
+        logging.info("TTS Worker: Performing service cleanup...")
+        if hasattr(tts_service, 'cleanup'): tts_service.cleanup()
     logging.info("TTS Worker Thread Finished.")
 
 # --- Flask Web Server & SocketIO ---
@@ -130,51 +400,171 @@ socketio_global = socketio
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    # Multi-stream: each OBS browser source opens /?stream=<id> to join that stream's room
+    return render_template('index.html', stream_id=request.args.get('stream', ''))
+
+@app.route('/stats')
+def stats():
+    """Queue depth, drops and wait times (plus cache counters when enabled) as JSON."""
+    data = {"queue": tts_queue.stats()}
+    if streams:
+        data["queue"] = {stream_id: ctx.scheduler.stats() for stream_id, ctx in streams.items()}
+    if chat_ingestor:
+        data["ingest"] = chat_ingestor.stats.snapshot()
+    data["overlay"] = overlay_channel.stats()
+    data["text"] = text_preprocessor.stats()
+    policies = {ctx.stream_id or "default": ctx.backlog_policy for ctx in (streams.values() if streams else [default_stream])}
+    if any(policies.values()):
+        data["backlog"] = {stream_id: policy.stats() for stream_id, policy in policies.items() if policy}
+    if audio_cache:
+        data["cache"] = audio_cache.stats()
+    if queue_wal:
+        data["wal"] = queue_wal.stats()
+    if audio_engine:
+        data["audio"] = audio_engine.stats()
+    tts_stats = active_tts_service.stats() if active_tts_service else {}
+    if tts_stats:
+        data["tts"] = tts_stats # Provider-specific: failover routing, HTTP pool timings...
+    return jsonify(data)
+
+@app.route('/metrics')
+def metrics_route():
+    """Prometheus scrape endpoint."""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/health')
+def health():
+    """Readiness probe: 200 once the TTS provider has warmed up, 503 while starting or after a failed warm-up."""
+    tts = active_tts_service.health() if active_tts_service else {"state": "starting"}
+    data = {"status": tts["state"], "uptime_s": round(time.monotonic() - started_at, 3), "tts": tts}
+    if chat_ingestor:
+        data["chat"] = {"mode": "async", "running": chat_ingestor.running}
+    elif pytchat_listener_thread:
+        data["chat"] = {"mode": "polling", "running": pytchat_listener_thread.is_alive()}
+    return jsonify(data), 200 if tts["state"] == READY else 503
 
 @socketio.on('connect', namespace='/')
 def handle_connect():
-    logging.info('Client connected')
+    stream_id = request.args.get('stream', '')
+    if stream_id:
+        join_room(stream_id)
+    logging.info(f"Client connected (stream: '{stream_id}')")
+
+@socketio.on('clock', namespace='/')
+def handle_clock(client_sent_ms=None):
+    """Clock sync for overlays: the ack carries the server time (ms since the epoch)."""
+    return server_time_ms()
 
 @socketio.on('disconnect', namespace='/')
 def handle_disconnect():
     logging.info('Client disconnected')
 
-def handle_new_pytchat_message(item):
-    """Processes messages received from the Pytchat listener."""
+def message_lane(item):
+    """Picks the scheduler priority lane for a Pytchat item."""
+    if getattr(item, 'type', '') in ('superChat', 'superSticker'):
+        return "superchat"
+    if getattr(item.author, 'isChatSponsor', False):
+        return "member"
+    return "normal"
+
+def handle_new_pytchat_message(item, stream: StreamContext = None, match=None):
+    """Processes messages received from the Pytchat listener (match may be precomputed by the batch path)."""
+    stream = stream or default_stream
+    stream_label = stream.stream_id or "default"
     try:
         message_text = getattr(item, 'message', '').strip()
         author = getattr(item.author, 'name', 'Someone')
 
-        logging.debug(f"Received message from YouTube: '{message_text}' by {author}")
-
-        # Check if the message starts with the activation phrase (case-insensitive)
-        if message_text.lower().startswith(ACTIVATION_PHRASE):
-            # Extract the actual message content aka remove the activation phrase
-            content_to_speak = message_text[len(ACTIVATION_PHRASE):].strip()
+        # Check if the message starts with any activation phrase (case-insensitive)
+        if match is None:
+            CHAT_MESSAGES.labels(stream_label).inc() # The batch path counts its whole batch instead
+            match = stream.matcher.match(message_text)
+        if match:
+            TRIGGERS_MATCHED.labels(stream_label).inc()
+            # The matcher already removed the activation phrase
+            content_to_speak = match.content
 
             if not content_to_speak:
-                logging.info("Activation phrase found but no message content.")
                 return # Ignore empty messages
-
-            logging.info(f"Activation phrase matched! Author: {author}, Content: '{content_to_speak}'")
+            if match.banned:
+                MODERATION_BLOCKED.labels(stream_label).inc()
+                return
 
             # Prepare for TTS
-            tts_text = f"{content_to_speak}" # What the TTS will actually speak
+            prepared = text_preprocessor.prepare(content_to_speak)
+            tts_text = prepared.text # What the TTS will actually speak
             display_text = f"{author}: {content_to_speak}" # What appears in the bubble
-
-            # Emit display message to overlay
-            if socketio_global:
-                socketio_global.emit('new_message', {'text': display_text}, namespace='/')
-                logging.debug(f"Emitted display message: {display_text}")
-
-            # Put job onto TTS queue
-            tts_queue.put(tts_text)
-            logging.info(f"Queued TTS job: {tts_text}")
+            if not tts_text:
+                logging.debug("Nothing left to speak after preprocessing: '%s'", content_to_speak)
+                return
+
+            # Put job onto TTS queue (the scheduler may refuse it under flood control)
+            job = TtsJob(tts_text, author=author, lane=message_lane(item),
+                         voice_id=match.rule.voice_id, character=match.rule.character)
+            if len(prepared.chunks) > 1:
+                job.chunks = prepared.chunks
+            TEXT_CHARS_SAVED.labels(stream_label).inc(prepared.chars_saved)
+            TEXT_CHUNKS.labels(stream_label).observe(len(prepared.chunks))
+            logging.debug("Preprocessed message from %s: %d -> %d chars (%d saved), %d chunks",
+                          author, prepared.original_chars, len(tts_text), prepared.chars_saved, len(prepared.chunks))
+            trace(job, "preprocessed", "%d -> %d chars (%d saved), %d chunks",
+                  prepared.original_chars, len(tts_text), prepared.chars_saved, len(prepared.chunks))
+            if not stream.scheduler.put(job):
+                trace(job, "rejected", "by scheduler (%s: '%s')", author, tts_text)
+                return
+            trace(job, "queued", "msg %s, lane %s (%s: '%s')", job.msg_id, job.lane, author, tts_text)
+
+            # Send the display message to the overlay (batched with other overlay events)
+            overlay_channel.set_state(stream.room, q=stream.scheduler.qsize())
+            overlay_channel.publish(stream.room, MSG, job.msg_id, text=display_text,
+                                    pos=stream.scheduler.lane_position(job.lane), ch=job.character)
 
     except Exception as e:
         logging.exception(f"Error handling Pytchat message: {getattr(item, 'json', str(item))}")
 
+def handle_new_pytchat_batch(items, stream: StreamContext = None):
+    """Batch hand-off from the async ingestor: trigger matching and moderation run over the whole batch."""
+    stream = stream or default_stream
+    CHAT_MESSAGES.labels(stream.stream_id or "default").inc(len(items))
+    matches = stream.matcher.match_batch([getattr(item, 'message', '').strip() for item in items])
+    for item, match in zip(items, matches):
+        if shutdown_event.is_set():
+            break
+        if match is not None:
+            handle_new_pytchat_message(item, stream, match)
+
+# --- Multi-Stream Startup ---
+def start_multi_stream(base_service: BaseTtsService, ingestor: AsyncChatIngestor):
+    """
+    Builds a StreamContext per configured stream and starts one playback thread
+    each. All streams share base_service (client + cache), one synthesis pool and
+    the given ingest loop. Returns the shared synthesis executor.
+    """
+    scheduler_defaults = dict(
+        capacity=TTS_QUEUE_CAPACITY, lanes=TTS_PRIORITY_LANES, overflow_policy=TTS_QUEUE_OVERFLOW,
+        max_age_s=TTS_QUEUE_MAX_AGE_S, author_rate_per_min=TTS_AUTHOR_RATE_PER_MIN,
+        author_burst=TTS_AUTHOR_BURST, dedupe_window_s=TTS_DEDUPE_WINDOW_S,
+    )
+    synth_executor = ThreadPoolExecutor(max_workers=MULTI_STREAM_SYNTH_WORKERS, thread_name_prefix="tts-synth")
+    for entry in load_stream_configs(STREAMS_CONFIG):
+        ctx = build_stream_context(entry, base_service, scheduler_defaults, ACTIVATION_PHRASE, moderation_filter)
+        streams[ctx.stream_id] = ctx
+        if queue_wal:
+            attach_queue_wal(ctx)
+        if ctx.video_id:
+            try:
+                # interruptable=False: only one SIGINT handler, and the ingest loop terminates sources itself
+                chat = pytchat.create(video_id=ctx.video_id, interruptable=False)
+                ingestor.add_source(PytchatSource(chat, video_id=ctx.video_id, name=ctx.stream_id),
+                                    lambda items, ctx=ctx: handle_new_pytchat_batch(items, ctx))
+            except Exception as e:
+                logging.error(f"Stream '{ctx.stream_id}': failed to create Pytchat instance: {e}")
+        ctx.tts_thread = threading.Thread(target=tts_worker, args=(ctx.tts_service, ctx, synth_executor),
+                                          name=f"tts-{ctx.stream_id}", daemon=True)
+        ctx.tts_thread.start()
+        logging.info(f"Stream '{ctx.stream_id}' started (video: {ctx.video_id}, overlay: /?stream={ctx.stream_id})")
+    return synth_executor
+
 # --- Pytchat Listener Function ---
 def pytchat_listener_loop(chat: pytchat.LiveChat, callback):
     """The loop that gets messages from an existing Pytchat instance."""
@@ -247,7 +637,11 @@ if __name__ == '__main__':
 
     # --- Determine Run Mode ---
     run_youtube_mode = False
-    if LOOK_FOR_YOUTUBE_ID and YOUTUBE_VIDEO_ID:
+    run_multi_stream = bool(STREAMS_CONFIG)
+    synth_executor = None # Shared synthesis pool (multi-stream mode only)
+    if run_multi_stream:
+        logging.info(f"Streams config found ({STREAMS_CONFIG}). Running in multi-stream mode.")
+    elif LOOK_FOR_YOUTUBE_ID and YOUTUBE_VIDEO_ID:
         logging.info("YouTube Video ID found. Attempting to run in YouTube Live mode.")
         run_youtube_mode = True
     else:
@@ -255,12 +649,21 @@ if __name__ == '__main__':
 
     # --- Initialize TTS Service ---
     try:
-        logging.info(f"Initializing TTS provider: {TTS_PROVIDER}")
-        active_tts_service = get_tts_service(TTS_PROVIDER, TTS_CONFIG)
+        init_tts_service()
     except Exception as e:
         logging.error(f"FATAL: Failed to initialize TTS service '{TTS_PROVIDER}'. Error: {e}")
         exit(1)
 
+    # --- Start Audio Engine (before any TTS worker picks its playback channel) ---
+    init_audio_engine()
+
+    # --- Open Queue WAL (re-queues messages left unplayed by the last run) ---
+    try:
+        open_queue_wal()
+    except OSError as e:
+        logging.error(f"FATAL: Failed to open queue WAL in '{TTS_WAL_DIR}'. Error: {e}")
+        exit(1)
+
     # --- Create Pytchat Instance in MAIN THREAD (if applicable) ---
     if run_youtube_mode:
         try:
@@ -279,7 +682,21 @@ if __name__ == '__main__':
 
     # --- Start Input Source Thread (Listener or Manual) ---
     input_thread = None # <<< ADD: Variable to hold the input thread
-    if run_youtube_mode and pytchat_instance:
+    if run_multi_stream:
+        logging.info("Starting shared chat ingest loop and per-stream TTS workers...")
+        chat_ingestor = AsyncChatIngestor(min_interval_s=CHAT_MIN_POLL_S, max_interval_s=CHAT_MAX_POLL_S)
+        try:
+            synth_executor = start_multi_stream(active_tts_service, chat_ingestor)
+        except (OSError, ValueError) as e:
+            logging.error(f"FATAL: Failed to load streams config '{STREAMS_CONFIG}'. Error: {e}")
+            exit(1)
+        input_thread = chat_ingestor.start()
+    elif run_youtube_mode and pytchat_instance and CHAT_INGEST_MODE == "async":
+        logging.info("Starting async chat ingest loop...")
+        chat_ingestor = AsyncChatIngestor(min_interval_s=CHAT_MIN_POLL_S, max_interval_s=CHAT_MAX_POLL_S)
+        chat_ingestor.add_source(PytchatSource(pytchat_instance, video_id=YOUTUBE_VIDEO_ID), handle_new_pytchat_batch)
+        input_thread = chat_ingestor.start()
+    elif run_youtube_mode and pytchat_instance:
         logging.info("Starting Pytchat listener thread...")
         pytchat_listener_thread = threading.Thread( # <<< CHANGE: Use specific name <<<
             target=pytchat_listener_loop,
@@ -296,10 +713,11 @@ if __name__ == '__main__':
         manual_input_thread.start()
 
 
-    # --- Start TTS Worker Thread ---
-    logging.info("Starting TTS worker thread...")
-    tts_thread = threading.Thread(target=tts_worker, args=(active_tts_service,), daemon=True)
-    tts_thread.start()
+    # --- Start TTS Worker Thread (multi-stream mode already started one per stream) ---
+    if not run_multi_stream:
+        logging.info("Starting TTS worker thread...")
+        tts_thread = threading.Thread(target=tts_worker, args=(active_tts_service,), daemon=True)
+        tts_thread.start()
 
     # --- Start Flask Server ---
     logging.info("Starting Flask-SocketIO server on http://127.0.0.1:5000")
@@ -317,8 +735,13 @@ if __name__ == '__main__':
         # 1. Signal all threads to stop
         logging.info("Setting shutdown event...")
         shutdown_event.set()
+        overlay_channel.stop()
 
-        # 2. Stop Pytchat instance (if it exists)
+        # 2. Stop the async ingest loop (closes its sources) and Pytchat instance (if it exists)
+        if chat_ingestor:
+            logging.info("Stopping chat ingest loop...")
+            chat_ingestor.stop()
+            logging.info(f"Chat ingest stats: {chat_ingestor.stats.snapshot()}")
         # This should help unblock the listener thread's get() call
         if pytchat_instance:
             logging.info("Terminating Pytchat instance...")
@@ -351,4 +774,26 @@ if __name__ == '__main__':
             else:
                  logging.info("TTS worker thread joined successfully.")
 
+        # 5. Multi-stream: stop every stream's worker, then the shared pool and service
+        if streams:
+            for ctx in streams.values():
+                ctx.scheduler.put(None)
+            for ctx in streams.values():
+                if ctx.tts_thread and ctx.tts_thread.is_alive():
+                    ctx.tts_thread.join(timeout=10)
+                    if ctx.tts_thread.is_alive():
+                        logging.warning(f"TTS worker for stream '{ctx.stream_id}' did not exit cleanly after timeout.")
+            if synth_executor:
+                synth_executor.shutdown(wait=False, cancel_futures=True)
+            active_tts_service.cleanup()
+
+        # 6. Close the audio output once every worker has finished its last clip
+        if audio_engine:
+            audio_engine.stop()
+
+        # 7. Commit the queue WAL last: whatever is still queued or was cut off stays
+        #    unfinished in the log and is re-queued on the next start.
+        if queue_wal:
+            queue_wal.close()
+
         logging.info("Application finished.")
\ No newline at end of file
@@ -0,0 +1,151 @@
+import time
+import threading
+import logging
+from collections import deque
+
+import httpx
+
+# --- Request Timings ---
+class RequestTiming:
+    """Phases of one HTTP request, filled in from httpcore trace events (seconds, monotonic)."""
+    __slots__ = ("method", "path", "started", "connect_started", "connected", "headers_received", "closed")
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.started = time.monotonic()
+        self.connect_started = None # None = an idle pooled connection was reused
+        self.connected = None
+        self.headers_received = None
+        self.closed = None
+
+    @property
+    def reused(self):
+        return self.connect_started is None
+
+    def as_dict(self):
+        def ms(end, start):
+            return round((end - start) * 1000, 1) if end is not None and start is not None else None
+        return {
+            "path": self.path,
+            "reused": self.reused,
+            "connect_ms": ms(self.connected, self.connect_started), # TCP + TLS (+ HTTP/2 preface)
+            "ttfb_ms": ms(self.headers_received, self.started),
+            "total_ms": ms(self.closed, self.started),
+        }
+
+
+def _median(values):
+    values = sorted(v for v in values if v is not None)
+    return values[len(values) // 2] if values else None
+
+
+# --- Connection Pool ---
+class HttpPool:
+    """
+    One shared, tuned httpx.Client for a provider: bounded pool, long keep-alive,
+    per-phase timeouts and HTTP/2 when the `h2` package is installed. Records
+    connect / time-to-first-byte / total per request, and can send a cheap
+    heartbeat request while idle so the next chat burst finds a warm connection.
+    """
+    def __init__(self, base_url, pool_size=10, keepalive_expiry_s=120.0, connect_timeout_s=5.0,
+                 read_timeout_s=30.0, http2=True, heartbeat_s=0.0, heartbeat_path="/v1/models",
+                 heartbeat_headers=None, timing_window=200):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(read_timeout_s, connect=connect_timeout_s, pool=connect_timeout_s)
+        if http2:
+            try:
+                import h2 # noqa: F401 - httpx only needs it to be importable
+            except ImportError:
+                logging.warning("HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1 keep-alive.")
+                http2 = False
+        self.http2 = http2
+        self.client = httpx.Client(
+            http2=http2,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                                keepalive_expiry=keepalive_expiry_s),
+            event_hooks={"request": [self._on_request]},
+        )
+        self.heartbeat_s = float(heartbeat_s) # 0 = no heartbeat
+        self.heartbeat_path = heartbeat_path
+        self.heartbeat_headers = heartbeat_headers or {}
+        self.timings = deque(maxlen=timing_window)
+        self.requests = 0
+        self.connections_opened = 0
+        self.heartbeats = 0
+        self.last_request_at = time.monotonic()
+        self.last_heartbeat_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat_thread = None
+
+    def _on_request(self, request):
+        # Provider SDKs usually pass one flat timeout per request, which would
+        # replace the per-phase timeouts configured above; restore them here.
+        request.extensions["timeout"] = self.timeout.as_dict()
+        timing = RequestTiming(request.method, request.url.path)
+        heartbeat = request.extensions.get("heartbeat", False)
+        request.extensions["trace"] = lambda event, info: self._trace(timing, event, heartbeat)
+        if not heartbeat:
+            with self._lock:
+                self.requests += 1
+                self.last_request_at = timing.started
+
+    def _trace(self, timing, event, heartbeat=False):
+        now = time.monotonic()
+        if event == "connection.connect_tcp.started":
+            timing.connect_started = now
+            with self._lock:
+                self.connections_opened += 1
+        elif event in ("connection.start_tls.complete", "connection.connect_tcp.complete"):
+            timing.connected = now # TLS completes after TCP, so this ends up as the later of the two
+        elif event.endswith("receive_response_headers.complete"):
+            timing.headers_received = now
+        elif event.endswith("response_closed.complete") and not heartbeat:
+            timing.closed = now
+            with self._lock:
+                self.timings.append(timing)
+            logging.debug(f"HTTP {timing.method} {timing.path}: {timing.as_dict()}")
+
+    # --- Heartbeat ---
+    def start_heartbeat(self):
+        if self.heartbeat_s <= 0 or self._heartbeat_thread is not None:
+            return
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="http-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_s / 2):
+            with self._lock:
+                idle_s = time.monotonic() - max(self.last_request_at, self.last_heartbeat_at)
+            if idle_s < self.heartbeat_s:
+                continue # Recent traffic is keeping the connection warm
+            self.last_heartbeat_at = time.monotonic()
+            try:
+                self.client.get(self.base_url + self.heartbeat_path, headers=self.heartbeat_headers,
+                                extensions={"heartbeat": True}).close()
+                self.heartbeats += 1
+            except httpx.HTTPError as e:
+                logging.debug(f"HTTP heartbeat failed: {e}")
+
+    # --- Stats / Cleanup ---
+    def stats(self):
+        with self._lock:
+            timings = [t.as_dict() for t in self.timings]
+            requests, opened, heartbeats = self.requests, self.connections_opened, self.heartbeats
+        fresh = [t for t in timings if not t["reused"]]
+        return {
+            "http2": self.http2,
+            "requests": requests,
+            "connections_opened": opened,
+            "heartbeats": heartbeats,
+            "reused_ratio": (len(timings) - len(fresh)) / len(timings) if timings else None,
+            "connect_ms_p50": _median(t["connect_ms"] for t in fresh),
+            "ttfb_ms_p50": _median(t["ttfb_ms"] for t in timings),
+            "total_ms_p50": _median(t["total_ms"] for t in timings),
+        }
+
+    def close(self):
+        self._stop.set()
+        self.client.close()
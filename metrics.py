@@ -0,0 +1,227 @@
+import math
+import random
+import threading
+import logging
+
+# --- Metrics ---
+# Minimal in-process counters / gauges / histograms rendered in the Prometheus
+# text format (served at /metrics). Updating a metric is a dict lookup and an
+# add under a lock, cheap enough for the per-message hot path, unlike logging.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {} # label values -> child
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values):
+        """The child metric for these label values (created on first use)."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _ValueChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = float(value)
+
+    def render(self, name, labelnames, key):
+        return [f"{name}{_label_str(labelnames, key)} {_number(self.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labelnames, key):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_label_str(labelnames, key, [('le', _number(bound))])} {cumulative}")
+        lines.append(f"{name}_bucket{_label_str(labelnames, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_label_str(labelnames, key)} {_number(total)}")
+        lines.append(f"{name}_count{_label_str(labelnames, key)} {count}")
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount=1.0):
+        self._children[()].inc(amount)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def set(self, value):
+        self._children[()].set(value)
+
+    def inc(self, amount=1.0):
+        self._children[()].inc(amount)
+
+    def dec(self, amount=1.0):
+        self._children[()].dec(amount)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets[:-1])
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+
+# --- Registry ---
+_registry = {}   # name -> metric
+_collectors = [] # callables run at scrape time, see register_collector
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            return existing # Re-importing a module must not create a second series
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def register_collector(collect):
+    """
+    collect() runs on every scrape and updates metrics from state that is
+    cheaper to read on demand (queue depth, cache counters...) than to track.
+    """
+    _collectors.append(collect)
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    for collect in list(_collectors):
+        try:
+            collect()
+        except Exception as e:
+            logging.error(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Trace IDs & Sampled Logging ---
+# Every message gets a trace id when it is accepted. Per-stage log lines are
+# only written for a sampled fraction of messages (TRACE_SAMPLE_RATE), so
+# un-sampled messages pay one attribute check per stage and nothing else:
+# messages are %-style and only formatted for sampled items.
+trace_logger = logging.getLogger("trace")
+_sample_rate = 0.0
+
+
+def set_trace_sample_rate(rate):
+    global _sample_rate
+    _sample_rate = max(0.0, min(1.0, float(rate)))
+
+
+def new_trace_id():
+    return f"{random.getrandbits(64):016x}"
+
+
+def should_sample():
+    return _sample_rate > 0 and random.random() < _sample_rate
+
+
+def trace(item, stage, fmt, *args):
+    """Log one pipeline stage for a sampled item (TtsJob or anything with trace_id/sampled)."""
+    if getattr(item, "sampled", False):
+        trace_logger.info("[trace %s] %s: " + fmt, item.trace_id, stage, *args)
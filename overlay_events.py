@@ -0,0 +1,107 @@
+import time
+import threading
+import logging
+
+# --- Overlay Event Channel ---
+#
+#   listener / TTS workers --publish()--> per-room pending batch --(window)--> one "overlay" emit per room
+#
+# Every event carries the server time it happened at ("at", ms since the epoch),
+# and every batch carries the server time it was sent at ("t"). Overlays sync
+# their clock with the "clock" Socket.IO call and schedule bubbles / mouth
+# animation themselves from those timestamps, so batching delay doesn't shift
+# the animation.
+
+# Event kinds
+MSG = "msg"     # Message accepted into the TTS queue: text, pos (queue position, 0 = already being synthesized), ch (character)
+START = "start" # Playback started: dur (expected audio duration ms, when known), ch, and with the audio engine:
+                #   lat (ms until the clip is audible) and env (clip loudness 0-100 per 50ms, for the mouth)
+                #   Long messages split into chunks send one start per chunk and a single stop at the end
+STOP = "stop"   # Playback ended
+
+
+def server_time_ms():
+    return int(time.time() * 1000)
+
+
+class OverlayEventChannel:
+    """
+    Collects overlay events per room for `window_s` and sends them as one
+    compact "overlay" payload: {"t": sent_at_ms, "ev": [...], **state}.
+    State fields (e.g. queue depth "q") are coalesced: only the latest value
+    per room is sent. window_s <= 0 sends every event immediately.
+    """
+    def __init__(self, emit, window_s=0.05, event_name="overlay"):
+        self.emit = emit # emit(event_name, payload, room)
+        self.window_s = float(window_s)
+        self.event_name = event_name
+        self._pending = {} # room -> [event, ...]
+        self._state = {}   # room -> {field: latest value}
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.events_published = 0
+        self.batches_emitted = 0
+
+    def publish(self, room, kind, msg_id=None, **fields):
+        event = {"k": kind, "at": server_time_ms()}
+        if msg_id is not None:
+            event["id"] = msg_id
+        event.update((k, v) for k, v in fields.items() if v is not None)
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            self._pending.setdefault(room, []).append(event)
+            self.events_published += 1
+            self._cond.notify()
+        if self.window_s <= 0:
+            self.flush()
+
+    def set_state(self, room, **fields):
+        with self._cond:
+            self._state.setdefault(room, {}).update(fields)
+            self._cond.notify()
+
+    def flush(self):
+        with self._cond:
+            pending, self._pending = self._pending, {}
+            state, self._state = self._state, {}
+        sent_at = server_time_ms()
+        for room in set(pending) | set(state):
+            payload = {"t": sent_at, "ev": pending.get(room, [])}
+            payload.update(state.get(room, {}))
+            try:
+                self.emit(self.event_name, payload, room)
+            except Exception as e:
+                logging.error(f"Overlay channel: emit to room '{room}' failed: {e}")
+                continue
+            with self._cond:
+                self.batches_emitted += 1
+
+    # --- Flush Thread ---
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                while not (self._pending or self._state) and not self._stop.is_set():
+                    self._cond.wait()
+            # The first event of a batch opens the window; everything arriving meanwhile rides along.
+            self._stop.wait(self.window_s)
+            self.flush()
+
+    def start(self):
+        """Start the flush thread (also done on the first publish)."""
+        with self._cond:
+            if self.window_s > 0 and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="overlay-events", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {"events": self.events_published, "batches": self.batches_emitted}
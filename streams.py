@@ -0,0 +1,87 @@
+import json
+import logging
+
+from tts_scheduler import TtsScheduler
+from trigger_matcher import TriggerMatcher, TriggerRule
+
+# --- Per-Stream Context ---
+class StreamContext:
+    """
+    Everything that belongs to one YouTube stream / overlay: its activation
+    phrase, voice, TTS scheduler and Socket.IO room. Providers, the synthesis
+    worker pool, the audio cache and the ingest loop are shared between streams.
+    """
+    def __init__(self, stream_id, video_id=None, activation_phrase="faust says ",
+                 tts_service=None, scheduler=None, room=None, matcher=None):
+        self.stream_id = stream_id
+        self.video_id = video_id
+        self.activation_phrase = activation_phrase.lower()
+        self.matcher = matcher or TriggerMatcher([TriggerRule(activation_phrase)])
+        self.tts_service = tts_service
+        self.scheduler = scheduler or TtsScheduler()
+        self.room = room # None = broadcast to every connected overlay
+        self.tts_thread = None
+        self.backlog_policy = None # backlog_policy.BacklogPolicy, created by the TTS worker
+
+    def __repr__(self):
+        return f"StreamContext({self.stream_id!r}, video_id={self.video_id!r})"
+
+
+# --- Config Loading ---
+# Keys accepted per stream in the streams config file. Anything not given
+# falls back to the single-stream defaults from chat_overlay.py.
+STREAM_CONFIG_KEYS = (
+    "id", "video_id", "activation_phrase", "voice_id", "triggers",
+    "queue_capacity", "queue_overflow", "queue_max_age_s",
+    "author_rate_per_min", "author_burst", "dedupe_window_s",
+)
+
+def load_stream_configs(path):
+    """
+    Reads a JSON file of the form {"streams": [{"id": ..., "video_id": ..., ...}, ...]}.
+    Raises ValueError on missing/duplicate ids or unknown keys.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("streams", []) if isinstance(data, dict) else data
+    seen = set()
+    for entry in entries:
+        stream_id = entry.get("id")
+        if not stream_id:
+            raise ValueError(f"Stream entry without an 'id': {entry}")
+        if stream_id in seen:
+            raise ValueError(f"Duplicate stream id: {stream_id}")
+        seen.add(stream_id)
+        unknown = set(entry) - set(STREAM_CONFIG_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown keys for stream '{stream_id}': {sorted(unknown)}")
+        if not entry.get("video_id"):
+            logging.warning(f"Stream '{stream_id}' has no video_id; it will only receive overlay events.")
+    logging.info(f"Loaded {len(entries)} stream configs from {path}")
+    return entries
+
+
+def build_stream_context(entry, base_service, scheduler_defaults, default_phrase, moderation=None):
+    """
+    Creates a StreamContext from one config entry, sharing base_service's client
+    and cache and the compiled moderation filter. "triggers" (same shape as in the
+    triggers config) overrides the single activation_phrase.
+    """
+    scheduler_kwargs = dict(scheduler_defaults)
+    for config_key, kwarg in (("queue_capacity", "capacity"), ("queue_overflow", "overflow_policy"),
+                              ("queue_max_age_s", "max_age_s"), ("author_rate_per_min", "author_rate_per_min"),
+                              ("author_burst", "author_burst"), ("dedupe_window_s", "dedupe_window_s")):
+        if config_key in entry:
+            scheduler_kwargs[kwarg] = entry[config_key]
+    service = base_service.for_voice(entry["voice_id"]) if entry.get("voice_id") else base_service
+    phrase = entry.get("activation_phrase", default_phrase)
+    rules = [TriggerRule(t["phrase"], t.get("voice_id"), t.get("character")) for t in entry.get("triggers", [])]
+    return StreamContext(
+        stream_id=entry["id"],
+        video_id=entry.get("video_id"),
+        activation_phrase=phrase,
+        tts_service=service,
+        scheduler=TtsScheduler(**scheduler_kwargs),
+        room=entry["id"],
+        matcher=TriggerMatcher(rules or [TriggerRule(phrase)], moderation),
+    )
@@ -0,0 +1,197 @@
+import re
+import threading
+import unicodedata
+
+# --- Text Preprocessing ---
+# Turns a chat message into what is actually worth sending to the TTS provider:
+# URLs and emoji are stripped (or spoken briefly), character/word spam is
+# collapsed and the length is capped. Long results are split at sentence
+# boundaries into chunks the pipeline synthesizes in parallel and plays in order.
+
+URL_RE = re.compile(r"(?:https?://|www\.)[^\s]+", re.IGNORECASE)
+# Runs of YouTube / member emoji (":face-blue-smiling::yt:"); not times or ratios like "10:30:45" / "a:b:c"
+SHORTCODE_RE = re.compile(r"(?<![\w:])(?::[a-z][a-z0-9_\-]*:)+(?![\w:])", re.IGNORECASE)
+SENTENCE_END_RE = re.compile(r"(?<=[.!?。！？])\s+")
+CLAUSE_END_RE = re.compile(r"(?<=[,;:、，])\s+")
+
+# URL / emoji handling
+STRIP = "strip" # Remove entirely
+SPEAK = "speak" # URLs: the domain ("youtube dot com"); emoji: their name ("smiling face")
+KEEP = "keep"   # Pass through untouched
+
+
+# Emoji blocks only: the wider "Symbol, other" category also holds text like "°" and "©"
+EMOJI_RANGES = (
+    ("\u2300", "\u23ff"),         # Misc technical (⌚, ⏰)
+    ("\u2600", "\u27bf"),         # Misc symbols, dingbats (☀, ✨)
+    ("\u2b00", "\u2bff"),         # Misc symbols and arrows (⭐, ⬛)
+    ("\U0001f000", "\U0001faff"), # Pictographs, flags, skin tones (😂, 🇯🇵, 🏻)
+    ("\U000e0020", "\U000e007f"), # Tags (subdivision flags)
+)
+EMOJI_JOINERS = "\u200d\ufe0f\u20e3" # ZWJ, emoji variation selector, keycap: glue sequences together
+
+
+def _is_emoji(char):
+    return char in EMOJI_JOINERS or any(low <= char <= high for low, high in EMOJI_RANGES)
+
+
+def truncate_text(text, max_chars):
+    """Cut text to at most max_chars, at a word boundary unless that loses more than half of it."""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > max_chars // 2 else cut).rstrip(" ,;:")
+
+
+class PreparedText:
+    """Result of TextPreprocessor.prepare(): the text to speak and its synthesis chunks."""
+    __slots__ = ("text", "chunks", "original_chars")
+
+    def __init__(self, text, chunks, original_chars):
+        self.text = text
+        self.chunks = chunks
+        self.original_chars = original_chars
+
+    @property
+    def chars_saved(self):
+        # NFKC ("ﬁ" -> "fi") and spoken emoji names can make the text longer: that saves nothing
+        return max(0, self.original_chars - len(self.text))
+
+    def __repr__(self):
+        return f"PreparedText({self.text!r}, chunks={len(self.chunks)}, saved={self.chars_saved})"
+
+
+class TextPreprocessor:
+    """
+    max_chars caps the spoken text (cut at a word boundary), max_repeat limits
+    runs of the same character ("loooool") and of the same word ("lol lol lol"),
+    chunk_chars is the target size of synthesis chunks (0 = never split).
+    """
+    def __init__(self, max_chars=300, max_repeat=3, urls=STRIP, emoji=STRIP, chunk_chars=120, min_chunk_chars=40):
+        for name, mode in (("urls", urls), ("emoji", emoji)):
+            if mode not in (STRIP, SPEAK, KEEP):
+                raise ValueError(f"Unknown {name} mode: {mode}")
+        self.max_chars = int(max_chars)
+        self.max_repeat = max(1, int(max_repeat))
+        self._repeat_char_re = re.compile(r"(\D)\1{%d,}" % self.max_repeat) # Digits are left alone: "1000000"
+        self.urls = urls
+        self.emoji = emoji
+        self.chunk_chars = int(chunk_chars)
+        self.min_chunk_chars = int(min_chunk_chars)
+
+        # --- Stats ---
+        self.lock = threading.Lock() # prepare() runs on every stream's ingest thread
+        self.messages = 0
+        self.chars_in = 0
+        self.chars_out = 0
+        self.chunked = 0
+        self.emptied = 0 # Nothing left to say (emoji/URL-only messages)
+
+    def prepare(self, text):
+        original_chars = len(text)
+        text = self.normalize(text)
+        chunks = self.split(text) if text else []
+        with self.lock:
+            self.messages += 1
+            self.chars_in += original_chars
+            self.chars_out += len(text)
+            self.chunked += len(chunks) > 1
+            self.emptied += not text
+        return PreparedText(text, chunks, original_chars)
+
+    # --- Normalization ---
+    def normalize(self, text):
+        text = unicodedata.normalize("NFKC", text)
+        if self.urls != KEEP:
+            text = URL_RE.sub(self._url, text)
+        if self.emoji != KEEP:
+            text = SHORTCODE_RE.sub(self._shortcode, text)
+            text = self._replace_emoji(text)
+        text = self._repeat_char_re.sub(lambda m: m.group(1) * self.max_repeat, text)
+        text = self._collapse_words(text.split())
+        return truncate_text(text, self.max_chars)
+
+    def _url(self, match):
+        if self.urls == STRIP:
+            return " "
+        domain = re.sub(r"^(?:https?://)?(?:www\.)?", "", match.group(0), flags=re.IGNORECASE).split("/")[0]
+        return " " + domain.replace(".", " dot ") + " "
+
+    def _shortcode(self, match):
+        if self.emoji == STRIP:
+            return " "
+        names = match.group(0).strip(":").split("::")
+        return "".join(" " + name.replace("-", " ").replace("_", " ") + " " for name in names)
+
+    def _replace_emoji(self, text):
+        out, last_name = [], None
+        for char in text:
+            if not _is_emoji(char):
+                out.append(char)
+                last_name = None
+                continue
+            if self.emoji == SPEAK and unicodedata.category(char) == "So":
+                name = unicodedata.name(char, "").lower()
+                if name and name != last_name: # "😂😂😂" is said once
+                    out.append(f" {name} ")
+                last_name = name
+            else:
+                out.append(" ")
+        return "".join(out)
+
+    def _collapse_words(self, words):
+        kept, run = [], 0
+        for i, word in enumerate(words):
+            run = run + 1 if i and word.lower() == words[i - 1].lower() else 1
+            if run <= self.max_repeat:
+                kept.append(word)
+        return " ".join(kept)
+
+    # --- Chunking ---
+    def split(self, text):
+        """
+        Sentence-sized chunks of at most chunk_chars (longer sentences are split
+        at clauses, then words). Short sentences are merged with the next one
+        so no chunk is below min_chunk_chars.
+        """
+        if self.chunk_chars <= 0 or len(text) <= self.chunk_chars:
+            return [text]
+        pieces = []
+        for sentence in SENTENCE_END_RE.split(text):
+            if len(sentence) <= self.chunk_chars:
+                pieces.append(sentence)
+                continue
+            for clause in CLAUSE_END_RE.split(sentence):
+                pieces.extend(self._split_words(clause))
+        chunks = []
+        for piece in pieces:
+            if chunks and (len(chunks[-1]) < self.min_chunk_chars or len(piece) < self.min_chunk_chars // 2) \
+                    and len(chunks[-1]) + 1 + len(piece) <= self.chunk_chars:
+                chunks[-1] += " " + piece
+            else:
+                chunks.append(piece)
+        return chunks
+
+    def _split_words(self, text):
+        parts, current = [], ""
+        for word in text.split():
+            if current and len(current) + 1 + len(word) > self.chunk_chars:
+                parts.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        if current:
+            parts.append(current)
+        return parts
+
+    def stats(self):
+        with self.lock:
+            return {
+                "messages": self.messages,
+                "chars_in": self.chars_in,
+                "chars_out": self.chars_out,
+                "chars_saved_ratio": round(1 - self.chars_out / self.chars_in, 3) if self.chars_in else 0.0,
+                "chunked": self.chunked,
+                "emptied": self.emptied,
+            }
@@ -0,0 +1,220 @@
+import re
+import json
+import bisect
+import logging
+
+# --- Trie Regex ---
+# Building one regex from a trie of literal words (instead of "w1|w2|w3...")
+# means the regex engine walks a single character tree at each position, so
+# the cost per message stays flat as the word list grows to thousands of entries.
+def trie_regex_pattern(words):
+    """Returns a regex (no anchors/boundaries) matching any of the literal words."""
+    trie = {}
+    for word in words:
+        if not word:
+            continue
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True # Terminal marker
+    if not trie:
+        return None
+    return _trie_node_pattern(trie)
+
+def _trie_node_pattern(node):
+    if "" in node and len(node) == 1:
+        return None
+    alternatives = []
+    char_class = []
+    optional = False
+    for char in sorted(node):
+        if char == "":
+            optional = True
+            continue
+        sub = _trie_node_pattern(node[char])
+        if sub is None:
+            char_class.append(re.escape(char))
+        else:
+            alternatives.append(re.escape(char) + sub)
+    char_class_only = not alternatives
+    if len(char_class) == 1:
+        alternatives.append(char_class[0])
+    elif char_class:
+        alternatives.append("[" + "".join(char_class) + "]")
+    result = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+    if optional:
+        result = result + "?" if char_class_only else f"(?:{result})?"
+    return result
+
+
+# --- Moderation ---
+MODERATION_DROP = "drop" # Don't speak or display the message at all
+MODERATION_MASK = "mask" # Replace the banned parts and speak the rest
+
+class ModerationFilter:
+    """
+    Banned literal words (compiled into one trie regex, matched as whole words,
+    case-insensitive) plus optional raw regex patterns (one combined regex).
+    Compiled once and shared by every stream's matcher. The word regex can scan
+    a whole batch in one pass; raw patterns always run per message, since
+    anchors and ".*" must not see across message boundaries.
+    """
+    MASK = "***"
+
+    def __init__(self, banned_words=(), banned_patterns=(), action=MODERATION_DROP):
+        if action not in (MODERATION_DROP, MODERATION_MASK):
+            raise ValueError(f"Unknown moderation action: {action}")
+        self.action = action
+        words = sorted({w.strip().casefold() for w in banned_words if w.strip()})
+        parts = []
+        word_pattern = trie_regex_pattern(words)
+        if word_pattern:
+            # Lookarounds instead of \b so entries starting/ending in symbols still work
+            parts.append(rf"(?<!\w){word_pattern}(?!\w)")
+        pattern_parts = [f"(?:{p})" for p in banned_patterns if p]
+        parts.extend(pattern_parts)
+        self.regex = re.compile("|".join(parts)) if parts else None
+        self.word_regex = re.compile(parts[0]) if word_pattern else None
+        self.pattern_regex = re.compile("|".join(pattern_parts)) if pattern_parts else None
+        self.word_count = len(words)
+        self.pattern_count = len(pattern_parts)
+
+    def is_banned(self, text):
+        return self.regex is not None and self.regex.search(text.casefold()) is not None
+
+    def banned_batch(self, texts):
+        """
+        Same result as is_banned() per text: one word-regex pass over the whole
+        batch, raw patterns per message. Returns a list of booleans.
+        """
+        flags = [False] * len(texts)
+        if self.regex is None or not texts:
+            return flags
+        folded = [t.casefold() for t in texts]
+        if self.word_regex is not None:
+            # Join with a non-word separator; (?!\w)/(?<!\w) treat it as a boundary.
+            starts = []
+            pos = 0
+            for text in folded:
+                starts.append(pos)
+                pos += len(text) + 1
+            for match in self.word_regex.finditer("\x00".join(folded)):
+                flags[bisect.bisect_right(starts, match.start()) - 1] = True
+        if self.pattern_regex is not None:
+            for i, text in enumerate(folded):
+                if not flags[i] and self.pattern_regex.search(text):
+                    flags[i] = True
+        return flags
+
+    def mask(self, text):
+        if self.regex is None:
+            return text
+        folded = text.casefold()
+        origin = None
+        if len(folded) != len(text):
+            # casefold() expands a few characters ("ß" -> "ss"): map folded offsets back to the original
+            origin = [i for i, char in enumerate(text) for _ in char.casefold()] + [len(text)]
+        out, last = [], 0
+        for match in self.regex.finditer(folded):
+            start, end = match.span()
+            if origin is not None:
+                start, end = origin[start], origin[end - 1] + 1 if end > start else origin[start]
+            if start < last:
+                continue # Two matches inside one expanded character
+            out.append(text[last:start])
+            out.append(self.MASK)
+            last = end
+        out.append(text[last:])
+        return "".join(out)
+
+
+# --- Triggers ---
+class TriggerRule:
+    """One activation phrase and where it routes (voice, overlay character)."""
+    __slots__ = ("phrase", "voice_id", "character")
+
+    def __init__(self, phrase, voice_id=None, character=None):
+        self.phrase = phrase.casefold()
+        self.voice_id = voice_id
+        self.character = character
+
+    def __repr__(self):
+        return f"TriggerRule({self.phrase!r}, voice_id={self.voice_id!r}, character={self.character!r})"
+
+
+class TriggerMatch:
+    """Result of a successful activation match."""
+    __slots__ = ("rule", "content", "banned")
+
+    def __init__(self, rule, content, banned=False):
+        self.rule = rule
+        self.content = content
+        self.banned = banned
+
+
+class TriggerMatcher:
+    """
+    Matches messages against many activation phrases at once (one anchored trie
+    regex over the casefolded message) and applies the moderation filter to
+    the remaining content.
+    """
+    def __init__(self, rules, moderation: ModerationFilter = None):
+        self.rules = {}
+        for rule in rules:
+            if rule.phrase in self.rules:
+                logging.warning(f"Duplicate activation phrase '{rule.phrase}', keeping the first one.")
+                continue
+            self.rules[rule.phrase] = rule
+        pattern = trie_regex_pattern(self.rules)
+        # The trie regex is greedy, so the longest matching phrase wins ("faust says loudly " over "faust says ").
+        self.regex = re.compile(pattern) if pattern else None
+        self.moderation = moderation
+
+    def _match_one(self, message, banned=None):
+        if self.regex is None:
+            return None
+        m = self.regex.match(message.casefold())
+        if m is None:
+            return None
+        rule = self.rules[m.group(0)]
+        content = message[m.end():].strip()
+        if self.moderation is not None:
+            if banned is None:
+                banned = self.moderation.is_banned(content)
+            if banned and self.moderation.action == MODERATION_MASK:
+                return TriggerMatch(rule, self.moderation.mask(content))
+        return TriggerMatch(rule, content, banned=bool(banned))
+
+    def match(self, message):
+        """Returns a TriggerMatch, or None if the message doesn't start with any activation phrase."""
+        return self._match_one(message)
+
+    def match_batch(self, messages):
+        """Matches a whole batch; moderation runs as a single pass over the triggered messages."""
+        results = [self._match_one(m, banned=False) for m in messages]
+        if self.moderation is not None:
+            triggered = [i for i, r in enumerate(results) if r is not None and r.content]
+            flags = self.moderation.banned_batch([results[i].content for i in triggered])
+            for i, banned in zip(triggered, flags):
+                if banned:
+                    results[i] = self._match_one(messages[i], banned=True)
+        return results
+
+
+# --- Config Loading ---
+def load_trigger_config(path):
+    """
+    Reads {"triggers": [{"phrase", "voice_id", "character"}...],
+           "banned_words": [...], "banned_patterns": [...]} from JSON.
+    A "banned_words_file" key may point to a plain text file, one word per line.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    rules = [TriggerRule(t["phrase"], t.get("voice_id"), t.get("character")) for t in data.get("triggers", [])]
+    banned_words = list(data.get("banned_words", []))
+    words_file = data.get("banned_words_file")
+    if words_file:
+        with open(words_file, "r", encoding="utf-8") as f:
+            banned_words.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    logging.info(f"Loaded {len(rules)} triggers and {len(banned_words)} banned words from {path}")
+    return rules, banned_words, list(data.get("banned_patterns", []))
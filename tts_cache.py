@@ -0,0 +1,260 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import unicodedata
+import logging
+from collections import OrderedDict
+
+from tts_services import BaseTtsService
+from audio_streaming import StreamingClip
+
+# --- Cache Keys ---
+def normalize_text(text):
+    """Normalization used for cache keys: NFC, trimmed, whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def cache_key(identity, text):
+    """
+    Content address for a clip: sha256 over the provider identity (provider,
+    voice, model, voice settings, output format...) and the normalized text.
+    """
+    payload = json.dumps({"identity": identity, "text": normalize_text(text)},
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# --- In-Memory LRU Tier ---
+class MemoryLruTier:
+    """Byte-bounded LRU of hot clips."""
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.size = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        audio = self._items.get(key)
+        if audio is not None:
+            self._items.move_to_end(key)
+        return audio
+
+    def put(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return # Never let one clip flush the whole tier
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._items[key] = audio
+        self.size += len(audio)
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+
+# --- On-Disk Tier ---
+class DiskTier:
+    """
+    Size-bounded directory of clips, one file per key. Writes are atomic
+    (temp file + rename) and happen outside the cache lock: write() stores the
+    file, add() then records it in the index. File mtimes double as the LRU
+    order, so the recency order survives restarts.
+    """
+    SUFFIX = ".audio"
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.size = 0
+        self.evictions = 0
+        self._index = OrderedDict() # key -> size, least recently used first
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-len(self.SUFFIX)], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self.size += size
+        self._evict()
+        logging.info(f"Audio cache: loaded {len(self._index)} clips ({self.size} bytes) from {self.directory}")
+
+    def get(self, key):
+        if key not in self._index:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            os.utime(path) # Bump recency for the next restart
+        except (OSError, ValueError) as e:
+            logging.warning(f"Audio cache: dropping unreadable entry {key}: {e}")
+            self._remove(key)
+            return None
+        self._index.move_to_end(key)
+        return audio
+
+    def write(self, key, audio):
+        """Store the clip's file. Returns False if it wasn't written. Needs no lock."""
+        if len(audio) > self.max_bytes:
+            return False
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logging.warning(f"Audio cache: failed to write {key}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def add(self, key, size):
+        """Index a clip stored by write() (under the cache lock)."""
+        self.size -= self._index.pop(key, 0)
+        self._index[key] = size
+        self.size += size
+        self._evict()
+
+    def _remove(self, key):
+        self.size -= self._index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._index:
+            key = next(iter(self._index))
+            self._remove(key)
+            self.evictions += 1
+
+
+# --- Two-Tier Cache ---
+class AudioCache:
+    """Memory LRU in front of a disk tier, with hit/miss/byte counters."""
+    def __init__(self, directory=".tts_cache", memory_max_bytes=32 * 1024 * 1024,
+                 disk_max_bytes=512 * 1024 * 1024):
+        self.lock = threading.Lock()
+        self.memory = MemoryLruTier(memory_max_bytes)
+        self.disk = DiskTier(directory, disk_max_bytes) if directory else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.bytes_stored = 0
+
+    def get(self, key):
+        with self.lock:
+            audio = self.memory.get(key)
+            if audio is not None:
+                self.memory_hits += 1
+            elif self.disk is not None:
+                audio = self.disk.get(key)
+                if audio is not None:
+                    self.disk_hits += 1
+                    self.memory.put(key, audio) # Promote to the hot tier
+            if audio is None:
+                self.misses += 1
+                return None
+            self.bytes_served += len(audio)
+            return audio
+
+    def put(self, key, audio):
+        if not audio:
+            return
+        with self.lock:
+            self.memory.put(key, audio)
+            self.bytes_stored += len(audio)
+        # The file write doesn't hold up lookups from other synthesis workers
+        if self.disk is not None and self.disk.write(key, audio):
+            with self.lock:
+                self.disk.add(key, len(audio))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "bytes_served": self.bytes_served,
+                "bytes_stored": self.bytes_stored,
+                "memory_bytes": self.memory.size,
+                "memory_evictions": self.memory.evictions,
+                "disk_bytes": self.disk.size if self.disk else 0,
+                "disk_evictions": self.disk.evictions if self.disk else 0,
+            }
+
+
+# --- Caching Service Wrapper ---
+class CachedTtsService(BaseTtsService):
+    """Wraps another BaseTtsService; cache hits skip the provider's network call entirely."""
+    def __init__(self, inner: BaseTtsService, cache: AudioCache):
+        super().__init__({"inner": inner.__class__.__name__})
+        self.inner = inner
+        self.cache = cache
+
+    def cache_identity(self):
+        return self.inner.cache_identity()
+
+    def for_voice(self, voice_id):
+        return CachedTtsService(self.inner.for_voice(voice_id), self.cache)
+
+    def warm_up(self):
+        self.inner.warm_up()
+
+    def stats(self):
+        return self.inner.stats()
+
+    def duration_s(self, audio):
+        return self.inner.duration_s(audio)
+
+    def decode(self, audio, sample_rate, channels):
+        return self.inner.decode(audio, sample_rate, channels)
+
+    def discard(self, audio):
+        self.inner.discard(audio)
+
+    def health(self):
+        return dict(super().health(), provider=self.inner.__class__.__name__)
+
+    def synthesize(self, text):
+        key = cache_key(self.inner.cache_identity(), text)
+        audio = self.cache.get(key)
+        if audio is not None:
+            logging.debug("Audio cache HIT for '%s' (%d bytes)", text, len(audio))
+            return audio
+
+        logging.debug("Audio cache MISS for '%s'", text)
+        audio = self.inner.synthesize(text)
+        if isinstance(audio, StreamingClip):
+            # Store the clip once the stream has fully arrived.
+            audio.on_complete = lambda data: self.cache.put(key, data)
+        elif isinstance(audio, (bytes, bytearray)):
+            self.cache.put(key, bytes(audio))
+        return audio
+
+    def play(self, audio):
+        self.inner.play(audio)
+
+    def cleanup(self):
+        logging.info(f"Audio cache stats: {self.cache.stats()}")
+        self.inner.cleanup()
@@ -0,0 +1,329 @@
+import copy
+import time
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from tts_services import BaseTtsService, start_warm_up
+from audio_streaming import StreamingClip
+
+# --- Circuit Breaker ---
+CLOSED = "closed"       # Healthy, requests flow normally
+OPEN = "open"           # Unhealthy, no requests until the cooldown has passed
+HALF_OPEN = "half_open" # Cooldown over, one trial request decides
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures, retries one request after `cooldown_s`."""
+    def __init__(self, failure_threshold=3, cooldown_s=30.0):
+        self.failure_threshold = int(failure_threshold)
+        self.cooldown_s = float(cooldown_s)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown_s:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def trip(self):
+        """Open immediately, e.g. for a provider that failed its startup check."""
+        with self._lock:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logging.warning(f"Circuit breaker OPEN after {self.consecutive_failures} failures.")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+# --- Rolling Latency ---
+class LatencyWindow:
+    """Rolling window of time-to-first-audio samples (seconds)."""
+    def __init__(self, size=100):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, pct):
+        with self._lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class ProviderState:
+    """Health and latency bookkeeping for one wrapped provider."""
+    def __init__(self, name, service, breaker, window_size):
+        self.name = name
+        self.service = service
+        self.breaker = breaker
+        self.latency = LatencyWindow(window_size)
+        # A dict (and lock) so per-voice copies of this state keep counting into the same totals
+        self.counts = {"successes": 0, "failures": 0, "timeouts": 0, "hedges_won": 0}
+        self._lock = threading.Lock() # Counted from callers and from the pool's done-callbacks
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "state": self.breaker.state,
+            "p50_s": self.latency.percentile(50),
+            "p95_s": self.latency.percentile(95),
+            **counts,
+            **self.service.stats(),
+        }
+
+
+class RoutedAudio:
+    """Audio from synthesize() tagged with the provider that has to play it."""
+    __slots__ = ("provider", "audio")
+
+    def __init__(self, provider, audio):
+        self.provider = provider
+        self.audio = audio
+
+
+# --- Failover Service ---
+class FailoverTtsService(BaseTtsService):
+    """
+    Composite provider. Each request goes to the healthy provider with the best
+    rolling p50 latency (config order breaks ties / cold start). If it hasn't
+    produced its first audio within the hedge delay a backup is started too,
+    and whichever is ready first wins. Errors and timeouts fall through to the
+    next provider and feed a per-provider circuit breaker.
+    """
+    def __init__(self, providers, config=None):
+        super().__init__(config)
+        self.timeout_s = float(self.config.get("timeout_s", 15.0)) # Per request, all attempts included
+        # None/0 = hedge after the primary's own rolling p95
+        self.hedge_after_s = (self.config.get("hedge_after_ms") or 0) / 1000.0 or None
+        self.min_samples = int(self.config.get("min_samples", 5)) # Before latency is trusted for routing
+        window = int(self.config.get("latency_window", 100))
+        self.providers = [
+            ProviderState(name, service,
+                          CircuitBreaker(self.config.get("failure_threshold", 3), self.config.get("cooldown_s", 30.0)),
+                          window)
+            for name, service in providers
+        ]
+        self.executor = ThreadPoolExecutor(max_workers=max(4, 4 * len(self.providers)),
+                                           thread_name_prefix="tts-failover")
+
+    def wrap_providers(self, wrapper):
+        """Replace every provider service with wrapper(service), e.g. to add caching per provider."""
+        for state in self.providers:
+            state.service = wrapper(state.service)
+
+    def for_voice(self, voice_id):
+        clone = copy.copy(self) # Shares the executor
+        clone.providers = []
+        # Per-voice services; breakers, latency windows and counters stay shared with this instance
+        for state in self.providers:
+            voiced = copy.copy(state)
+            voiced.service = state.service.for_voice(voice_id)
+            clone.providers.append(voiced)
+        return clone
+
+    def cache_identity(self):
+        return {"provider": "failover", "providers": [s.service.cache_identity() for s in self.providers]}
+
+    def warm_up(self):
+        """Warms every provider in parallel; fails only if none of them came up."""
+        threads = [start_warm_up(state.service) for state in self.providers]
+        for thread in threads:
+            thread.join()
+        failed = [state.name for state in self.providers if state.service.startup_error]
+        if failed:
+            logging.warning(f"Failover: providers failed to warm up, skipped until their cooldown ends: {failed}")
+            for state in self.providers:
+                if state.service.startup_error:
+                    state.breaker.trip()
+        if len(failed) == len(self.providers):
+            raise ConnectionError("Failover: no TTS provider warmed up successfully")
+
+    def health(self):
+        return dict(super().health(), providers={s.name: s.service.health() for s in self.providers})
+
+    # --- Routing ---
+    def _route(self):
+        """All providers, best rolling p50 first; untrusted latency keeps config order."""
+        def sort_key(item):
+            index, state = item
+            p50 = state.latency.percentile(50) if len(state.latency.samples) >= self.min_samples else None
+            return (p50 is None, p50 if p50 is not None else index, index)
+        return [state for _, state in sorted(enumerate(self.providers), key=sort_key)]
+
+    def _hedge_delay(self, state):
+        if self.hedge_after_s:
+            return self.hedge_after_s
+        p95 = state.latency.percentile(95) if len(state.latency.samples) >= self.min_samples else None
+        return p95 if p95 is not None else self.timeout_s / 2
+
+    def _attempt(self, state, text):
+        """Runs in the pool: synthesize and wait for the first audio. Returns (audio, seconds)."""
+        started = time.monotonic()
+        audio = state.service.synthesize(text)
+        if audio is None:
+            raise ValueError(f"{state.name} returned no audio")
+        if isinstance(audio, StreamingClip):
+            if not audio.first_chunk.wait(self.timeout_s):
+                audio.cancel()
+                raise TimeoutError(f"{state.name} sent no audio within {self.timeout_s:.1f}s")
+            if audio.buffer.error is not None:
+                raise audio.buffer.error
+            if audio.first_chunk_at is None:
+                raise ValueError(f"{state.name} ended its stream without audio")
+        return audio, time.monotonic() - started
+
+    def _record(self, state, future):
+        """Update health/latency from a finished attempt. Returns the audio or None."""
+        try:
+            audio, seconds = future.result()
+        except Exception as e:
+            state.count("failures")
+            state.breaker.record_failure()
+            logging.warning(f"Failover: provider '{state.name}' failed: {e}")
+            return None
+        state.count("successes")
+        state.latency.add(seconds)
+        state.breaker.record_success()
+        return audio
+
+    def _abandon(self, state, future, settled=False):
+        """
+        An attempt we stopped waiting for: still learn from it, and free its
+        audio. settled=True means its outcome was already recorded (a timeout),
+        so it must not count again when it finishes.
+        """
+        def done(f):
+            if settled:
+                audio = None if f.exception() is not None else f.result()[0]
+            else:
+                audio = self._record(state, f)
+            if audio is not None:
+                state.service.discard(audio)
+        future.add_done_callback(done)
+
+    def synthesize(self, text):
+        # Breakers are asked lazily, in routing order, so a half-open provider's
+        # single trial slot is only taken when a request is really sent to it.
+        candidates = iter(self._route())
+        started = time.monotonic()
+        deadline = started + self.timeout_s
+        pending = {} # future -> ProviderState
+        upcoming = None # Next provider whose breaker allowed a request
+
+        def next_allowed():
+            nonlocal upcoming
+            if upcoming is None:
+                upcoming = next((s for s in candidates if s.breaker.allow()), None)
+            return upcoming
+
+        def launch():
+            nonlocal upcoming
+            state = next_allowed()
+            upcoming = None
+            future = self.executor.submit(self._attempt, state, text)
+            pending[future] = state
+            return future
+
+        if next_allowed() is None:
+            raise ConnectionError("Failover: no healthy TTS provider available")
+        primary = pending[launch()]
+        hedge = None # The backup future started by the hedge, not a fallback after a failure
+        hedge_at = started + self._hedge_delay(primary)
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if not pending:
+                if next_allowed() is None:
+                    break
+                logging.info(f"Failover: falling back to '{next_allowed().name}'")
+                launch()
+            wake_at = min(deadline, hedge_at) if next_allowed() is not None else deadline
+            done, _ = wait(pending, timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                state = pending.pop(future)
+                audio = self._record(state, future)
+                if audio is None:
+                    continue
+                if future is hedge:
+                    state.count("hedges_won")
+                for other_future, other_state in pending.items():
+                    self._abandon(other_state, other_future)
+                return RoutedAudio(state, audio)
+            if time.monotonic() >= hedge_at and pending and next_allowed() is not None:
+                logging.info(f"Failover: '{primary.name}' slow, hedging with '{next_allowed().name}'")
+                hedge = launch()
+                hedge_at = float("inf") # One hedge per request
+
+        for future, state in pending.items():
+            state.count("timeouts")
+            state.breaker.record_failure() # A hung provider must still trip its breaker
+            self._abandon(state, future, settled=True)
+        if not pending:
+            raise ConnectionError("Failover: every available TTS provider failed")
+        raise TimeoutError(f"Failover: no provider produced audio within {self.timeout_s:.1f}s")
+
+    def play(self, audio):
+        if isinstance(audio, RoutedAudio):
+            audio.provider.service.play(audio.audio)
+        elif audio is not None:
+            self.providers[0].service.play(audio)
+
+    def discard(self, audio):
+        if isinstance(audio, RoutedAudio):
+            audio.provider.service.discard(audio.audio)
+
+    def duration_s(self, audio):
+        if isinstance(audio, RoutedAudio):
+            return audio.provider.service.duration_s(audio.audio)
+        return None
+
+    def decode(self, audio, sample_rate, channels):
+        if isinstance(audio, RoutedAudio):
+            return audio.provider.service.decode(audio.audio, sample_rate, channels)
+        return None
+
+    def stats(self):
+        return {state.name: state.stats() for state in self.providers}
+
+    def cleanup(self):
+        logging.info(f"Failover provider stats: {self.stats()}")
+        for state in self.providers:
+            state.service.cleanup()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        super().cleanup()
@@ -0,0 +1,414 @@
+import time
+import queue
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from metrics import trace
+from tts_services import BaseTtsService
+
+# --- Pipelined TTS (synthesis stage + playback stage) ---
+#
+#   tts_queue --> [dispatcher] --submit--> synthesis pool (N threads)
+#                      |
+#                      +--> ready queue (bounded by prefetch_depth) --> [playback] --> play()
+#
+# The dispatcher keeps up to `prefetch_depth` upcoming messages synthesizing
+# (or already synthesized) while the current clip plays. Playback always
+# happens in queue order, one clip at a time.
+#
+# With a player (an audio_engine.PlaybackChannel) the synthesis stage also
+# decodes each clip to PCM, and playback hands clips to the shared audio
+# engine instead of the provider's own play(). Until the engine's output is
+# open (it starts in the background) clips are left to the provider.
+#
+# Items with several chunks (TtsJob.chunks, long messages split at sentence
+# boundaries) have every chunk submitted to the pool at once and are played
+# chunk by chunk, so the first sentence starts while the rest still renders.
+#
+# With a backlog policy, every item taken off the queue is first checked
+# against the latency target: it may be sped up, truncated, merged with
+# similar queued items or skipped (see backlog_policy.py).
+
+_STOP = object() # Internal sentinel passed from dispatcher to playback stage
+
+# --- Metrics ---
+QUEUE_WAIT = metrics.histogram("tts_queue_wait_seconds", "Time a message waited in the TTS queue", ("stream",))
+SYNTH_SECONDS = metrics.histogram("tts_synthesis_seconds", "Time to synthesize one clip", ("stream",))
+TIME_TO_FIRST_AUDIO = metrics.histogram("tts_time_to_first_audio_seconds",
+                                        "Time from a message being queued to its playback starting", ("stream",))
+PLAYBACK_SECONDS = metrics.histogram("tts_playback_seconds", "Playback duration of one clip", ("stream",))
+INTER_CLIP_GAP = metrics.histogram("tts_inter_clip_gap_seconds",
+                                   "Silence between clips while messages were waiting", ("stream",),
+                                   buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+CHUNKING_TTFA_SAVED = metrics.histogram("tts_chunking_ttfa_saved_seconds",
+                                        "How much sooner a chunked message started than if it had waited "
+                                        "for all of its chunks", ("stream",))
+ERRORS = metrics.counter("tts_errors_total", "Messages that failed in the pipeline", ("stream", "stage"))
+
+
+def _item_text(item):
+    """Source queues may hold plain strings or TtsJob objects."""
+    return getattr(item, "text", item)
+
+def _item_chunks(item):
+    """Text pieces synthesized and played in order (one unless the item was split)."""
+    return getattr(item, "chunks", None) or [_item_text(item)]
+
+def _item_voice(item):
+    return getattr(item, "voice_id", None)
+
+def _mark_done(future):
+    future.done_at = time.monotonic()
+
+
+class GapStats:
+    """Tracks the dead air between consecutive clips while there was work waiting."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = None
+
+    def record(self, gap):
+        with self.lock:
+            self.count += 1
+            self.total += gap
+            self.max = max(self.max, gap)
+            self.last = gap
+
+    def snapshot(self):
+        with self.lock:
+            mean = self.total / self.count if self.count else 0.0
+            return {"count": self.count, "mean_s": mean, "max_s": self.max, "last_s": self.last}
+
+
+class TtsPipeline:
+    """Two-stage TTS pipeline: parallel synthesis with prefetch, ordered playback."""
+    def __init__(self, tts_service: BaseTtsService, source_queue: queue.Queue,
+                 prefetch_depth=2, synth_workers=2, shutdown_event=None,
+                 on_start=None, on_stop=None, executor=None, stream_id="default", player=None, policy=None):
+        self.tts_service = tts_service
+        self.source_queue = source_queue
+        self.prefetch_depth = max(0, int(prefetch_depth))
+        self.synth_workers = max(1, int(synth_workers))
+        self.shutdown_event = shutdown_event or threading.Event()
+        self.on_start = on_start # Called with the queue item, expected duration (s or None) and player cues right before playback
+        self.on_stop = on_stop   # Called with the queue item after playback ends (or fails)
+        self._voice_services = {} # voice_id -> tts_service.for_voice(voice_id), for per-trigger voices
+        self.player = player # None = providers play their own clips
+        self.policy = policy # backlog_policy.BacklogPolicy or None
+        self.stream_id = stream_id or "default" # Metrics label
+        self._queue_wait = QUEUE_WAIT.labels(self.stream_id)
+        self._synth_seconds = SYNTH_SECONDS.labels(self.stream_id)
+        self._ttfa = TIME_TO_FIRST_AUDIO.labels(self.stream_id)
+        self._playback_seconds = PLAYBACK_SECONDS.labels(self.stream_id)
+        self._gap = INTER_CLIP_GAP.labels(self.stream_id)
+        self._chunking_saved = CHUNKING_TTFA_SAVED.labels(self.stream_id)
+        self.gap_stats = GapStats()
+        self._last_play_end = None
+
+        # With prefetch_depth == 0 the pipeline degrades to the old serial behaviour:
+        # the playback stage synthesizes each item itself right before playing it.
+        self._ready = queue.Queue(maxsize=self.prefetch_depth) if self.prefetch_depth else None
+        self._executor = executor # Shared pool (multi-stream) or None to create our own
+        self._owns_executor = executor is None
+        self._dispatcher_thread = None
+
+    # --- Synthesis Stage ---
+    def _service_for(self, item):
+        voice_id = _item_voice(item)
+        if not voice_id:
+            return self.tts_service
+        service = self._voice_services.get(voice_id)
+        if service is None:
+            service = self._voice_services[voice_id] = self.tts_service.for_voice(voice_id)
+        return service
+
+    def _synthesize(self, item, text=None):
+        text = _item_text(item) if text is None else text
+        started = time.monotonic()
+        service = self._service_for(item)
+        audio = service.synthesize(text)
+        if self.player is not None and self.player.ready and audio is not None:
+            audio = self._decode(service, audio, getattr(item, "rate", 1.0))
+        elapsed = time.monotonic() - started
+        self._synth_seconds.observe(elapsed)
+        trace(item, "synthesized", "%.0fms", elapsed * 1000)
+        return audio
+
+    def _decode(self, service, audio, rate=1.0):
+        try:
+            clip = service.decode(audio, self.player.sample_rate, self.player.channels)
+        except Exception as e:
+            logging.warning(f"TTS Pipeline: could not decode clip for the audio engine, provider plays it instead: {e}")
+            return audio
+        return self.player.prepare(clip, rate) if clip is not None else audio
+
+    def _dequeued(self, item):
+        enqueued_at = getattr(item, "enqueued_at", None)
+        if enqueued_at is not None:
+            waited = time.monotonic() - enqueued_at
+            self._queue_wait.observe(waited)
+            trace(item, "dequeued", "waited %.0fms", waited * 1000)
+
+    def _admit(self, item):
+        """Backlog policy check for a dequeued item; False = skipped (and finished here)."""
+        if self.policy is None or getattr(item, "enqueued_at", None) is None:
+            return True
+        ahead = 1 + (self._ready.qsize() if self._ready is not None else 0) # Prefetched + the one playing
+        can_speed_up = self.player is not None and self.player.ready # Only the audio engine applies a rate
+        if self.policy.apply(item, self.source_queue, ahead, can_speed_up):
+            return True
+        try:
+            self.source_queue.task_done()
+        except ValueError:
+            pass
+        return False
+
+    def _put_ready(self, entry):
+        """Put onto the bounded ready queue, waking up periodically to check for shutdown."""
+        while not self.shutdown_event.is_set():
+            try:
+                self._ready.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _dispatch_loop(self):
+        logging.info(f"TTS Pipeline: dispatcher started (prefetch depth {self.prefetch_depth}, "
+                     f"{self.synth_workers} synthesis workers).")
+        while not self.shutdown_event.is_set():
+            try:
+                item = self.source_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is None: # Signal to exit
+                self.source_queue.task_done()
+                break
+            futures = []
+            try:
+                self._dequeued(item)
+                if not self._admit(item):
+                    continue
+                futures = [self._executor.submit(self._synthesize, item, chunk) for chunk in _item_chunks(item)]
+                for future in futures:
+                    future.add_done_callback(_mark_done)
+            except Exception:
+                # One bad item must not take the dispatcher (and every message behind it) down
+                logging.exception(f"TTS Pipeline: failed to dispatch '{_item_text(item)[:40]}', skipping it.")
+                ERRORS.labels(self.stream_id, "dispatch").inc()
+                self._release(item, futures)
+                if hasattr(self.source_queue, "complete"):
+                    self.source_queue.complete(item, "failed")
+                try:
+                    self.source_queue.task_done()
+                except ValueError:
+                    pass
+                continue
+            if not self._put_ready((item, futures, time.monotonic())):
+                self._release(item, futures)
+                self.source_queue.task_done()
+                break
+        # Always wake the playback stage so it can exit.
+        try:
+            self._ready.put(_STOP, timeout=1)
+        except queue.Full:
+            pass # Playback stage will notice shutdown_event instead
+        logging.info("TTS Pipeline: dispatcher finished.")
+
+    def _release(self, item, futures):
+        """
+        Audio these futures synthesize will never be played: cancel the ones
+        not started yet, and discard() the rest once they finish, so streams
+        stop downloading and shared memory is freed.
+        """
+        service = self._service_for(item)
+
+        def discard(future):
+            if future.cancelled() or future.exception() is not None or future.result() is None:
+                return
+            audio = future.result()
+            try:
+                if self.player is not None and self.player.accepts(audio):
+                    audio.cancel() # Decoded PCM: the provider's audio was already consumed
+                else:
+                    service.discard(audio)
+            except Exception as e:
+                logging.warning(f"TTS Pipeline: failed to release unplayed audio: {e}")
+
+        for future in futures or ():
+            if not future.cancel():
+                future.add_done_callback(discard)
+
+    def _release_ready(self):
+        """At exit: release the prefetched items nobody is going to play."""
+        while True:
+            try:
+                entry = self._ready.get_nowait()
+            except queue.Empty:
+                return
+            if entry is not _STOP:
+                self._release(entry[0], entry[1])
+
+    # --- Playback Stage ---
+    def _next_item(self):
+        """Returns (item, futures, dequeued_at) or None when the pipeline should stop."""
+        if self._ready is None:
+            return self._next_serial_item()
+        while not self.shutdown_event.is_set():
+            try:
+                entry = self._ready.get(timeout=0.5)
+                return None if entry is _STOP else entry
+            except queue.Empty:
+                continue
+        return None
+
+    def _next_serial_item(self):
+        """Serial mode: take straight from the source queue, synthesis happens at play time."""
+        while True:
+            entry = self._take_serial_item()
+            if entry is None or self._admit(entry[0]):
+                return entry
+
+    def _take_serial_item(self):
+        waiting_since = None
+        try:
+            # An item that is already waiting counts as queued before the last clip ended.
+            text = self.source_queue.get_nowait()
+            waiting_since = self._last_play_end
+        except queue.Empty:
+            text = None
+            while not self.shutdown_event.is_set():
+                try:
+                    text = self.source_queue.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    continue
+            else:
+                return None
+        if text is None:
+            self.source_queue.task_done()
+            return None
+        self._dequeued(text)
+        return (text, None, waiting_since if waiting_since is not None else time.monotonic())
+
+    def _play_one(self, item, futures, dequeued_at):
+        """Plays every chunk of one item in order (serial mode: synthesizing each right before it plays)."""
+        chunks = _item_chunks(item)
+        started = False
+        outcome = "failed"
+        interrupted = False # Cut off by shutdown: left unfinished in the WAL, re-queued on the next start
+        play_start = None
+        try:
+            for index, chunk in enumerate(chunks):
+                if index and self.shutdown_event.is_set():
+                    self._release(item, futures[index:] if futures else None)
+                    interrupted = True
+                    break
+                chunk_start = self._play_chunk(item, chunk, futures[index] if futures else None, dequeued_at,
+                                               first=not started)
+                if chunk_start is None:
+                    continue
+                started = True
+                if chunk_start is not False:
+                    outcome = "played"
+                    play_start = play_start or chunk_start
+            if play_start is not None:
+                self._playback_seconds.observe(time.monotonic() - play_start)
+                if self.policy is not None:
+                    self.policy.observe(time.monotonic() - play_start)
+                trace(item, "played", "%.0fms", (time.monotonic() - play_start) * 1000)
+            if futures and len(futures) > 1:
+                self._report_chunking(item, futures)
+        finally:
+            if started and self.on_stop and not self.shutdown_event.is_set():
+                self.on_stop(item)
+            if hasattr(self.source_queue, "complete") and not interrupted: # TtsScheduler: journal the outcome
+                self.source_queue.complete(item, outcome)
+            try:
+                self.source_queue.task_done()
+            except ValueError:
+                logging.debug("TTS Pipeline: task_done() called when not needed or queue cleared.")
+
+    def _play_chunk(self, item, text, future, dequeued_at, first):
+        """Returns the playback start time, False if playback started but failed, None if nothing started."""
+        started = False
+        stage = "synthesize"
+        try:
+            audio = future.result() if future is not None else self._synthesize(item, text)
+            if audio is None:
+                logging.warning(f"TTS Pipeline: no audio for '{text}', skipping.")
+                ERRORS.labels(self.stream_id, stage).inc()
+                return None
+
+            stage = "play"
+            service = self._service_for(item)
+            if self.player is not None and self.player.accepts(audio):
+                duration_s, cues, play = audio.duration_s, self.player.cues(audio), self.player.play
+                if self.policy is not None and audio.rate > 1.0:
+                    self.policy.sped_up(item)
+            else:
+                duration_s, cues, play = service.duration_s(audio), {}, service.play
+            # Every chunk gets its own start (duration and cues are per clip); stop follows the last one
+            if self.on_start: self.on_start(item, duration_s, cues)
+            started = True
+            play_start = time.monotonic()
+            enqueued_at = getattr(item, "enqueued_at", None)
+            if first and enqueued_at is not None:
+                self._ttfa.observe(play_start - enqueued_at)
+                trace(item, "playing", "%.0fms after queueing", (play_start - enqueued_at) * 1000)
+            # Only count the gap when this item was already waiting when the
+            # previous clip ended -- otherwise the silence is just an idle chat.
+            if self._last_play_end is not None and dequeued_at <= self._last_play_end:
+                gap = play_start - self._last_play_end
+                self.gap_stats.record(gap)
+                self._gap.observe(gap)
+
+            play(audio)
+            return play_start
+        except Exception as e:
+            ERRORS.labels(self.stream_id, stage).inc()
+            logging.error(f"!!!!!!!! ERROR in TTS pipeline processing '{text}' ({stage}): {e} !!!!!!!!")
+            return False if started else None
+        finally:
+            self._last_play_end = time.monotonic()
+
+    def _report_chunking(self, item, futures):
+        """Per message: how much sooner the first chunk could start than the whole message."""
+        done_at = [getattr(f, "done_at", None) for f in futures]
+        if None in done_at:
+            return
+        saved = max(0.0, max(done_at) - done_at[0])
+        self._chunking_saved.observe(saved)
+        trace(item, "chunked", "%d chunks, first audio %.0fms sooner", len(futures), saved * 1000)
+        logging.debug("TTS Pipeline: '%.40s' in %d chunks, first audio %.0fms sooner than waiting for the whole "
+                      "message.", _item_text(item), len(futures), saved * 1000)
+
+    def run(self):
+        """Run the pipeline. The playback stage runs in the calling thread (BLOCKING)."""
+        if self._ready is not None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.synth_workers,
+                                                    thread_name_prefix="tts-synth")
+            self._dispatcher_thread = threading.Thread(target=self._dispatch_loop,
+                                                       name="tts-dispatcher", daemon=True)
+            self._dispatcher_thread.start()
+        try:
+            while True:
+                entry = self._next_item()
+                if entry is None:
+                    break
+                self._play_one(*entry)
+        finally:
+            if self._ready is not None:
+                self._dispatcher_thread.join(timeout=2) # So it can't add to _ready behind the cleanup
+                self._release_ready()
+            if self._executor and self._owns_executor:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            stats = self.gap_stats.snapshot()
+            logging.info(f"TTS Pipeline finished. Inter-clip gaps: {stats['count']} measured, "
+                         f"mean {stats['mean_s'] * 1000:.0f}ms, max {stats['max_s'] * 1000:.0f}ms")
@@ -0,0 +1,308 @@
+import re
+import time
+import queue
+import itertools
+import threading
+import logging
+from collections import deque
+
+from metrics import new_trace_id, should_sample
+
+# --- TTS Job ---
+_job_ids = itertools.count(1) # next() on a count is atomic under the GIL
+
+class TtsJob:
+    """One accepted chat message waiting to be spoken."""
+    __slots__ = ("msg_id", "trace_id", "sampled", "text", "author", "lane", "voice_id", "character", "chunks", "rate", "enqueued_at")
+
+    def __init__(self, text, author="Someone", lane="normal", voice_id=None, character=None):
+        self.msg_id = next(_job_ids) # Lets overlays match bubbles to playback events
+        self.trace_id = new_trace_id() # Follows the message through queue, synthesis and playback logs
+        self.sampled = should_sample() # Whether per-stage trace lines are logged for this message
+        self.text = text
+        self.author = author
+        self.lane = lane
+        self.voice_id = voice_id   # Per-trigger voice override (None = stream default)
+        self.character = character # Overlay character to animate (None = default)
+        self.chunks = None # Sentence chunks for long messages (None = synthesize text in one go)
+        self.rate = 1.0 # Playback speed set by the backlog policy (pitch unchanged)
+        self.enqueued_at = time.monotonic()
+
+    def __repr__(self):
+        return f"TtsJob({self.text!r}, author={self.author!r}, lane={self.lane!r})"
+
+
+def similar_key(text):
+    """Loose comparison key: lowercase words only, repeated words collapsed."""
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(w for i, w in enumerate(words) if not i or w != words[i - 1])
+
+
+# --- Overflow Policies ---
+DROP_OLDEST = "drop_oldest" # Make room by dropping the oldest item of the lowest-priority lane
+DROP_NEWEST = "drop_newest" # Reject the incoming item while full
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+
+class TokenBucket:
+    """Simple token bucket used for per-author rate limiting."""
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, rate_per_s, burst, now):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate_per_s)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+# --- Scheduler ---
+class TtsScheduler:
+    """
+    Bounded, prioritized replacement for the raw TTS queue.Queue.
+
+    put() applies flood control (per-author rate limit, duplicate coalescing)
+    and the overflow policy; get() serves the highest-priority non-empty lane
+    and drops items older than max_age_s. The get()/task_done() interface
+    matches queue.Queue so the TTS pipeline can consume it directly.
+
+    With a journal (tts_wal.WalStream), accepted jobs and every way a job
+    leaves the queue (complete() or a drop) are logged, so unfinished jobs
+    can be restore()d after a restart.
+    """
+    def __init__(self, capacity=50, lanes=("superchat", "member", "normal"),
+                 overflow_policy=DROP_OLDEST, max_age_s=0,
+                 author_rate_per_min=0, author_burst=3, dedupe_window_s=0, journal=None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.capacity = int(capacity)
+        self.lanes = list(lanes)
+        self.overflow_policy = overflow_policy
+        self.max_age_s = float(max_age_s)   # 0 = no age limit
+        self.author_rate_per_s = float(author_rate_per_min) / 60.0 # 0 = no rate limit
+        self.author_burst = max(1, int(author_burst))
+        self.dedupe_window_s = float(dedupe_window_s) # 0 = no coalescing
+        self.journal = journal
+
+        self._lanes = {name: deque() for name in self.lanes}
+        self._control = deque() # None sentinels, always served first
+        self._size = 0
+        self._unfinished = 0
+        self._cond = threading.Condition()
+        self._buckets = {}     # author -> TokenBucket
+        self._recent = {}      # normalized text -> last accepted time
+
+        # --- Metrics ---
+        self.accepted = 0
+        self.dropped = {"rate_limited": 0, "duplicate": 0, "overflow_oldest": 0,
+                        "overflow_newest": 0, "expired": 0, "summarized": 0, "skipped": 0}
+        self.max_depth = 0
+        self.wait_count = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    # --- Producer Side ---
+    def put(self, job, block=True, timeout=None):
+        """
+        Offer a job to the scheduler. Returns True if accepted.
+        None is treated as a control sentinel and always accepted.
+        """
+        with self._cond:
+            if job is None:
+                self._control.append(None)
+                self._unfinished += 1
+                self._cond.notify()
+                return True
+
+            now = time.monotonic()
+            if not self._allow_author(job.author, now):
+                self.dropped["rate_limited"] += 1
+                logging.debug("TTS Scheduler: rate limited %s", job.author)
+                return False
+            if self._is_duplicate(job.text, now):
+                self.dropped["duplicate"] += 1
+                logging.debug("TTS Scheduler: coalesced duplicate '%s'", job.text)
+                return False
+
+            if self._size >= self.capacity:
+                self._expire(now)
+            if self._size >= self.capacity:
+                if self.overflow_policy == DROP_NEWEST or not self._drop_oldest(job.lane):
+                    self.dropped["overflow_newest"] += 1
+                    logging.debug("TTS Scheduler: queue full, dropped incoming '%s'", job.text)
+                    return False
+                self.dropped["overflow_oldest"] += 1
+
+            lane = job.lane if job.lane in self._lanes else self.lanes[-1]
+            self._lanes[lane].append(job)
+            self._size += 1
+            self._unfinished += 1
+            self.accepted += 1
+            self.max_depth = max(self.max_depth, self._size)
+            if self.journal:
+                self.journal.accepted(job)
+            self._cond.notify()
+            return True
+
+    def restore(self, job):
+        """
+        Re-queue a job recovered from the journal: skips flood control and is
+        not journaled again (its accepted record is still in the log).
+        Returns False when the queue is already full.
+        """
+        with self._cond:
+            if self._size >= self.capacity:
+                return False
+            lane = job.lane if job.lane in self._lanes else self.lanes[-1]
+            self._lanes[lane].append(job)
+            self._size += 1
+            self._unfinished += 1
+            self.max_depth = max(self.max_depth, self._size)
+            self._cond.notify()
+            return True
+
+    def _allow_author(self, author, now):
+        if self.author_rate_per_s <= 0:
+            return True
+        bucket = self._buckets.get(author)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                self._prune_buckets(now)
+            bucket = self._buckets[author] = TokenBucket(self.author_burst)
+        return bucket.take(self.author_rate_per_s, self.author_burst, now)
+
+    def _prune_buckets(self, now):
+        # A bucket that would be full again carries no state worth keeping.
+        refill_s = self.author_burst / self.author_rate_per_s
+        self._buckets = {a: b for a, b in self._buckets.items() if now - b.updated < refill_s}
+
+    def _is_duplicate(self, text, now):
+        if self.dedupe_window_s <= 0:
+            return False
+        key = " ".join(text.lower().split())
+        last = self._recent.get(key)
+        if last is not None and now - last < self.dedupe_window_s:
+            return True
+        if len(self._recent) > 10000:
+            self._recent = {k: t for k, t in self._recent.items() if now - t < self.dedupe_window_s}
+        self._recent[key] = now
+        return False
+
+    def _drop_oldest(self, incoming_lane):
+        """Drop the oldest item from the lowest-priority non-empty lane not above the incoming one."""
+        incoming_rank = self.lanes.index(incoming_lane) if incoming_lane in self._lanes else len(self.lanes) - 1
+        for rank in range(len(self.lanes) - 1, incoming_rank - 1, -1):
+            lane = self._lanes[self.lanes[rank]]
+            if lane:
+                dropped = lane.popleft()
+                self._discard(1)
+                self.complete(dropped, "dropped")
+                logging.debug("TTS Scheduler: queue full, dropped oldest '%s'", dropped.text)
+                return True
+        return False # Everything queued outranks the incoming item
+
+    def _expire(self, now):
+        if self.max_age_s <= 0:
+            return
+        for lane in self._lanes.values():
+            while lane and now - lane[0].enqueued_at > self.max_age_s:
+                dropped = lane.popleft()
+                self._discard(1)
+                self.dropped["expired"] += 1
+                self.complete(dropped, "expired")
+                logging.debug("TTS Scheduler: dropped stale '%s'", dropped.text)
+
+    def _discard(self, n):
+        self._size -= n
+        self._unfinished -= n
+
+    # --- Consumer Side (queue.Queue compatible) ---
+    def get(self, block=True, timeout=None):
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                if self._control:
+                    return self._control.popleft()
+                self._expire(time.monotonic())
+                for name in self.lanes:
+                    lane = self._lanes[name]
+                    if lane:
+                        job = lane.popleft()
+                        self._size -= 1
+                        self._record_wait(time.monotonic() - job.enqueued_at)
+                        return job
+                if not block:
+                    raise queue.Empty
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._cond.wait(remaining)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        with self._cond:
+            if self._unfinished <= 0:
+                raise ValueError("task_done() called too many times")
+            self._unfinished -= 1
+
+    def complete(self, job, outcome="played"):
+        """Record that a job left the pipeline (played, failed...), so it is not restored after a restart."""
+        if self.journal and job is not None:
+            self.journal.done(job, outcome)
+
+    def take_similar(self, job):
+        """
+        Remove the queued jobs in job's lane that say the same thing ("LOL!!" ~
+        "lol lol"), for the backlog policy to summarize them into job. Returns
+        how many were removed.
+        """
+        key = similar_key(job.text)
+        with self._cond:
+            lane = self._lanes.get(job.lane if job.lane in self._lanes else self.lanes[-1])
+            similar = [queued for queued in lane if similar_key(queued.text) == key]
+            for queued in similar:
+                lane.remove(queued)
+                self._discard(1)
+                self.dropped["summarized"] += 1
+                self.complete(queued, "summarized")
+            return len(similar)
+
+    def skip(self, job):
+        """A dequeued job the backlog policy decided not to play."""
+        with self._cond:
+            self.dropped["skipped"] += 1
+        self.complete(job, "skipped")
+
+    def _record_wait(self, wait_s):
+        self.wait_count += 1
+        self.wait_total_s += wait_s
+        self.wait_max_s = max(self.wait_max_s, wait_s)
+
+    def lane_position(self, lane):
+        """Queue position of the newest item in `lane` (1 = spoken next), ignoring anything already playing."""
+        with self._cond:
+            rank = self.lanes.index(lane) if lane in self._lanes else len(self.lanes) - 1
+            return sum(len(self._lanes[name]) for name in self.lanes[:rank + 1])
+
+    def qsize(self):
+        with self._cond:
+            return self._size
+
+    def stats(self):
+        with self._cond:
+            return {
+                "depth": self._size,
+                "depth_by_lane": {name: len(lane) for name, lane in self._lanes.items()},
+                "max_depth": self.max_depth,
+                "accepted": self.accepted,
+                "dropped": dict(self.dropped),
+                "wait_mean_s": self.wait_total_s / self.wait_count if self.wait_count else 0.0,
+                "wait_max_s": self.wait_max_s,
+            }
@@ -1,24 +1,114 @@
 import os
+import copy
 import time
-from elevenlabs.client import ElevenLabs
-from elevenlabs import play, stream, Voice, VoiceSettings
+import random
+import threading
+import wave
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
 import logging
 
+from audio_streaming import StreamingClip, play_streaming_clip
+
+# --- Startup States (see BaseTtsService.health) ---
+STARTING = "starting" # warm_up() still running
+READY = "ready"
+FAILED = "failed"     # warm_up() raised; requests are still attempted
+
 # --- Base Class (Interface Definition) ---
 class BaseTtsService:
     """Abstract base class for TTS services."""
     def __init__(self, config=None):
         """Initialize the service with optional configuration."""
         self.config = config or {}
+        self.ready = threading.Event() # Set once warm_up() has finished, successfully or not
+        self.startup_error = None
         logging.info(f"Initializing {self.__class__.__name__}")
 
-    def speak(self, text):
+    def synthesize(self, text):
         """
-        Generate audio for the text and play it (BLOCKING).
+        Generate audio for the text and return it WITHOUT playing it.
+        The returned object is opaque to callers and is handed back to play().
+        Returns None if no audio could be generated.
+        Raises NotImplementedError if not implemented by subclass.
+        """
+        raise NotImplementedError("Subclasses must implement the 'synthesize' method.")
+
+    def play(self, audio):
+        """
+        Play audio previously returned by synthesize() (BLOCKING).
         This method should block until audio playback is complete.
         Raises NotImplementedError if not implemented by subclass.
         """
-        raise NotImplementedError("Subclasses must implement the 'speak' method.")
+        raise NotImplementedError("Subclasses must implement the 'play' method.")
+
+    def speak(self, text):
+        """
+        Generate audio for the text and play it (BLOCKING).
+        Default implementation is synthesize() followed by play(), so
+        providers only need to implement those two stages.
+        """
+        audio = self.synthesize(text)
+        if audio is not None:
+            self.play(audio)
+
+    def for_voice(self, voice_id):
+        """
+        Returns a service that speaks with a different voice but shares this
+        instance's client/connections. Default is a shallow copy.
+        """
+        clone = copy.copy(self)
+        clone.config = dict(self.config, voice_id=voice_id)
+        if hasattr(clone, "voice_id"):
+            clone.voice_id = voice_id
+        return clone
+
+    def discard(self, audio):
+        """Release audio from synthesize() that will never be played (e.g. a lost hedged request)."""
+        pass
+
+    def duration_s(self, audio):
+        """Expected playback length of audio from synthesize() in seconds, or None if unknown."""
+        return None
+
+    def decode(self, audio, sample_rate, channels):
+        """
+        Convert audio from synthesize() to PCM for the shared audio engine:
+        returns an audio_engine.DecodedClip at sample_rate/channels, or None if
+        this audio can only be played by play(). Runs in the synthesis workers.
+        """
+        return None
+
+    def warm_up(self):
+        """
+        Slow one-off startup work: verifying credentials, opening connections,
+        starting engines. Raises on failure. In fast-start mode this runs in the
+        background (see start_warm_up), so synthesize() may be called before it is done.
+        """
+        pass
+
+    def stats(self):
+        """Provider-specific counters for the /stats endpoint (empty by default)."""
+        return {}
+
+    def health(self):
+        """Readiness summary for the /health endpoint."""
+        if not self.ready.is_set():
+            state = STARTING
+        else:
+            state = FAILED if self.startup_error else READY
+        return {"provider": self.__class__.__name__, "state": state, "error": self.startup_error}
+
+    def cache_identity(self):
+        """
+        Everything besides the text that changes the generated audio (provider,
+        voice, model, settings...). Used to build content-addressed cache keys.
+        """
+        identity = {k: v for k, v in self.config.items() if k != "api_key"}
+        identity["provider"] = self.__class__.__name__
+        return identity
 
     def cleanup(self):
         """Perform any cleanup needed when stopping."""
@@ -26,6 +116,16 @@ class BaseTtsService:
         pass # Optional cleanup actions
 
 # --- ElevenLabs Implementation ---
+# Latency/quality presets: ElevenLabs' optimize_streaming_latency level (0 = best
+# quality, 4 = fastest, also disables text normalization) plus the output format.
+ELEVENLABS_LATENCY_PRESETS = {
+    "quality":  {"optimize_streaming_latency": "0", "output_format": "mp3_44100_64"},
+    "default":  {"optimize_streaming_latency": "0", "output_format": "mp3_22050_32"},
+    "balanced": {"optimize_streaming_latency": "2", "output_format": "mp3_22050_32"},
+    "fast":     {"optimize_streaming_latency": "3", "output_format": "mp3_22050_32"},
+    "fastest":  {"optimize_streaming_latency": "4", "output_format": "mp3_22050_32"},
+}
+
 class ElevenLabsService(BaseTtsService):
     """TTS implementation using ElevenLabs API (online)."""
     def __init__(self, config=None):
@@ -33,25 +133,141 @@ class ElevenLabsService(BaseTtsService):
         self.api_key = self.config.get("api_key")
         self.voice_id = self.config.get("voice_id", "21m00Tcm4TlvDq8ikWAM") # Default to Adam
         self.model = self.config.get("model", "eleven_turbo_v2")  # defaults to use the turbo model for low latency
+        self.streaming = bool(self.config.get("streaming", False)) # Play chunks as they arrive instead of buffering the whole clip
+        self.stream_buffer_bytes = int(self.config.get("stream_buffer_bytes", 512 * 1024))
+        self.latency_preset = self.config.get("latency_preset", "default")
+        if self.latency_preset not in ELEVENLABS_LATENCY_PRESETS:
+            logging.warning(f"Unknown ElevenLabs latency preset '{self.latency_preset}', using 'default'.")
+            self.latency_preset = "default"
+        self.voice_settings = {
+            "stability": 0.0, # Adjust as needed
+            "similarity_boost": 1.0, # Adjust as needed
+            "style": 0.0,
+            "use_speaker_boost": True,
+        }
+        self.voice_settings.update(self.config.get("voice_settings", {}))
+        self.base_url = self.config.get("base_url") or "https://api.elevenlabs.io"
         self.client = None
+        self.http_pool = None
 
         if not self.api_key:
             logging.error("ElevenLabs API key not provided in config.")
             raise ValueError("Missing ElevenLabs API Key")
 
         try:
+            # Imported here rather than at module level: the SDK takes a noticeable
+            # share of startup time and is only needed when this provider is used.
+            from elevenlabs.client import ElevenLabs
+            from http_pool import HttpPool
+            # One pooled client shared by every request (and every per-voice copy of this
+            # service), so connections and TLS sessions are reused between messages.
+            self.http_pool = HttpPool(self.base_url, heartbeat_headers={"xi-api-key": self.api_key},
+                                      **self.config.get("http", {}))
             # API key can be set via env var or passed explicitly
             # Passing explicitly is clearer for multi-service setup
-            logging.info("Initializing ElevenLabs client...")
-            self.client = ElevenLabs(api_key=self.api_key)
-            # Verify connection (optional but recommended)
-            self.client.voices.get_all()
-            logging.info("ElevenLabs client initialized and API key verified.")
+            logging.info(f"Initializing ElevenLabs client (HTTP/2: {self.http_pool.http2})...")
+            self.client = ElevenLabs(api_key=self.api_key, base_url=self.base_url,
+                                     timeout=self.http_pool.timeout.read, httpx_client=self.http_pool.client)
         except Exception as e:
             logging.error(f"Failed to initialize ElevenLabs client: {e}")
             self.client = None # Ensure client is None if init fails
             raise ConnectionError(f"ElevenLabs initialization failed: {e}")
 
+    def warm_up(self):
+        # Verifies the API key; the request also leaves a warm connection behind for the first message.
+        started = time.monotonic()
+        try:
+            self.client.voices.get_all()
+        except Exception as e:
+            raise ConnectionError(f"ElevenLabs API key verification failed: {e}")
+        logging.info(f"ElevenLabs API key verified in {(time.monotonic() - started) * 1000:.0f}ms.")
+        self.http_pool.start_heartbeat()
+
+    def stats(self):
+        return {"http": self.http_pool.stats()} if self.http_pool else {}
+
+    def _request_kwargs(self, text):
+        from elevenlabs import VoiceSettings
+        preset = ELEVENLABS_LATENCY_PRESETS[self.latency_preset]
+        return dict(
+            text=text,
+            voice_id=self.voice_id,
+            optimize_streaming_latency=preset["optimize_streaming_latency"],
+            output_format=preset["output_format"],
+            model_id=self.model,  # turbo model for low latency, for other languages use the `eleven_multilingual_v2`
+            voice_settings=VoiceSettings(**self.voice_settings),
+        )
+
+    def cache_identity(self):
+        return {
+            "provider": "elevenlabs",
+            "voice_id": self.voice_id,
+            "model": self.model,
+            "voice_settings": self.voice_settings,
+            "output_format": ELEVENLABS_LATENCY_PRESETS[self.latency_preset]["output_format"],
+            "optimize_streaming_latency": ELEVENLABS_LATENCY_PRESETS[self.latency_preset]["optimize_streaming_latency"],
+        }
+
+    def synthesize(self, text):
+        """
+        Buffered mode: fetch the complete clip and return it as bytes.
+        Streaming mode: start the request and return a StreamingClip that fills in the background.
+        """
+        if not self.client:
+            logging.error("Cannot synthesize: ElevenLabs client is not initialized.")
+            return None
+
+        logging.debug(f"ElevenLabs generating audio for: '{text}' (Voice: {self.voice_id}, "
+                     f"Model: {self.model}, Preset: {self.latency_preset}, Streaming: {self.streaming})")
+        if self.streaming:
+            chunks = self.client.text_to_speech.convert_as_stream(**self._request_kwargs(text))
+            return StreamingClip(chunks, text=text, buffer_bytes=self.stream_buffer_bytes)
+
+        started = time.monotonic()
+        audio_stream = self.client.text_to_speech.convert(**self._request_kwargs(text))
+        # Drain the iterator here so the whole clip is ready before playback starts.
+        # This is what lets the pipeline prefetch upcoming messages.
+        audio = b"".join(audio_stream) if audio_stream else None
+        # In buffered mode audio can't start before the last byte has arrived.
+        logging.debug(f"ElevenLabs time-to-first-audio: {(time.monotonic() - started) * 1000:.0f}ms "
+                     f"(buffered, {len(text)} chars, {len(audio) if audio else 0} bytes)")
+        return audio
+
+    def discard(self, audio):
+        if isinstance(audio, StreamingClip):
+            audio.cancel() # Stop downloading
+
+    def duration_s(self, audio):
+        # Output formats are constant bitrate ("mp3_22050_32" = 32 kbps); a stream's length isn't known yet
+        if not isinstance(audio, (bytes, bytearray)):
+            return None
+        kbps = int(ELEVENLABS_LATENCY_PRESETS[self.latency_preset]["output_format"].rsplit("_", 1)[1])
+        return len(audio) * 8 / (kbps * 1000)
+
+    def decode(self, audio, sample_rate, channels):
+        from audio_engine import decode_bytes, decode_stream
+        if isinstance(audio, StreamingClip):
+            return decode_stream(audio.buffer, sample_rate, channels) # Frames become playable as they arrive
+        return decode_bytes(audio, sample_rate, channels) if audio else None
+
+    def play(self, audio):
+        """Play a clip from synthesize() (BLOCKING). Requires ffmpeg installed and in PATH."""
+        if isinstance(audio, StreamingClip):
+            logging.debug("ElevenLabs streaming playback... (BLOCKING)")
+            ttfa = play_streaming_clip(audio)
+            if ttfa is not None:
+                logging.debug(f"ElevenLabs time-to-first-audio: {ttfa * 1000:.0f}ms "
+                             f"(streaming, {len(audio.text)} chars, {audio.bytes_received} bytes)")
+            logging.debug("ElevenLabs streaming playback COMPLETED.")
+            return
+        if not audio:
+            logging.warning("ElevenLabs audio was empty, skipping playback.")
+            return
+        from elevenlabs import play as elevenlabs_play
+        logging.debug("ElevenLabs calling play function... (BLOCKING)")
+        elevenlabs_play(audio)
+        logging.debug("ElevenLabs play function COMPLETED.")
+
     def speak(self, text):
         if not self.client:
             logging.error("Cannot speak: ElevenLabs client is not initialized.")
@@ -59,49 +275,274 @@ class ElevenLabsService(BaseTtsService):
             time.sleep(1)
             return
 
-        audio_stream = None
         try:
-            logging.info(f"ElevenLabs generating audio for: '{text}' (Voice: {self.voice_id})")
-
-
-            
-            audio_stream = self.client.text_to_speech.convert(
-                text=text,
-                voice_id=self.voice_id,
-                optimize_streaming_latency="0",
-                output_format="mp3_22050_32",
-                model_id="eleven_turbo_v2",  # use the turbo model for low latency, for other languages use the `eleven_multilingual_v2`
-                voice_settings=VoiceSettings(
-                    stability=0.0, # Adjust as needed
-                    similarity_boost=1.0, # Adjust as needed
-                    style=0.0,
-                    use_speaker_boost=True,
-                ),
-            )
-            logging.info("ElevenLabs audio stream generation initiated.")
-
-            # Play the stream (blocking)
-            # Requires ffmpeg installed and in PATH
-            logging.info("ElevenLabs calling play/stream function... (BLOCKING)")
-            if audio_stream:
-                 play(audio_stream) # Use stream() for playback from the iterator
-                 logging.info("ElevenLabs play/stream function COMPLETED.")
-            else:
-                 logging.warning("ElevenLabs audio stream was None, skipping playback.")
-
+            self.play(self.synthesize(text))
         except Exception as e:
             logging.error(f"Error during ElevenLabs speak: {e}")
             # Log specific API errors if needed
-        finally:
-             # Clean up stream resource if applicable (usually handled by stream/play)
-             pass
 
     def cleanup(self):
         super().cleanup()
-        # No specific client cleanup needed for elevenlabs usually
+        if self.http_pool:
+            logging.info(f"ElevenLabs HTTP stats: {self.http_pool.stats()}")
+            self.http_pool.close()
         logging.info("ElevenLabs service cleanup complete.")
 
 
+# --- Local (Offline) Implementation ---
+# pyttsx3 drives the OS speech engine (SAPI5 / NSSpeechSynthesizer / eSpeak).
+# Each worker process owns one engine; rendering happens in a ProcessPoolExecutor
+# so several clips render in parallel without GIL contention, and the PCM is
+# handed back through a SharedMemory block instead of being pickled.
+_local_engine = None # Per worker process
+
+class PcmClip:
+    """Rendered PCM living in a SharedMemory block, owned by the parent once returned."""
+    __slots__ = ("shm_name", "nbytes", "sample_rate", "channels", "sample_width")
+
+    def __init__(self, shm_name, nbytes, sample_rate, channels, sample_width):
+        self.shm_name = shm_name
+        self.nbytes = nbytes
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+
+    @property
+    def duration_s(self):
+        frame_bytes = self.channels * self.sample_width
+        return self.nbytes / frame_bytes / self.sample_rate if frame_bytes and self.sample_rate else 0.0
+
+    def release(self):
+        """Free the shared memory block (safe to call more than once)."""
+        try:
+            shm = shared_memory.SharedMemory(name=self.shm_name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+def _local_init_engine():
+    """Runs in a worker process: start its pyttsx3 engine once and reuse it for every clip."""
+    global _local_engine
+    if _local_engine is None:
+        import pyttsx3
+        _local_engine = pyttsx3.init()
+    return os.getpid()
+
+
+def _local_voice_ids():
+    """Runs in a worker process: ids of the voices its engine has."""
+    _local_init_engine()
+    return [voice.id for voice in _local_engine.getProperty("voices")]
+
+
+def _local_render(text, rate, volume, voice):
+    """Runs in a worker process: render text to WAV with pyttsx3, return PCM via shared memory."""
+    _local_init_engine()
+    if rate:
+        _local_engine.setProperty("rate", rate)
+    if volume is not None:
+        _local_engine.setProperty("volume", volume)
+    if voice:
+        _local_engine.setProperty("voice", voice)
+
+    fd, wav_path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        _local_engine.save_to_file(text, wav_path)
+        _local_engine.runAndWait()
+        with wave.open(wav_path, "rb") as wav:
+            frames = wav.readframes(wav.getnframes())
+            params = (wav.getframerate(), wav.getnchannels(), wav.getsampwidth())
+    finally:
+        try:
+            os.remove(wav_path)
+        except OSError:
+            pass
+    if not frames:
+        return None
+
+    shm = shared_memory.SharedMemory(create=True, size=len(frames))
+    shm.buf[:len(frames)] = frames
+    clip = PcmClip(shm.name, len(frames), *params)
+    shm.close() # The parent attaches by name, plays, then unlinks
+    # Ownership passes to the parent, so this process's resource tracker must not unlink it
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return clip
+
+
+class LocalTtsService(BaseTtsService):
+    """TTS implementation using an offline engine via pyttsx3 (no network)."""
+    def __init__(self, config=None):
+        super().__init__(config)
+        self.rate = self.config.get("rate", 180) # Words per minute
+        self.volume = self.config.get("volume", 1.0)
+        self.voice_id = self.config.get("voice_id", None) # pyttsx3 voice id, None = system default
+        self.default_voice_id = self.voice_id
+        self.voices = set() # Filled by warm_up(); shared with the for_voice() copies
+        self.workers = int(self.config.get("workers", max(1, min(4, (os.cpu_count() or 2) - 1))))
+        logging.info(f"Starting local TTS process pool ({self.workers} workers)...")
+        # spawn: forking a process that already runs Flask/pipeline threads is not safe
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+
+    def warm_up(self):
+        # Spawning workers and starting their speech engines otherwise happens on the first messages
+        started = time.monotonic()
+        pids = {f.result() for f in [self.executor.submit(_local_init_engine) for _ in range(self.workers)]}
+        self.voices.update(self.executor.submit(_local_voice_ids).result())
+        logging.info(f"Local TTS: {len(pids)} worker engines started in {(time.monotonic() - started) * 1000:.0f}ms")
+
+    def _voice(self):
+        """
+        The pyttsx3 voice to speak with. Streams and triggers name ElevenLabs
+        voices (also passed here behind failover): ids this engine doesn't
+        have fall back to its default voice.
+        """
+        if self.voice_id == self.default_voice_id or self.voice_id in self.voices:
+            return self.voice_id
+        return self.default_voice_id
+
+    def cache_identity(self):
+        return dict(super().cache_identity(), voice_id=self._voice())
+
+    def synthesize(self, text):
+        logging.debug(f"Local TTS rendering audio for: '{text}'")
+        started = time.monotonic()
+        clip = self.executor.submit(_local_render, text, self.rate, self.volume, self._voice()).result()
+        if clip is not None:
+            logging.debug(f"Local TTS rendered {clip.duration_s:.1f}s of audio in {(time.monotonic() - started) * 1000:.0f}ms")
+        return clip
+
+    def play(self, audio):
+        """Play a PcmClip straight out of shared memory (BLOCKING), then free it."""
+        if audio is None:
+            return
+        import numpy as np
+        import sounddevice as sd
+        dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[audio.sample_width]
+        shm = shared_memory.SharedMemory(name=audio.shm_name)
+        try:
+            samples = np.ndarray((audio.nbytes // (audio.sample_width * audio.channels), audio.channels),
+                                 dtype=dtype, buffer=shm.buf)
+            sd.play(samples, audio.sample_rate)
+            sd.wait()
+            del samples # Drop the view before closing the block
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def discard(self, audio):
+        if audio is not None:
+            audio.release()
+
+    def duration_s(self, audio):
+        return audio.duration_s if audio is not None else None
+
+    def decode(self, audio, sample_rate, channels):
+        """Copy the PCM out of shared memory (and free it) in the engine's format."""
+        if audio is None:
+            return None
+        from audio_engine import DecodedClip, pcm_to_float, convert
+        shm = shared_memory.SharedMemory(name=audio.shm_name)
+        try:
+            samples = pcm_to_float(bytes(shm.buf[:audio.nbytes]), audio.sample_width, audio.channels)
+        finally:
+            shm.close()
+            shm.unlink()
+        return DecodedClip(sample_rate, channels, convert(samples, audio.sample_rate, sample_rate, channels))
+
+    def cleanup(self):
+        super().cleanup()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        logging.info("Local TTS service cleanup complete.")
+
+
+# --- Fake Implementation (testing / benchmarks) ---
+class FakeTtsService(BaseTtsService):
+    """
+    Deterministic stand-in provider: no network, no audio device. Synthesis and
+    playback just sleep, and failures/latency spikes can be injected. With
+    tone_hz set, decode() renders a syllable-modulated tone of the clip's
+    duration so the audio engine can be exercised headless.
+    """
+    def __init__(self, config=None):
+        super().__init__(config)
+        self.synth_delay_s = float(self.config.get("synth_delay_s", 0.2))
+        self.synth_jitter_s = float(self.config.get("synth_jitter_s", 0.0))
+        self.synth_s_per_char = float(self.config.get("synth_s_per_char", 0.0)) # Longer texts take longer, like real providers
+        self.failure_rate = float(self.config.get("failure_rate", 0.0))
+        self.chars_per_s = float(self.config.get("chars_per_s", 15.0)) # Simulated speaking speed
+        self.play_delay_s = self.config.get("play_delay_s", None) # Fixed playback time, overrides chars_per_s
+        self.warm_up_s = float(self.config.get("warm_up_s", 0.0)) # Simulated credential check / connection setup
+        self.tone_hz = float(self.config.get("tone_hz", 0.0)) # 0 = no PCM, play() only
+        self.rng = random.Random(self.config.get("seed", 0))
+        self.rng_lock = threading.Lock()
+        self.synth_calls = 0
+
+    def warm_up(self):
+        time.sleep(self.warm_up_s)
+        if self.config.get("warm_up_fails"):
+            raise ConnectionError(f"{self.config.get('name', 'fake')}: injected warm-up failure")
+
+    def synthesize(self, text):
+        with self.rng_lock:
+            self.synth_calls += 1
+            delay = self.synth_delay_s + len(text) * self.synth_s_per_char + self.rng.uniform(0, self.synth_jitter_s)
+            fail = self.rng.random() < self.failure_rate
+        time.sleep(delay)
+        if fail:
+            raise ConnectionError(f"{self.config.get('name', 'fake')}: injected failure")
+        return text.encode("utf-8")
+
+    def duration_s(self, audio):
+        if not audio:
+            return None
+        return float(self.play_delay_s if self.play_delay_s is not None else len(audio) / self.chars_per_s)
+
+    def decode(self, audio, sample_rate, channels):
+        if not audio or not self.tone_hz:
+            return None
+        import numpy as np
+        from audio_engine import DecodedClip
+        t = np.arange(int(self.duration_s(audio) * sample_rate)) / sample_rate
+        samples = 0.3 * np.sin(2 * np.pi * self.tone_hz * t) * (0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)) # ~4 syllables/s
+        return DecodedClip(sample_rate, channels, np.repeat(samples.astype(np.float32)[:, None], channels, axis=1))
+
+    def play(self, audio):
+        if audio:
+            time.sleep(self.duration_s(audio))
+
+
+# --- Startup ---
+def start_warm_up(service: BaseTtsService, background=True):
+    """
+    Runs service.warm_up() and records the outcome for service.health().
+    background=True returns the started daemon thread immediately; otherwise
+    this blocks and re-raises a warm-up failure.
+    """
+    def run():
+        started = time.monotonic()
+        try:
+            service.warm_up()
+            logging.info(f"{service.__class__.__name__} ready after {(time.monotonic() - started) * 1000:.0f}ms.")
+        except Exception as e:
+            service.startup_error = str(e)
+            logging.error(f"{service.__class__.__name__} warm-up failed: {e}")
+            if not background:
+                raise
+        finally:
+            service.ready.set()
+
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name="tts-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
 # --- Factory Function ---
 def get_tts_service(provider_name, config):
     """
@@ -116,6 +557,26 @@ def get_tts_service(provider_name, config):
         if "api_key" not in el_config:
              el_config["api_key"] = os.getenv("ELEVENLABS_API_KEY") # Fallback to env var
         return ElevenLabsService(el_config)
+    elif provider_name == "fake":
+        logging.info("Creating FakeTtsService instance.")
+        return FakeTtsService(config.get("fake", {}))
+    elif provider_name == "failover":
+        logging.info("Creating FailoverTtsService instance.")
+        from tts_failover import FailoverTtsService # Imported here: tts_failover builds on this module
+        fo_config = config.get("failover", {})
+        providers = []
+        for name in fo_config.get("providers", []):
+            try:
+                providers.append((name, get_tts_service(name, config)))
+            except Exception as e:
+                # One provider failing to start shouldn't take the others down with it
+                logging.error(f"Failover: provider '{name}' failed to initialize, skipping. Error: {e}")
+        if not providers:
+            raise ValueError("Failover: no TTS provider could be initialized")
+        return FailoverTtsService(providers, fo_config)
+    elif provider_name == "local":
+        logging.info("Creating LocalTtsService instance.")
+        return LocalTtsService(config.get("local", {}))
     # Add elif for other providers here (e.g., 'google_tts')
     else:
         logging.error(f"Unsupported TTS provider: {provider_name}")
@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import logging
+
+# --- Queue Write-Ahead Log ---
+#
+#   scheduler.put() / drop / pipeline completion --append--> in-memory batch
+#        --(commit window)--> writer thread: one write() + fsync per batch
+#
+# Append-only JSON lines in numbered segment files. Two record kinds:
+#   {"op": "a", "id", "s", "at", "text", "author", "lane", "voice", "ch"}  accepted into a stream's queue
+#   {"op": "d", "id", "s", "at", "out"}                                    finished: played / failed / dropped / expired
+# "id" is the job's trace id (unique across restarts), "s" the stream id and
+# "at" the wall-clock time in seconds. A message whose "a" record has no
+# matching "d" record was never finished and is re-queued on the next start.
+#
+# Producers only append a tuple to a list; encoding, writing and fsync happen
+# on the writer thread, once per commit window (group commit). A crash loses
+# at most the last window of accepted messages.
+
+ACCEPTED = "a"
+DONE = "d"
+
+# Completion outcomes
+PLAYED = "played"
+FAILED = "failed"
+DROPPED = "dropped"
+EXPIRED = "expired"
+SUMMARIZED = "summarized" # Folded into a similar message by the backlog policy
+SKIPPED = "skipped" # Stale under backlog, never played
+
+SEGMENT_PREFIX = "wal-"
+SEGMENT_SUFFIX = ".log"
+
+
+def _segment_name(seq):
+    return f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}"
+
+
+def _encode(record):
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def read_records(directory):
+    """
+    Yields every record of every segment in log order. A torn last line (crash
+    mid-write) or any other undecodable line is skipped with a warning.
+    """
+    for name in list_segments(directory):
+        with open(os.path.join(directory, name), "rb") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logging.warning(f"Queue WAL: skipping unreadable record {name}:{line_no}")
+
+
+def list_segments(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(n for n in os.listdir(directory) if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX))
+
+
+class WalStream:
+    """The log as seen by one stream's scheduler: tags every record with the stream id."""
+    __slots__ = ("wal", "stream_id")
+
+    def __init__(self, wal, stream_id):
+        self.wal = wal
+        self.stream_id = stream_id
+
+    def accepted(self, job):
+        self.wal.append((ACCEPTED, self.stream_id, job))
+
+    def done(self, job, outcome):
+        self.wal.append((DONE, self.stream_id, job, outcome))
+
+
+class QueueWal:
+    """
+    Durable log of accepted TTS messages and their completion state.
+
+    open() reads the existing segments, compacts them into a fresh segment that
+    only holds unfinished messages and starts the writer thread. pending()
+    then returns what each stream should re-queue. A segment that grows past
+    segment_bytes is compacted the same way, so the log stays roughly
+    segment_bytes + the unfinished messages on disk.
+    """
+    def __init__(self, directory, commit_interval_s=0.02, segment_bytes=4 * 1024 * 1024, fsync=True):
+        self.directory = directory
+        self.commit_interval_s = max(0.0, float(commit_interval_s))
+        self.segment_bytes = int(segment_bytes)
+        self.fsync = fsync # False = leave flushing to the OS (tests / benchmarks only)
+        self._live = {}     # id -> accepted record not finished yet, in log order (writer thread only after open())
+        self._recovered = [] # Snapshot of _live taken by open()
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._closing = threading.Event()
+        self._compact_requested = False
+        self._thread = None
+        self._file = None
+        self._seq = 0
+        self._segment_size = 0
+
+        # --- Stats ---
+        self.records = 0
+        self.commits = 0
+        self.bytes_written = 0
+        self.compactions = 0
+        self.commit_max_s = 0.0
+        self.commit_total_s = 0.0
+        self.errors = 0
+
+    def stream(self, stream_id):
+        return WalStream(self, stream_id)
+
+    # --- Load & Recovery ---
+    def load(self):
+        """Rebuilds the set of unfinished messages from disk (no writer thread)."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._live = {}
+        for record in read_records(self.directory):
+            self._apply(record)
+        segments = list_segments(self.directory)
+        self._seq = int(segments[-1][len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) if segments else 0
+        self._recovered = list(self._live.values())
+        return self
+
+    def _apply(self, record):
+        if record.get("op") == ACCEPTED:
+            self._live[record["id"]] = record
+        elif record.get("op") == DONE:
+            self._live.pop(record.get("id"), None)
+
+    def open(self):
+        started = time.monotonic()
+        self.load()
+        self._compact()
+        self._thread = threading.Thread(target=self._run, name="queue-wal", daemon=True)
+        self._thread.start()
+        logging.info(f"Queue WAL: {len(self._recovered)} unfinished messages in {self.directory} "
+                     f"(loaded in {(time.monotonic() - started) * 1000:.0f}ms)")
+        return self
+
+    def pending(self, stream_id, max_age_s=0):
+        """
+        Unfinished messages of one stream, oldest first. Messages older than
+        max_age_s (0 = no limit) are marked expired instead of returned.
+        """
+        now = time.time()
+        fresh = []
+        for record in self._recovered:
+            if record.get("s") != stream_id:
+                continue
+            if max_age_s > 0 and now - record.get("at", 0) > max_age_s:
+                self.append((DONE, stream_id, record["id"], EXPIRED))
+            else:
+                fresh.append(record)
+        return fresh
+
+    # --- Producer Side ---
+    def append(self, entry):
+        """entry: (ACCEPTED, stream, job) or (DONE, stream, job_or_id, outcome). Never blocks on disk."""
+        with self._cond:
+            self._buffer.append((time.time(),) + entry)
+            self._cond.notify()
+
+    # --- Writer Thread ---
+    def _record(self, entry):
+        if entry[1] == ACCEPTED:
+            at, _, stream_id, job = entry
+            record = {"op": ACCEPTED, "id": job.trace_id, "s": stream_id, "at": round(at, 3), "text": job.text,
+                      "author": job.author, "lane": job.lane, "voice": job.voice_id, "ch": job.character}
+        else:
+            at, _, stream_id, job, outcome = entry
+            record = {"op": DONE, "id": getattr(job, "trace_id", job), "s": stream_id,
+                      "at": round(at, 3), "out": outcome}
+        return record
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._compact_requested and not self._closing.is_set():
+                    self._cond.wait()
+            if not self._closing.is_set() and self.commit_interval_s > 0:
+                self._closing.wait(self.commit_interval_s) # Let the group fill up
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+                compact, self._compact_requested = self._compact_requested, False
+            if batch:
+                self._commit(batch)
+            if compact or self._segment_size >= self.segment_bytes:
+                self._compact()
+            if self._closing.is_set():
+                with self._cond:
+                    if not self._buffer:
+                        break
+
+    def _commit(self, batch):
+        started = time.monotonic()
+        try:
+            records = [self._record(entry) for entry in batch]
+            data = b"".join(_encode(record) for record in records)
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except (OSError, ValueError, TypeError) as e:
+            self.errors += 1
+            logging.error(f"Queue WAL: failed to commit {len(batch)} records: {e}")
+            return
+        # Only records that reached the log count for compaction
+        for record in records:
+            self._apply(record)
+        elapsed = time.monotonic() - started
+        self.records += len(batch)
+        self.commits += 1
+        self.bytes_written += len(data)
+        self._segment_size += len(data)
+        self.commit_total_s += elapsed
+        self.commit_max_s = max(self.commit_max_s, elapsed)
+
+    # --- Compaction ---
+    def _compact(self):
+        """
+        Starts a new segment holding only the unfinished messages, then deletes
+        the older segments. A crash in between leaves both on disk, which
+        recovery handles: replaying a record twice is harmless.
+        """
+        old_segments = list_segments(self.directory)
+        self._seq += 1
+        path = os.path.join(self.directory, _segment_name(self._seq))
+        data = b"".join(_encode(record) for record in self._live.values())
+        new_file = open(path, "ab")
+        new_file.write(data)
+        new_file.flush()
+        if self.fsync:
+            os.fsync(new_file.fileno())
+        if self._file:
+            self._file.close()
+        self._file = new_file
+        self._segment_size = len(data)
+        for name in old_segments:
+            if name != _segment_name(self._seq):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    logging.warning(f"Queue WAL: could not remove old segment {name}: {e}")
+        self.compactions += 1
+        logging.debug(f"Queue WAL: compacted to {_segment_name(self._seq)} ({len(self._live)} unfinished messages)")
+
+    def compact(self):
+        """Compact now (on the writer thread when the log is open)."""
+        if self._thread is None:
+            self._compact()
+            self._file.close()
+            self._file = None
+            return
+        with self._cond:
+            self._compact_requested = True
+            self._cond.notify()
+
+    def close(self):
+        """Commits everything appended so far, then stops the writer thread."""
+        self._closing.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._file:
+            self._file.close()
+            self._file = None
+        logging.info(f"Queue WAL closed: {self.stats()}")
+
+    def stats(self):
+        return {
+            "records": self.records,
+            "commits": self.commits,
+            "records_per_commit": round(self.records / self.commits, 1) if self.commits else 0.0,
+            "commit_mean_ms": round(self.commit_total_s / self.commits * 1000, 2) if self.commits else 0.0,
+            "commit_max_ms": round(self.commit_max_s * 1000, 2),
+            "bytes_written": self.bytes_written,
+            "compactions": self.compactions,
+            "unfinished": len(self._live),
+            "errors": self.errors,
+        }
+
+
+# --- Offline Tool ---
+def to_trace(records, activation_phrase):
+    """
+    Accepted messages as a chat_load trace (benchmarks/chat_load.py JSONL format),
+    with offsets relative to the first message.
+    """
+    accepted = [r for r in records if r.get("op") == ACCEPTED]
+    start = accepted[0]["at"] if accepted else 0
+    return [{"t": round(r["at"] - start, 6), "author": r.get("author") or "Someone",
+             "message": f"{activation_phrase}{r['text']}", "superchat": r.get("lane") == "superchat",
+             "member": r.get("lane") == "member"} for r in accepted]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect, compact or export a TTS queue write-ahead log.")
+    parser.add_argument("directory", help="WAL directory (TTS_WAL_DIR)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Record counts and outcomes per stream")
+    sub.add_parser("pending", help="Print the unfinished messages that would be re-queued")
+    sub.add_parser("compact", help="Rewrite the log to only the unfinished messages (app must be stopped)")
+    export = sub.add_parser("export-trace", help="Write accepted messages as a replayable chat trace")
+    export.add_argument("out", help="Output JSONL, e.g. for benchmarks/bench_e2e_latency.py --trace")
+    export.add_argument("--phrase", default="faust says ", help="Activation phrase to prefix messages with")
+    args = parser.parse_args(argv)
+
+    if not list_segments(args.directory):
+        print(f"No WAL segments in {args.directory}")
+        return 1
+    if args.command == "stats":
+        per_stream = {}
+        for record in read_records(args.directory):
+            counts = per_stream.setdefault(record.get("s") or "default", {"accepted": 0})
+            key = "accepted" if record.get("op") == ACCEPTED else record.get("out", "done")
+            counts[key] = counts.get(key, 0) + 1
+        wal = QueueWal(args.directory).load()
+        print(json.dumps({"segments": list_segments(args.directory), "streams": per_stream,
+                          "unfinished": len(wal._recovered)}, indent=2))
+    elif args.command == "pending":
+        for record in QueueWal(args.directory).load()._recovered:
+            print(json.dumps(record, ensure_ascii=False))
+    elif args.command == "compact":
+        wal = QueueWal(args.directory).load()
+        wal.compact()
+        print(f"Compacted to {list_segments(args.directory)} ({len(wal._recovered)} unfinished messages)")
+    elif args.command == "export-trace":
+        trace = to_trace(read_records(args.directory), args.phrase)
+        with open(args.out, "w", encoding="utf-8") as f:
+            for message in trace:
+                f.write(json.dumps(message, ensure_ascii=False) + "\n")
+        print(f"Wrote {len(trace)} messages to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())